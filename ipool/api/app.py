@@ -9,11 +9,10 @@ from typing import List, Optional
 from ipool.config import settings
 from ipool.node.models import ProxyNodeResponse, ProxyNodeCreate, ProxyNodeUpdate, ProxyProtocol
 from ipool.node.repository import ProxyNodeRepository
-from ipool.scheduler.base import get_scheduler, set_scheduler
-from ipool.scheduler.random import RandomScheduler
-from ipool.scheduler.round_robin import RoundRobinScheduler
-from ipool.scheduler.health_first import HealthFirstScheduler
+from ipool.node.sync import registry_publisher
+from ipool.scheduler.base import get_scheduler, scheduler_factory, set_scheduler
 from ipool.health.checker import HealthChecker
+from ipool.health.history import health_history
 
 logger = logging.getLogger(__name__)
 
@@ -76,7 +75,8 @@ def register_routes(app: FastAPI):
         is_healthy: Optional[bool] = None,
         protocol: Optional[ProxyProtocol] = None,
         country: Optional[str] = None,
-        search: Optional[str] = None
+        search: Optional[str] = None,
+        tag: Optional[str] = None
     ):
         """获取代理节点列表"""
         return await ProxyNodeRepository.get_all(
@@ -86,7 +86,8 @@ def register_routes(app: FastAPI):
             is_healthy=is_healthy,
             protocol=protocol.value if protocol else None,
             country=country,
-            search=search
+            search=search,
+            tag=tag
         )
     
     @app.get("/api/nodes/{node_id}", response_model=ProxyNodeResponse)
@@ -123,16 +124,13 @@ def register_routes(app: FastAPI):
     @app.put("/api/scheduler")
     async def update_scheduler(scheduler_type: str):
         """更新调度策略"""
-        scheduler_map = {
-            "random": RandomScheduler,
-            "round_robin": RoundRobinScheduler,
-            "health_first": HealthFirstScheduler
-        }
-        
-        if scheduler_type not in scheduler_map:
+        factory = scheduler_factory(scheduler_type)
+        if factory is None:
             raise HTTPException(status_code=400, detail=f"不支持的调度器类型: {scheduler_type}")
         
-        scheduler = set_scheduler(scheduler_map[scheduler_type])
+        scheduler = set_scheduler(factory)
+        # 多进程模式下同时切换各工作进程的调度器
+        registry_publisher.publish_scheduler(scheduler_type)
         return {"name": scheduler.__class__.__name__}
     
     # == 统计信息 ==
@@ -140,7 +138,10 @@ def register_routes(app: FastAPI):
     @app.get("/api/stats")
     async def get_statistics():
         """获取代理池统计信息"""
-        return await ProxyNodeRepository.get_statistics()
+        stats = await ProxyNodeRepository.get_statistics()
+        # 健康检查滚动窗口内的成功率和延迟分位数
+        stats["health_history"] = health_history.summary()
+        return stats
     
     # == 手动触发健康检查 ==
     
@@ -148,5 +149,5 @@ def register_routes(app: FastAPI):
     async def trigger_health_check():
         """手动触发所有节点健康检查"""
         checker = HealthChecker()
-        await checker._check_all_proxies()
+        await checker.check_once()
         return {"status": "ok", "message": "健康检查已触发"}
@@ -12,6 +12,15 @@ class Settings(BaseSettings):
     http_proxy_port: int = 8080
     debug: bool = False
     secret_key: str = "changeme_use_strong_secret_key"
+    # 数据面工作进程数：1 为单进程模式；大于 1 时代理服务运行在多个工作进程中
+    # （SO_REUSEPORT 共享端口），API 和健康检查运行在控制进程中；0 表示按 CPU 核数
+    workers: int = 1
+    
+    # 事件循环与监听配置
+    event_loop: str = "auto"  # auto / uvloop / asyncio，auto 在安装了 uvloop 时使用 uvloop
+    # 代理端口的 listen backlog，同时也是每次可读事件中最多 accept 的连接数
+    # （标准 asyncio 按 backlog 批量 accept），实际上限受 net.core.somaxconn 限制
+    listen_backlog: int = 1024
     
     # 数据库配置
     db_host: str = "localhost"
@@ -35,6 +44,62 @@ class Settings(BaseSettings):
     health_check_interval: int = 300
     health_check_url: str = "https://www.google.com"
     health_check_timeout: int = 10
+    health_check_concurrency: int = 256  # 同时进行的检查数
+    health_check_dns_ttl: int = 300  # 检查会话的 DNS 缓存时间（秒）
+    # 单个节点检查间隔的自适应范围（秒）：状态变化的节点按最短间隔复查，
+    # 稳定健康的节点和持续失败的节点逐步放宽到最长间隔
+    health_check_min_interval: int = 30
+    health_check_max_interval: int = 1800
+    # 完整检查（经节点请求检查 URL）的间隔（秒），其余检查只做 TCP 连接和代理握手探测，
+    # 探测结果与节点当前状态不一致时立即完整检查确认；0 表示每次都完整检查
+    health_check_full_interval: int = 3600
+    health_check_write_batch: int = 500  # 检查结果每批写回的节点数
+    # 检查结果历史：每个节点在内存中保留的结果数、计算成功率和延迟分位数的滚动窗口（秒）、
+    # 写入 proxy_health_history 表的降采样时间段（秒）。
+    # 延迟只来自完整检查，窗口应远大于 health_check_full_interval（默认约 24 个延迟样本）
+    health_check_history_size: int = 128
+    health_check_history_window: int = 86400
+    health_check_history_bucket: int = 300
+    
+    # 上游代理连接配置
+    upstream_connect_timeout: float = 10.0  # 每次尝试的超时（秒）
+    connect_race_delay: float = 0.3  # 当前节点多久没有连通就并行尝试另一个节点（秒）
+    connect_max_attempts: int = 3  # 单个连接最多尝试的节点数
+    
+    # 隧道转发配置
+    relay_buffer_min: int = 16384  # 每个方向转发缓冲区的最小值（字节）
+    relay_buffer_max: int = 262144  # 每个方向转发缓冲区的最大值（字节）
+    relay_sndbuf: int = 0  # socket 发送缓冲区大小，0 表示使用系统自动调节
+    relay_rcvbuf: int = 0  # socket 接收缓冲区大小，0 表示使用系统自动调节
+    tcp_nodelay: bool = True  # 关闭 Nagle 算法，降低小包交互延迟
+    relay_splice: bool = True  # Linux 下明文 TCP 隧道使用 splice 零拷贝转发
+    
+    # HTTP 代理请求解析配置
+    http_parser: str = "auto"  # auto / httptools / h11 / python
+    http_max_header_size: int = 65536  # 请求头块的最大字节数
+    http_max_headers: int = 100  # 单个请求最多的请求头数量
+    http_expect_timeout: float = 1.0  # Expect: 100-continue 请求等待上游中间响应的秒数，超时后由代理回复 100 Continue
+    
+    # 上游连接池配置
+    pool_warm_size: int = 2  # 每个最近使用过的节点保持的预热连接数，0 表示不预热
+    pool_max_idle: int = 16  # 每个节点每种用途最多保留的 keep-alive 连接数
+    pool_idle_ttl: float = 30.0  # 空闲连接的最长保留时间（秒）
+    pool_maintain_interval: float = 10.0  # 清理空闲连接的间隔（秒）
+    
+    # 会话保持配置
+    session_ttl: int = 600  # 会话空闲多久后失效（秒）
+    session_table_size: int = 100000  # 最多记录的会话数
+    session_ring_replicas: int = 40  # 每个节点在哈希环上的虚拟节点数
+    session_load_factor: float = 1.25  # 有界负载系数，节点负载上限为平均值的倍数
+    
+    # 连接计数写回间隔（秒）
+    connection_flush_interval: float = 5.0
+    
+    # 请求结果反馈配置
+    feedback_flush_interval: float = 1.0  # 批量处理请求结果的间隔（秒）
+    feedback_batch_size: int = 512  # 积累到该条数时提前处理
+    feedback_max_pending: int = 100000  # 队列上限，超出后丢弃最旧的结果
+    feedback_rate_window: float = 300.0  # 计算节点成功率的滑动窗口（秒）
     
     # 日志配置
     log_level: str = "INFO"
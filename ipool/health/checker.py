@@ -1,26 +1,51 @@
 import asyncio
 import logging
 import time
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional
-
-import aiohttp
-from sqlalchemy import select, update
+from typing import AsyncIterator, List, Optional, Set, Tuple
 
 from ipool.config import settings
-from ipool.node.models import ProxyNode, HealthCheckResult
-from ipool.storage.database import get_session
+from ipool.health.engine import FAILED_RESPONSE_TIME, HealthCheckEngine
+from ipool.health.history import health_history
+from ipool.health.schedule import CheckSchedule
+from ipool.health.writer import HealthResultWriter, result_changes
+from ipool.node.models import HealthCheckResult
+from ipool.node.registry import NodeSnapshot, node_registry
 
 logger = logging.getLogger(__name__)
 
+# 没有节点到期时最长的等待时间（秒），也是感知新增节点的最大延迟
+IDLE_POLL_INTERVAL = 1.0
+
+# 检查结果和检查历史写回数据库的最长间隔（秒），批满时提前写回
+FLUSH_INTERVAL = 5.0
+
 
 class HealthChecker:
-    """代理健康状态检查器"""
+    """
+    代理健康状态检查器
+    
+    每个节点按 CheckSchedule 安排的时间单独检查，而不是每个周期集中检查一遍：
+    一个长期运行的 check_many 以固定数量的任务从时间表中按到期顺序取节点，
+    某个任务的检查一结束就取下一个到期节点，不必等待慢节点，检查负载在整个周期内均匀分布。
+    需要检查的节点集合来自进程内注册表中的活跃节点。
+    
+    检查分级进行：多数检查只做 TCP 连接和代理握手探测，完整检查按
+    health_check_full_interval 定期进行，或在探测结果与节点状态不一致时进行。
+    检查成功率（check_success_rate）和响应时间由 HealthHistory 的滚动窗口统计得出，而不是逐次加减；
+    success_rate 是请求结果反馈统计的实际流量成功率，检查器不写入。
+    """
     
     def __init__(self):
         self.check_url = settings.health_check_url
         self.check_interval = settings.health_check_interval
         self.timeout = settings.health_check_timeout
+        self.engine = HealthCheckEngine(self.check_url, self.timeout)
+        self.schedule = CheckSchedule(self.check_interval)
+        self.history = health_history
+        self.writer = HealthResultWriter()
+        self._registry_version: Optional[int] = None
+        # 已从时间表取出、尚未记录结果的节点
+        self._in_flight: Set[int] = set()
         self._running = False
         
     async def start(self):
@@ -29,119 +54,173 @@ class HealthChecker:
             return
             
         self._running = True
-        logger.info(f"健康检查服务启动，检查URL: {self.check_url}, 间隔: {self.check_interval}秒")
+        logger.info(f"健康检查服务启动，检查URL: {self.check_url}, 间隔: {self.schedule.min_interval}-"
+                    f"{self.schedule.max_interval}秒（初始 {self.check_interval}秒）, 并发数: {self.engine.concurrency}")
         
-        while self._running:
-            try:
-                # 检查所有活跃的代理
-                await self._check_all_proxies()
-                
-                # 等待下一次检查
-                await asyncio.sleep(self.check_interval)
-            except asyncio.CancelledError:
-                break
-            except Exception as e:
-                logger.error(f"健康检查过程中发生错误: {str(e)}", exc_info=True)
-                await asyncio.sleep(10)  # 出错后短暂暂停
+        await self.engine.start()
+        flusher = asyncio.create_task(self._flush_periodically())
+        try:
+            while self._running:
+                try:
+                    async for node, (result, full) in self.engine.check_many(self._due_nodes(), self._check_node):
+                        await self._handle_result(node, result, full, self.writer)
+                except asyncio.CancelledError:
+                    break
+                except Exception as e:
+                    logger.error(f"健康检查过程中发生错误: {str(e)}", exc_info=True)
+                    await asyncio.sleep(10)  # 出错后短暂暂停
+                finally:
+                    # 检查中途退出时，已取出但未记录结果的节点按原间隔重新安排
+                    for node_id in self._in_flight:
+                        self.schedule.postpone(node_id)
+                    self._in_flight.clear()
+        finally:
+            flusher.cancel()
+            await self.writer.flush()
+            await self.history.flush()
+            await self.engine.close()
     
     async def stop(self):
         """停止健康检查循环"""
         self._running = False
         logger.info("健康检查服务已停止")
     
+    async def check_once(self):
+        """不启动检查循环，只执行一轮检查（如手动触发）"""
+        await self.engine.start()
+        try:
+            await self._check_all_proxies()
+        finally:
+            await self.engine.close()
+    
+    async def _due_nodes(self) -> AsyncIterator[NodeSnapshot]:
+        """按时间表持续产出到期的活跃节点，没有节点到期时等待；stop() 之后结束"""
+        while self._running:
+            # 同步需要检查的节点，取出一个已到期的节点
+            self._sync_schedule()
+            node_ids = self.schedule.pop_due(1)
+            if not node_ids:
+                # 等待下一个节点到期，同时定期感知注册表中新增的节点
+                await asyncio.sleep(self._idle_delay())
+                continue
+            
+            node = node_registry.get(node_ids[0])
+            if node is None or not node.is_active:
+                # 已删除或停用的节点不再检查
+                self._forget(node_ids[0])
+                continue
+            self._in_flight.add(node.id)
+            yield node
+    
+    async def _flush_periodically(self):
+        """定期写回未满一批的检查结果和已结束时间段的检查历史"""
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            try:
+                await self.writer.flush()
+                await self.history.flush()
+            except Exception as e:
+                logger.error(f"写回健康检查结果时发生错误: {str(e)}", exc_info=True)
+    
+    def _sync_schedule(self):
+        """按注册表的变化增删时间表中的节点"""
+        if self._registry_version == node_registry.version:
+            return
+        registry_version = self._registry_version
+        self._registry_version = node_registry.version
+        changed = None if registry_version is None else node_registry.changed_since(registry_version)
+        
+        if changed is None:
+            # 首次启动或变更日志已被截断：全量比对，新节点的检查时间均匀分布在一个周期内
+            active = {node.id for node in node_registry.nodes() if node.is_active}
+            for node_id in self.schedule.node_ids():
+                if node_id not in active:
+                    self._forget(node_id)
+            self.schedule.add_spread(active)
+            return
+        
+        for node_id in changed:
+            node = node_registry.get(node_id)
+            if node is not None and node.is_active:
+                self.schedule.add(node_id)
+            else:
+                self._forget(node_id)
+    
+    def _forget(self, node_id: int):
+        """不再检查节点，并丢弃其检查历史"""
+        self.schedule.remove(node_id)
+        self.history.remove(node_id)
+    
+    def _idle_delay(self) -> float:
+        next_due = self.schedule.next_due()
+        if next_due is None:
+            return IDLE_POLL_INTERVAL
+        return min(max(next_due - time.monotonic(), 0), IDLE_POLL_INTERVAL)
+    
     async def _check_all_proxies(self):
         """检查所有代理的健康状态"""
-        async with get_session() as session:
-            # 获取所有活跃的代理节点
-            result = await session.execute(
-                select(ProxyNode).where(ProxyNode.is_active == True)
-            )
-            proxies = result.scalars().all()
-            
-            if not proxies:
-                logger.info("没有活跃的代理节点需要检查")
-                return
-            
-            # 并发检查所有代理
-            check_tasks = [self._check_proxy(proxy) for proxy in proxies]
-            results = await asyncio.gather(*check_tasks, return_exceptions=True)
-            
-            # 更新数据库
-            for proxy, result in zip(proxies, results):
-                if isinstance(result, Exception):
-                    logger.error(f"检查代理 {proxy.host}:{proxy.port} 时发生错误: {str(result)}")
-                    continue
-                    
-                try:
-                    # 更新代理状态
-                    proxy.is_healthy = result.success
-                    proxy.response_time = result.response_time if result.success else 10000
-                    proxy.last_check = datetime.utcnow()
-                    
-                    # 如果失败，降低成功率
-                    if not result.success:
-                        proxy.success_rate = max(0, proxy.success_rate - 5)
-                    else:
-                        # 如果成功，提高成功率，但不超过100
-                        proxy.success_rate = min(100, proxy.success_rate + 1)
-                        
-                    logger.debug(f"代理 {proxy.host}:{proxy.port} 健康检查: {'成功' if result.success else '失败'}, "
-                                f"响应时间: {result.response_time:.2f}ms, 成功率: {proxy.success_rate}%")
-                    
-                except Exception as e:
-                    logger.error(f"更新代理 {proxy.host}:{proxy.port} 状态时出错: {str(e)}")
-            
-            # 提交更改
-            await session.commit()
-            logger.info(f"完成 {len(proxies)} 个代理节点的健康检查")
+        # 获取所有活跃的代理节点
+        nodes = [node for node in node_registry.nodes() if node.is_active]
+        
+        if not nodes:
+            logger.info("没有活跃的代理节点需要检查")
+            return
+        
+        await self._check_nodes(nodes)
+        logger.info(f"完成 {len(nodes)} 个代理节点的健康检查")
     
-    async def _check_proxy(self, proxy: ProxyNode) -> HealthCheckResult:
-        """检查单个代理节点的健康状态"""
-        result = HealthCheckResult(success=False, response_time=10000)
+    async def _check_nodes(self, nodes: List[NodeSnapshot]):
+        """
+        检查给定的节点快照
         
-        # 构建代理URL
-        proxy_url = f"{proxy.protocol}://"
-        if proxy.username and proxy.password:
-            proxy_url += f"{proxy.username}:{proxy.password}@"
-        proxy_url += f"{proxy.host}:{proxy.port}"
+        结果按完成顺序依次更新注册表和检查时间表，并交给 HealthResultWriter 分批写回数据库，
+        不加载 ORM 对象，也不在整轮检查期间持有数据库会话。
+        """
+        writer = HealthResultWriter()
         
-        start_time = time.time()
-        try:
-            # 配置代理连接
-            async with aiohttp.ClientSession() as session:
-                # 使用代理请求目标URL
-                async with session.get(
-                    self.check_url,
-                    proxy=proxy_url,
-                    timeout=aiohttp.ClientTimeout(total=self.timeout),
-                    allow_redirects=True
-                ) as response:
-                    # 检查是否成功
-                    if response.status == 200:
-                        # 计算响应时间（毫秒）
-                        response_time = (time.time() - start_time) * 1000
-                        result = HealthCheckResult(
-                            success=True,
-                            response_time=response_time
-                        )
-                    else:
-                        result = HealthCheckResult(
-                            success=False,
-                            response_time=10000,
-                            error_message=f"HTTP状态码: {response.status}"
-                        )
-                        
-        except asyncio.TimeoutError:
-            result = HealthCheckResult(
-                success=False,
-                response_time=10000,
-                error_message="请求超时"
-            )
-        except Exception as e:
-            result = HealthCheckResult(
-                success=False,
-                response_time=10000,
-                error_message=str(e)
-            )
-            
-        return result
\ No newline at end of file
+        # 以有界并发检查所有代理，结果按完成顺序处理
+        async for node, (result, full) in self.engine.check_many(nodes, self._check_node):
+            await self._handle_result(node, result, full, writer)
+        
+        await writer.flush()
+        await self.history.flush()
+    
+    async def _handle_result(self, node: NodeSnapshot, result: HealthCheckResult, full: bool, writer: HealthResultWriter):
+        """记录一个节点的检查结果：更新检查历史、注册表和时间表，并交给 writer 写回"""
+        # 探测的耗时只包含握手，不计入延迟历史
+        stats = self.history.record(node.id, result.success, result.response_time if full else None)
+        check_success_rate = round(stats.success_rate, 2)
+        if not result.success:
+            response_time = FAILED_RESPONSE_TIME
+        elif stats.p50 is not None:
+            # 响应时间取窗口内的中位延迟，不受单次检查波动影响
+            response_time = stats.p50
+        else:
+            response_time = node.response_time
+        
+        changes = result_changes(node, result.success, response_time, check_success_rate)
+        node_registry.update_health(
+            node.id, result.success, response_time, check_success_rate,
+            (stats.p50, stats.p95, stats.p99)
+        )
+        self.schedule.record(node.id, result.success, full)
+        self._in_flight.discard(node.id)
+        
+        logger.debug(f"代理 {node.host}:{node.port} {'健康检查' if full else '握手探测'}: "
+                    f"{'成功' if result.success else '失败'}, "
+                    f"响应时间: {result.response_time:.2f}ms, 检查成功率: {check_success_rate}%")
+        await writer.add(node.id, changes)
+    
+    async def _check_node(self, node: NodeSnapshot) -> Tuple[HealthCheckResult, bool]:
+        """
+        分级检查单个节点，返回 (结果, 是否为完整检查)
+        
+        到了完整检查的时间才完整检查，否则只做握手探测；
+        探测结果与节点当前状态不一致时，再做一次完整检查确认。
+        """
+        if self.schedule.needs_full_check(node.id):
+            return await self.engine.check(node), True
+        result = await self.engine.probe(node)
+        if result.success == bool(node.is_healthy):
+            return result, False
+        return await self.engine.check(node), True
@@ -0,0 +1,243 @@
+"""
+健康检查引擎
+
+所有检查共用一个 aiohttp 会话（连接器复用到代理节点的连接并缓存 DNS 解析结果），
+检查目标 URL 只解析一次，SSL 上下文只创建一次；并发数由信号量限制，
+批量检查时结果按完成顺序逐个产出，内存占用与节点总数无关。
+
+检查分两级：probe() 只建立到检查目标的隧道（TCP 连接 + 代理协议握手），
+check() 经节点完整请求检查 URL。
+
+aiohttp 只支持 HTTP 代理，http 节点直接交给共享会话检查；https/socks 节点通过
+open_upstream 建立到目标的隧道后发送一个最小的 GET 请求。
+"""
+import asyncio
+import logging
+import ssl
+import time
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable, Optional, Tuple, Union
+from urllib.parse import urlparse
+
+import aiohttp
+
+from ipool.config import settings
+from ipool.node.models import HealthCheckResult, ProxyProtocol
+from ipool.protocols.parser import HttpParseError, parse_response_head
+from ipool.protocols.upstream import UpstreamError, format_authority, open_upstream
+
+logger = logging.getLogger(__name__)
+
+# 检查失败时记录的响应时间（毫秒）
+FAILED_RESPONSE_TIME = 10000
+
+
+class _CheckTarget:
+    """解析后的检查目标，所有检查共用"""
+    
+    __slots__ = ("url", "host", "port", "tls", "request")
+    
+    def __init__(self, url: str):
+        parsed = urlparse(url)
+        self.url = url
+        self.host = parsed.hostname
+        self.tls = parsed.scheme == "https"
+        self.port = parsed.port or (443 if self.tls else 80)
+        path = parsed.path or "/"
+        if parsed.query:
+            path += f"?{parsed.query}"
+        authority = parsed.hostname if parsed.port is None else format_authority(parsed.hostname, parsed.port)
+        self.request = (
+            f"GET {path} HTTP/1.1\r\n"
+            f"Host: {authority}\r\n"
+            "Accept: */*\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode("latin-1")
+
+
+class HealthCheckEngine:
+    """
+    共享连接器、有界并发的健康检查引擎
+    
+    使用前需要在事件循环中调用 start() 创建会话，停止时调用 close()。
+    """
+    
+    def __init__(self, check_url: str = None, timeout: float = None, concurrency: int = None):
+        self.target = _CheckTarget(check_url or settings.health_check_url)
+        self.timeout = timeout or settings.health_check_timeout
+        self.concurrency = concurrency or settings.health_check_concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._ssl_context: Optional[ssl.SSLContext] = None
+    
+    async def start(self):
+        """创建共享会话"""
+        if self._session is not None:
+            return
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._ssl_context = ssl.create_default_context()
+        connector = aiohttp.TCPConnector(
+            limit=self.concurrency,
+            ttl_dns_cache=settings.health_check_dns_ttl,
+            ssl=self._ssl_context
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+    
+    async def close(self):
+        """关闭共享会话"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+    
+    async def check(self, proxy) -> HealthCheckResult:
+        """完整检查单个代理节点：经节点请求检查 URL，异常都转换为失败结果"""
+        if getattr(proxy.protocol, "value", proxy.protocol) == ProxyProtocol.HTTP:
+            return await self._run(proxy, self._check_http)
+        return await self._run(proxy, self._check_tunnel)
+    
+    async def probe(self, proxy) -> HealthCheckResult:
+        """
+        轻量探测单个代理节点：TCP 连接加代理协议握手（SOCKS 握手或 HTTP CONNECT），
+        隧道建立后立即关闭，不与目标进行 TLS 握手，也不发送 HTTP 请求
+        """
+        return await self._run(proxy, self._probe_tunnel)
+    
+    async def _run(self, proxy, check: Callable[[object], Awaitable[Optional[str]]]) -> HealthCheckResult:
+        """在并发限制和超时内执行一次检查，异常都转换为失败结果"""
+        async with self._semaphore:
+            start_time = time.time()
+            try:
+                error = await asyncio.wait_for(check(proxy), self.timeout)
+            except asyncio.TimeoutError:
+                error = "请求超时"
+            except (UpstreamError, aiohttp.ClientError, HttpParseError, OSError, ssl.SSLError) as e:
+                error = str(e) or e.__class__.__name__
+            except Exception as e:
+                logger.debug(f"检查代理 {proxy.host}:{proxy.port} 时发生错误: {str(e)}", exc_info=True)
+                error = str(e) or e.__class__.__name__
+        
+        if error is not None:
+            return HealthCheckResult(success=False, response_time=FAILED_RESPONSE_TIME, error_message=error)
+        return HealthCheckResult(success=True, response_time=(time.time() - start_time) * 1000)
+    
+    async def check_many(
+        self,
+        proxies: Union[Iterable, AsyncIterable],
+        check: Optional[Callable[[object], Awaitable[object]]] = None
+    ) -> AsyncIterator[Tuple[object, object]]:
+        """
+        批量检查，按完成顺序产出 (节点, 结果)
+        
+        固定数量的任务从 proxies 中依次取节点，不会一次为所有节点创建任务；
+        调用方消费得慢时任务随之等待。proxies 也可以是异步迭代器（如按时间表
+        持续产出到期节点的生成器），此时 check_many 一直运行到它结束。
+        check 为对单个节点的检查函数（不得抛出异常），默认为 check()。
+        """
+        check = check or self.check
+        take = _taker(proxies)
+        results: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency)
+        done = object()
+        
+        async def worker():
+            # check 不会抛出异常，每个任务最后都会放入结束标记
+            while True:
+                try:
+                    proxy = await take()
+                except StopAsyncIteration:
+                    break
+                await results.put((proxy, await check(proxy)))
+            await results.put(done)
+        
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            running = len(workers)
+            while running:
+                item = await results.get()
+                if item is done:
+                    running -= 1
+                    continue
+                yield item
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            aclose = getattr(proxies, "aclose", None)
+            if aclose is not None:
+                await aclose()
+    
+    async def _check_http(self, proxy) -> Optional[str]:
+        """通过共享会话经 HTTP 代理节点请求检查 URL，返回失败原因"""
+        proxy_auth = None
+        if proxy.username:
+            proxy_auth = aiohttp.BasicAuth(proxy.username, proxy.password or "")
+        async with self._session.get(
+            self.target.url,
+            proxy=f"http://{format_authority(proxy.host, proxy.port)}",
+            proxy_auth=proxy_auth,
+            allow_redirects=True
+        ) as response:
+            if response.status != 200:
+                return f"HTTP状态码: {response.status}"
+        return None
+    
+    async def _check_tunnel(self, proxy) -> Optional[str]:
+        """经隧道请求检查 URL，返回失败原因；不跟随重定向，2xx/3xx 即说明目标可达"""
+        target = self.target
+        reader, writer = await open_upstream(proxy, target.host, target.port, self.timeout, reuse=False)
+        try:
+            if target.tls:
+                writer = await _start_tls(reader, writer, self._ssl_context, target.host)
+            writer.write(target.request)
+            await writer.drain()
+            response = parse_response_head(await reader.readuntil(b"\r\n\r\n"))
+        finally:
+            writer.close()
+        if response.status >= 400:
+            return f"HTTP状态码: {response.status}"
+        return None
+    
+    async def _probe_tunnel(self, proxy) -> Optional[str]:
+        """建立到检查目标的隧道后立即关闭"""
+        target = self.target
+        _, writer = await open_upstream(proxy, target.host, target.port, self.timeout, reuse=False)
+        writer.close()
+        return None
+
+
+def _taker(proxies: Union[Iterable, AsyncIterable]) -> Callable[[], Awaitable[object]]:
+    """
+    返回依次取出下一个节点的协程函数，取完时抛出 StopAsyncIteration
+    异步迭代器由多个任务共享，同一时刻只能有一个任务在其中等待，需要加锁
+    """
+    if hasattr(proxies, "__aiter__"):
+        iterator = proxies.__aiter__()
+        lock = asyncio.Lock()
+        
+        async def take_async():
+            async with lock:
+                return await iterator.__anext__()
+        
+        return take_async
+    
+    iterator = iter(proxies)
+    
+    async def take():
+        try:
+            return next(iterator)
+        except StopIteration:
+            raise StopAsyncIteration from None
+    
+    return take
+
+
+async def _start_tls(reader, writer, ssl_context: ssl.SSLContext, server_hostname: str) -> asyncio.StreamWriter:
+    """在已建立的隧道上与目标完成 TLS 握手（StreamWriter.start_tls 需要 Python 3.11）"""
+    if hasattr(writer, "start_tls"):
+        await writer.start_tls(ssl_context, server_hostname=server_hostname)
+        return writer
+    loop = asyncio.get_running_loop()
+    protocol = writer.transport.get_protocol()
+    transport = await loop.start_tls(writer.transport, protocol, ssl_context, server_hostname=server_hostname)
+    return asyncio.StreamWriter(transport, protocol, reader, loop)
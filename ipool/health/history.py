@@ -0,0 +1,315 @@
+"""
+健康检查结果历史
+
+每个节点在内存中保留最近 health_check_history_size 次检查结果的环形缓冲区，
+从中计算 health_check_history_window 秒内的成功率和 p50/p95/p99 延迟；
+延迟只取成功的完整检查（握手探测的耗时与完整请求不可比），单独保存在另一个
+同样大小的环形缓冲区中，不会被频繁的探测结果挤出。完整检查每 health_check_full_interval
+秒才有一次，窗口应远大于该间隔，分位数才有足够的样本。
+
+同时按 health_check_history_bucket 秒为一段对结果降采样，每个节点每段一行
+（检查次数、成功次数、延迟样本数和段内延迟分位数），段结束后批量写入 proxy_health_history 表；
+启动时从该表读取窗口内的记录恢复各节点的历史。
+"""
+import logging
+import math
+import time
+from array import array
+from datetime import datetime, timezone
+from typing import Dict, List, NamedTuple, Optional
+
+from sqlalchemy import insert, select
+
+from ipool.config import settings
+from ipool.node.models import ProxyHealthHistory
+from ipool.node.registry import node_registry
+from ipool.storage.database import get_session
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryStats(NamedTuple):
+    """节点在滚动窗口内的检查统计"""
+    samples: int
+    success_rate: float  # 百分比
+    p50: Optional[float]  # 毫秒，窗口内没有成功的完整检查时为 None
+    p95: Optional[float]
+    p99: Optional[float]
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """已排序序列的分位数（最近秩法）"""
+    index = max(0, math.ceil(q / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+class _Ring:
+    """单个节点的检查结果和延迟样本环形缓冲区"""
+    
+    __slots__ = ("times", "successes", "next", "count",
+                 "latency_times", "latencies", "latency_next", "latency_count")
+    
+    def __init__(self, size: int):
+        self.times = array("d", bytes(8 * size))
+        self.successes = bytearray(size)
+        self.next = 0
+        self.count = 0
+        self.latency_times = array("d", bytes(8 * size))
+        self.latencies = array("d", bytes(8 * size))
+        self.latency_next = 0
+        self.latency_count = 0
+    
+    def append(self, timestamp: float, success: bool):
+        i = self.next
+        self.times[i] = timestamp
+        self.successes[i] = success
+        self.next = (i + 1) % len(self.successes)
+        self.count = min(self.count + 1, len(self.successes))
+    
+    def append_latency(self, timestamp: float, latency: float):
+        i = self.latency_next
+        self.latency_times[i] = timestamp
+        self.latencies[i] = latency
+        self.latency_next = (i + 1) % len(self.latencies)
+        self.latency_count = min(self.latency_count + 1, len(self.latencies))
+    
+    def stats(self, since: float) -> HistoryStats:
+        size = len(self.successes)
+        samples = successes = 0
+        # 从新到旧遍历，遇到窗口外的样本即可停止
+        for k in range(self.count):
+            i = (self.next - 1 - k) % size
+            if self.times[i] < since:
+                break
+            samples += 1
+            successes += self.successes[i]
+        latencies = []
+        for k in range(self.latency_count):
+            i = (self.latency_next - 1 - k) % size
+            if self.latency_times[i] < since:
+                break
+            latencies.append(self.latencies[i])
+        return _summarize(samples, successes, latencies)
+
+
+class _Bucket:
+    """单个节点当前降采样时间段的累计值"""
+    
+    __slots__ = ("start", "checks", "successes", "latencies")
+    
+    def __init__(self, start: int):
+        self.start = start
+        self.checks = 0
+        self.successes = 0
+        self.latencies: List[float] = []
+
+
+def _summarize(samples: int, successes: int, latencies: List[float]) -> HistoryStats:
+    if not samples:
+        return HistoryStats(0, 0.0, None, None, None)
+    success_rate = successes * 100 / samples
+    if not latencies:
+        return HistoryStats(samples, success_rate, None, None, None)
+    latencies.sort()
+    return HistoryStats(
+        samples,
+        success_rate,
+        percentile(latencies, 50),
+        percentile(latencies, 95),
+        percentile(latencies, 99),
+    )
+
+
+class HealthHistory:
+    """
+    健康检查结果历史存储
+    
+    由健康检查器在事件循环线程中写入，不需要加锁；统计结果按节点缓存，
+    节点有新结果时重新计算（只涉及该节点的环形缓冲区）。
+    """
+    
+    def __init__(self, size: int = None, window: float = None, bucket: float = None):
+        self.size = size or settings.health_check_history_size
+        self.window = window or settings.health_check_history_window
+        self.bucket = bucket or settings.health_check_history_bucket
+        self._rings: Dict[int, _Ring] = {}
+        self._stats: Dict[int, HistoryStats] = {}
+        self._buckets: Dict[int, _Bucket] = {}
+        # 已结束、等待写入数据库的降采样行
+        self._rows: List[dict] = []
+        self._next_rollover = self._bucket_start(time.time()) + self.bucket
+    
+    def __len__(self) -> int:
+        return len(self._rings)
+    
+    def record(self, node_id: int, success: bool, latency: Optional[float] = None) -> HistoryStats:
+        """
+        记录一次检查结果，返回节点更新后的窗口统计
+        latency 为成功的完整检查的耗时（毫秒），探测或失败时为 None
+        """
+        now = time.time()
+        if not success:
+            latency = None
+        
+        ring = self._rings.get(node_id)
+        if ring is None:
+            ring = self._rings[node_id] = _Ring(self.size)
+        ring.append(now, success)
+        if latency is not None:
+            ring.append_latency(now, latency)
+        
+        start = self._bucket_start(now)
+        bucket = self._buckets.get(node_id)
+        if bucket is None or bucket.start != start:
+            if bucket is not None:
+                self._close(node_id, bucket)
+            bucket = self._buckets[node_id] = _Bucket(start)
+        bucket.checks += 1
+        bucket.successes += success
+        if latency is not None:
+            bucket.latencies.append(latency)
+        
+        stats = self._stats[node_id] = ring.stats(now - self.window)
+        return stats
+    
+    def stats(self, node_id: int) -> Optional[HistoryStats]:
+        """节点最近一次记录时的窗口统计，没有历史时返回 None"""
+        return self._stats.get(node_id)
+    
+    def remove(self, node_id: int):
+        """丢弃节点的历史（当前时间段的累计值仍会写入数据库）"""
+        self._rings.pop(node_id, None)
+        self._stats.pop(node_id, None)
+        bucket = self._buckets.pop(node_id, None)
+        if bucket is not None:
+            self._close(node_id, bucket)
+    
+    def summary(self) -> dict:
+        """
+        全池统计：各节点窗口样本合计的成功率，以及节点中位延迟的 p50/p95/p99
+        （即典型节点、较慢的 5% 和 1% 节点的延迟）
+        """
+        samples = successes = 0
+        medians = []
+        for stats in self._stats.values():
+            samples += stats.samples
+            successes += stats.success_rate * stats.samples / 100
+            if stats.p50 is not None:
+                medians.append(stats.p50)
+        result = _summarize(samples, round(successes), medians)
+        return {
+            "nodes": len(self._stats),
+            "window": self.window,
+            "samples": result.samples,
+            "success_rate": round(result.success_rate, 2),
+            "latency_p50": _round(result.p50),
+            "latency_p95": _round(result.p95),
+            "latency_p99": _round(result.p99),
+        }
+    
+    async def load(self) -> int:
+        """
+        从 proxy_health_history 表恢复窗口内的历史，并把延迟分位数写入注册表，返回恢复的节点数
+        
+        表中只有按时间段降采样的结果：每段的检查记为段起始时刻的 checks 次结果，
+        延迟样本按段内分位数近似还原。只恢复注册表中存在的节点，需在注册表加载之后调用。
+        """
+        now = time.time()
+        table = ProxyHealthHistory.__table__
+        stmt = (
+            select(table.c.node_id, table.c.bucket_start, table.c.checks, table.c.successes,
+                   table.c.latency_samples, table.c.latency_p50, table.c.latency_p95, table.c.latency_p99)
+            .where(table.c.bucket_start >= datetime.utcfromtimestamp(now - self.window))
+            .order_by(table.c.node_id, table.c.bucket_start)
+        )
+        try:
+            async with get_session() as session:
+                rows = (await session.execute(stmt)).all()
+        except Exception as e:
+            logger.error(f"加载健康检查历史失败: {str(e)}")
+            return 0
+        
+        loaded = set()
+        for row in rows:
+            if node_registry.get(row.node_id) is None:
+                continue
+            ring = self._rings.get(row.node_id)
+            if ring is None:
+                ring = self._rings[row.node_id] = _Ring(self.size)
+            timestamp = row.bucket_start.replace(tzinfo=timezone.utc).timestamp()
+            # 环形缓冲区只保留最近 size 个结果，更多的样本不必还原
+            checks = min(row.checks, self.size)
+            successes = min(row.successes, checks)
+            for k in range(checks):
+                ring.append(timestamp, k < successes)
+            if row.latency_p50 is not None:
+                samples = min(row.latency_samples or 1, self.size)
+                for k in range(1, samples + 1):
+                    ring.append_latency(timestamp, _approximate(row, k * 100 / samples))
+            loaded.add(row.node_id)
+        
+        for node_id in loaded:
+            stats = self._stats[node_id] = self._rings[node_id].stats(now - self.window)
+            node = node_registry.get(node_id)
+            node_registry.update_health(
+                node_id, node.is_healthy, node.response_time, round(stats.success_rate, 2),
+                (stats.p50, stats.p95, stats.p99)
+            )
+        logger.info(f"已从 {len(rows)} 条健康检查历史恢复 {len(loaded)} 个节点的统计")
+        return len(loaded)
+    
+    async def flush(self):
+        """把已结束的时间段批量写入数据库"""
+        now = time.time()
+        if now >= self._next_rollover:
+            # 长时间没有新结果的节点，其时间段在这里结束
+            current = self._bucket_start(now)
+            for node_id, bucket in list(self._buckets.items()):
+                if bucket.start < current:
+                    self._close(node_id, self._buckets.pop(node_id))
+            self._next_rollover = current + self.bucket
+        
+        if not self._rows:
+            return
+        rows, self._rows = self._rows, []
+        try:
+            async with get_session() as session:
+                await session.execute(insert(ProxyHealthHistory.__table__), rows)
+                await session.commit()
+        except Exception as e:
+            logger.error(f"写入 {len(rows)} 条健康检查历史失败: {str(e)}")
+            return
+        logger.debug(f"已写入 {len(rows)} 条健康检查历史")
+    
+    def _bucket_start(self, timestamp: float) -> int:
+        return int(timestamp // self.bucket * self.bucket)
+    
+    def _close(self, node_id: int, bucket: _Bucket):
+        stats = _summarize(bucket.checks, bucket.successes, bucket.latencies)
+        self._rows.append({
+            "node_id": node_id,
+            "bucket_start": datetime.utcfromtimestamp(bucket.start),
+            "checks": bucket.checks,
+            "successes": bucket.successes,
+            "latency_samples": len(bucket.latencies),
+            "latency_p50": stats.p50,
+            "latency_p95": stats.p95,
+            "latency_p99": stats.p99,
+        })
+
+
+def _approximate(row, q: float) -> float:
+    """用时间段的 p50/p95/p99 近似第 q 百分位的延迟样本"""
+    if q <= 50:
+        return row.latency_p50
+    if q <= 95:
+        return row.latency_p95 if row.latency_p95 is not None else row.latency_p50
+    return row.latency_p99 if row.latency_p99 is not None else row.latency_p50
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return None if value is None else round(value, 2)
+
+
+# 全局健康检查历史实例（控制进程使用）
+health_history = HealthHistory()
@@ -0,0 +1,174 @@
+"""
+按节点安排健康检查时间
+
+每个节点有自己的下次检查时间，保存在一个最小堆中；检查循环只取出已到期的节点，
+检查负载在整个周期内均匀分布。检查间隔随节点状态自适应：
+- 稳定健康的节点每次成功后间隔乘以 STABLE_GROWTH，最长 health_check_max_interval；
+- 状态刚发生变化（恢复或首次失败）的节点以 health_check_min_interval 尽快复查，
+  反复波动的节点因此一直保持较短的间隔；
+- 持续失败的节点按指数退避，间隔每次翻倍，最长 health_check_max_interval。
+
+另外记录每个节点上次完整检查的时间：两次完整检查之间的检查只做轻量探测，
+距上次完整检查超过 health_check_full_interval 时才再次完整检查。
+"""
+import heapq
+import random
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from ipool.config import settings
+
+# 稳定健康的节点每次成功后检查间隔的增长倍数
+STABLE_GROWTH = 1.5
+
+# 持续失败的节点每次失败后检查间隔的增长倍数
+FAILURE_BACKOFF = 2.0
+
+# 检查时间的随机抖动比例，避免节点重新集中到同一时刻
+JITTER = 0.1
+
+
+class _NodeState:
+    """单个节点的检查状态"""
+    
+    __slots__ = ("due", "interval", "healthy", "failures", "last_full")
+    
+    def __init__(self, due: float, interval: float):
+        self.due = due
+        self.interval = interval
+        # 最近一次检查结果，尚未检查时为 None
+        self.healthy: Optional[bool] = None
+        self.failures = 0
+        # 上次完整检查的时间，尚未完整检查时为 None
+        self.last_full: Optional[float] = None
+
+
+class CheckSchedule:
+    """
+    健康检查时间表
+    
+    堆中的条目为 (到期时间, 节点ID)，节点重新安排或被移除后旧条目不立即删除，
+    出堆时与 _states 中的到期时间比对后丢弃（惰性删除）。时间使用 time.monotonic()。
+    """
+    
+    def __init__(
+        self,
+        interval: float = None,
+        min_interval: float = None,
+        max_interval: float = None,
+        full_interval: float = None
+    ):
+        self.interval = interval or settings.health_check_interval
+        self.min_interval = min(min_interval or settings.health_check_min_interval, self.interval)
+        self.max_interval = max(max_interval or settings.health_check_max_interval, self.interval)
+        # 完整检查的间隔，0 表示每次都完整检查
+        self.full_interval = settings.health_check_full_interval if full_interval is None else full_interval
+        self._states: Dict[int, _NodeState] = {}
+        self._heap: List[Tuple[float, int]] = []
+    
+    def __len__(self) -> int:
+        return len(self._states)
+    
+    def __contains__(self, node_id: int) -> bool:
+        return node_id in self._states
+    
+    def node_ids(self) -> List[int]:
+        """所有已安排的节点ID"""
+        return list(self._states)
+    
+    def add_spread(self, node_ids: Iterable[int]):
+        """批量加入节点，首次检查时间均匀分布在一个检查周期内"""
+        node_ids = [node_id for node_id in node_ids if node_id not in self._states]
+        if not node_ids:
+            return
+        now = time.monotonic()
+        step = self.interval / len(node_ids)
+        for i, node_id in enumerate(node_ids):
+            self._schedule(node_id, _NodeState(now + i * step, self.interval))
+    
+    def add(self, node_id: int):
+        """加入新节点，在最短间隔内尽快检查"""
+        if node_id in self._states:
+            return
+        due = time.monotonic() + random.uniform(0, self.min_interval)
+        self._schedule(node_id, _NodeState(due, self.interval))
+    
+    def remove(self, node_id: int):
+        """移除节点（堆中的旧条目出堆时丢弃）"""
+        self._states.pop(node_id, None)
+    
+    def clear(self):
+        self._states.clear()
+        self._heap.clear()
+    
+    def next_due(self) -> Optional[float]:
+        """最早的到期时间，没有节点时返回 None"""
+        self._discard_stale()
+        return self._heap[0][0] if self._heap else None
+    
+    def pop_due(self, limit: int) -> List[int]:
+        """取出最多 limit 个已到期的节点，取出的节点在 record() 之前不会再次到期"""
+        now = time.monotonic()
+        due = []
+        while len(due) < limit:
+            self._discard_stale()
+            if not self._heap or self._heap[0][0] > now:
+                break
+            _, node_id = heapq.heappop(self._heap)
+            self._states[node_id].due = float("inf")
+            due.append(node_id)
+        return due
+    
+    def needs_full_check(self, node_id: int) -> bool:
+        """节点的下一次检查是否应为完整检查（不在时间表中的节点总是完整检查）"""
+        state = self._states.get(node_id)
+        if state is None or state.last_full is None or self.full_interval <= 0:
+            return True
+        return time.monotonic() - state.last_full >= self.full_interval
+    
+    def record(self, node_id: int, healthy: bool, full: bool = True):
+        """记录检查结果并安排下一次检查，full 表示本次是否为完整检查"""
+        state = self._states.get(node_id)
+        if state is None:
+            return
+        if full:
+            state.last_full = time.monotonic()
+        changed = state.healthy is not None and state.healthy != healthy
+        if healthy:
+            state.failures = 0
+            state.interval = self.min_interval if changed else min(state.interval * STABLE_GROWTH, self.max_interval)
+        else:
+            state.failures += 1
+            if state.failures == 1:
+                state.interval = self.min_interval
+            else:
+                state.interval = min(state.interval * FAILURE_BACKOFF, self.max_interval)
+        state.healthy = healthy
+        state.due = time.monotonic() + state.interval * random.uniform(1 - JITTER, 1 + JITTER)
+        self._schedule(node_id, state)
+    
+    def postpone(self, node_id: int):
+        """检查未能完成时按当前间隔重新安排，不改变节点状态"""
+        state = self._states.get(node_id)
+        if state is None or state.due != float("inf"):
+            return
+        state.due = time.monotonic() + state.interval * random.uniform(1 - JITTER, 1 + JITTER)
+        self._schedule(node_id, state)
+    
+    def interval_of(self, node_id: int) -> Optional[float]:
+        """节点当前的检查间隔（秒）"""
+        state = self._states.get(node_id)
+        return state.interval if state is not None else None
+    
+    def _schedule(self, node_id: int, state: _NodeState):
+        self._states[node_id] = state
+        heapq.heappush(self._heap, (state.due, node_id))
+    
+    def _discard_stale(self):
+        heap = self._heap
+        while heap:
+            due, node_id = heap[0]
+            state = self._states.get(node_id)
+            if state is not None and state.due == due:
+                return
+            heapq.heappop(heap)
@@ -0,0 +1,132 @@
+"""
+健康检查结果的批量写回
+
+检查结果按完成顺序逐条加入，积累到 health_check_write_batch 个节点时在一个短事务中
+以批量 UPDATE（executemany）写回；每个节点只写发生变化的列，变化列相同的节点
+共用一条语句。内存占用和事务时长只与批大小有关，与节点总数无关。
+
+变化列是与已更新的注册表快照比较得出的，写回失败的批次不会被下一次检查重新发现，
+因此放回待写队列（同一节点的新结果覆盖旧值），最多尝试 MAX_WRITE_ATTEMPTS 次。
+"""
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+
+from sqlalchemy import bindparam, update
+
+from ipool.config import settings
+from ipool.node.models import ProxyNode
+from ipool.storage.database import get_session
+
+logger = logging.getLogger(__name__)
+
+# 健康检查写回的列
+WRITE_COLUMNS = ("is_healthy", "response_time", "check_success_rate", "last_check")
+
+# 一个节点的结果最多尝试写回的次数
+MAX_WRITE_ATTEMPTS = 10
+
+# 写回失败后，批满不再立即重试，至少等待的时间（秒）；显式调用 flush() 不受限制
+RETRY_DELAY = 5.0
+
+
+class HealthResultWriter:
+    """健康检查结果的批量写回器"""
+    
+    def __init__(self, batch_size: int = None):
+        self.batch_size = batch_size or settings.health_check_write_batch
+        # 节点ID -> 待写回的变化列（按加入顺序）
+        self._pending: Dict[int, Dict[str, Any]] = {}
+        # 节点ID -> 已失败的写回次数
+        self._attempts: Dict[int, int] = {}
+        self._retry_at = 0.0
+        # 已写回的节点数
+        self.written = 0
+        # 多次写回失败后放弃的节点数
+        self.dropped = 0
+    
+    def __len__(self) -> int:
+        return len(self._pending)
+    
+    async def add(self, node_id: int, changes: Dict[str, Any]):
+        """加入一个节点的变化列（与尚未写回的旧值合并），批满时写回"""
+        pending = self._pending.get(node_id)
+        if pending is None:
+            self._pending[node_id] = dict(changes)
+        else:
+            pending.update(changes)
+        if len(self._pending) >= self.batch_size and time.monotonic() >= self._retry_at:
+            await self.flush()
+    
+    async def flush(self):
+        """写回积累的结果"""
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        
+        # 按变化列分组，每组一条 executemany 语句
+        groups: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+        for node_id, changes in batch.items():
+            columns = tuple(column for column in WRITE_COLUMNS if column in changes)
+            params = {"node_id": node_id}
+            for column in columns:
+                params[f"new_{column}"] = changes[column]
+            groups.setdefault(columns, []).append(params)
+        
+        table = ProxyNode.__table__
+        try:
+            async with get_session() as session:
+                for columns, params in groups.items():
+                    values = {column: bindparam(f"new_{column}") for column in columns}
+                    stmt = (
+                        update(table)
+                        .where(table.c.id == bindparam("node_id"))
+                        .values(
+                            **values,
+                            # 检查结果不算作节点信息变更，保持 updated_at 不变
+                            updated_at=table.c.updated_at,
+                        )
+                    )
+                    await session.execute(stmt, params)
+                await session.commit()
+        except Exception as e:
+            logger.error(f"写回 {len(batch)} 个节点的健康检查结果失败: {str(e)}")
+            self._requeue(batch)
+            return
+        
+        for node_id in batch:
+            self._attempts.pop(node_id, None)
+        self.written += len(batch)
+        logger.debug(f"已写回 {len(batch)} 个节点的健康检查结果")
+    
+    def _requeue(self, batch: Dict[int, Dict[str, Any]]):
+        """把写回失败的结果放回待写队列，写回期间加入的新结果优先"""
+        self._retry_at = time.monotonic() + RETRY_DELAY
+        dropped = 0
+        for node_id, changes in batch.items():
+            attempts = self._attempts.get(node_id, 0) + 1
+            if attempts >= MAX_WRITE_ATTEMPTS:
+                self._attempts.pop(node_id, None)
+                dropped += 1
+                continue
+            self._attempts[node_id] = attempts
+            newer = self._pending.get(node_id)
+            if newer is not None:
+                changes.update(newer)
+            self._pending[node_id] = changes
+        if dropped:
+            self.dropped += dropped
+            logger.error(f"{dropped} 个节点的健康检查结果多次写回失败，已放弃")
+
+
+def result_changes(node, is_healthy: bool, response_time: float, check_success_rate: float) -> Dict[str, Any]:
+    """与节点当前值比较，返回需要写回的列（last_check 总是写回）"""
+    changes: Dict[str, Any] = {"last_check": datetime.utcnow()}
+    if node.is_healthy != is_healthy:
+        changes["is_healthy"] = is_healthy
+    if node.response_time != response_time:
+        changes["response_time"] = response_time
+    if node.check_success_rate != check_success_rate:
+        changes["check_success_rate"] = check_success_rate
+    return changes
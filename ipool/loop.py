@@ -0,0 +1,36 @@
+"""
+事件循环后端选择
+
+event_loop 为 auto 时，安装了 uvloop 就使用 uvloop（基于 libuv，TCP 收发和
+accept 的开销明显低于标准实现），否则使用标准 asyncio 事件循环。
+install_event_loop() 必须在 asyncio.run 之前调用，每个进程各调用一次。
+"""
+import asyncio
+import logging
+
+try:
+    import uvloop
+except ImportError:  # pragma: no cover - uvloop 为可选依赖
+    uvloop = None
+
+from ipool.config import settings
+
+logger = logging.getLogger(__name__)
+
+LOOP_AUTO = "auto"
+LOOP_UVLOOP = "uvloop"
+LOOP_ASYNCIO = "asyncio"
+
+
+def install_event_loop() -> str:
+    """按配置安装事件循环策略，返回实际使用的后端名称"""
+    backend = settings.event_loop.lower()
+    if backend in (LOOP_AUTO, LOOP_UVLOOP) and uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        return LOOP_UVLOOP
+    
+    if backend == LOOP_UVLOOP:
+        logger.warning("uvloop 未安装，使用标准 asyncio 事件循环")
+    elif backend not in (LOOP_AUTO, LOOP_ASYNCIO):
+        logger.warning(f"未知的事件循环后端 {settings.event_loop}，使用标准 asyncio 事件循环")
+    return LOOP_ASYNCIO
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+from typing import Dict
+
+from sqlalchemy import bindparam, func, update
+
+from ipool.config import settings
+from ipool.node.models import ProxyNode
+from ipool.node.registry import NodeSnapshot
+from ipool.storage.database import get_session
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionCounter:
+    """
+    进程内连接计数器
+    
+    连接数直接记录在 NodeSnapshot.current_connections 上供调度器读取，
+    同时累积每个节点的增量，由后台任务定期以一次批量 UPDATE 写回数据库。
+    所有操作都在事件循环线程中完成，不需要加锁；写回时按增量累加，
+    因此多个工作进程可以同时写回同一张表。
+    """
+    
+    def __init__(self, flush_interval: float = None):
+        self.flush_interval = flush_interval or settings.connection_flush_interval
+        # 自上次写回以来的连接数增量
+        self._deltas: Dict[int, int] = {}
+        # 本进程当前的连接总数
+        self.total = 0
+        self._running = False
+    
+    def acquire(self, proxy_node: NodeSnapshot):
+        """占用节点的一个连接"""
+        proxy_node.current_connections += 1
+        self.total += 1
+        self._deltas[proxy_node.id] = self._deltas.get(proxy_node.id, 0) + 1
+    
+    def release(self, proxy_node: NodeSnapshot):
+        """释放节点的一个连接"""
+        if proxy_node.current_connections <= 0:
+            return
+        proxy_node.current_connections -= 1
+        self.total = max(0, self.total - 1)
+        self._deltas[proxy_node.id] = self._deltas.get(proxy_node.id, 0) - 1
+    
+    async def start(self):
+        """启动定期写回循环"""
+        if self._running:
+            return
+        
+        self._running = True
+        logger.info(f"连接计数写回服务启动，间隔: {self.flush_interval}秒")
+        
+        while self._running:
+            try:
+                await asyncio.sleep(self.flush_interval)
+                await self.flush()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"写回连接计数时发生错误: {str(e)}", exc_info=True)
+    
+    async def stop(self):
+        """停止写回循环并写回剩余增量"""
+        self._running = False
+        await self.flush()
+    
+    async def flush(self):
+        """将累积的连接数增量批量写回数据库"""
+        # 先整体交换字典，之后的计数进入新的一轮
+        deltas, self._deltas = self._deltas, {}
+        params = [
+            {"node_id": node_id, "delta": delta}
+            for node_id, delta in deltas.items() if delta
+        ]
+        if not params:
+            return
+        
+        table = ProxyNode.__table__
+        stmt = (
+            update(table)
+            .where(table.c.id == bindparam("node_id"))
+            .values(
+                current_connections=func.greatest(table.c.current_connections + bindparam("delta"), 0),
+                # 连接计数不算作节点信息变更，保持 updated_at 不变
+                updated_at=table.c.updated_at,
+            )
+        )
+        try:
+            async with get_session() as session:
+                await session.execute(stmt, params)
+                await session.commit()
+        except Exception:
+            # 写回失败时把增量合并回去，下一轮重试
+            for item in params:
+                self._deltas[item["node_id"]] = self._deltas.get(item["node_id"], 0) + item["delta"]
+            raise
+        
+        logger.debug(f"已写回 {len(params)} 个节点的连接计数")
+    
+    async def reset(self):
+        """清零数据库中的连接计数（启动时调用，上次运行遗留的计数已失效）"""
+        self._deltas = {}
+        async with get_session() as session:
+            await session.execute(
+                update(ProxyNode.__table__).values(
+                    current_connections=0,
+                    updated_at=ProxyNode.__table__.c.updated_at,
+                )
+            )
+            await session.commit()
+
+
+# 全局连接计数器实例
+connection_counter = ConnectionCounter()
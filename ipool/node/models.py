@@ -1,6 +1,6 @@
 from datetime import datetime
 from enum import Enum
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, Enum as SQLEnum
+from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, Index, Enum as SQLEnum
 from sqlalchemy.ext.declarative import declarative_base
 from pydantic import BaseModel, Field, IPvAnyAddress
 
@@ -31,7 +31,8 @@ class ProxyNode(Base):
     is_active = Column(Boolean, default=True)
     is_healthy = Column(Boolean, default=True)
     response_time = Column(Float, default=0.0)  # 毫秒
-    success_rate = Column(Float, default=100.0)  # 百分比
+    success_rate = Column(Float, default=100.0)  # 百分比，最近的请求结果（由请求结果反馈维护）
+    check_success_rate = Column(Float, default=100.0)  # 百分比，健康检查历史窗口内的结果
     
     # 调度相关
     weight = Column(Integer, default=1)
@@ -49,6 +50,23 @@ class ProxyNode(Base):
     last_check = Column(DateTime, nullable=True)
 
 
+class ProxyHealthHistory(Base):
+    """按时间段降采样的节点健康检查历史，每个节点每段一行"""
+    __tablename__ = "proxy_health_history"
+    __table_args__ = (Index("ix_proxy_health_history_node_bucket", "node_id", "bucket_start"),)
+    
+    id = Column(Integer, primary_key=True)
+    node_id = Column(Integer, nullable=False)
+    bucket_start = Column(DateTime, nullable=False)
+    checks = Column(Integer, nullable=False)
+    successes = Column(Integer, nullable=False)
+    # 段内成功的完整检查次数，及其延迟分位数（毫秒），没有样本时分位数为空
+    latency_samples = Column(Integer, nullable=False, default=0)
+    latency_p50 = Column(Float, nullable=True)
+    latency_p95 = Column(Float, nullable=True)
+    latency_p99 = Column(Float, nullable=True)
+
+
 # Pydantic 模型用于 API
 class ProxyNodeCreate(BaseModel):
     name: str | None = None
@@ -90,6 +108,7 @@ class ProxyNodeResponse(BaseModel):
     is_healthy: bool
     response_time: float
     success_rate: float
+    check_success_rate: float | None = None
     weight: int
     max_connections: int
     current_connections: int
@@ -0,0 +1,369 @@
+import logging
+import random
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import select
+
+from ipool.node.models import ProxyNode
+from ipool.storage.database import get_session
+
+logger = logging.getLogger(__name__)
+
+# 从 ProxyNode 复制到快照中的字段（current_connections 由注册表自行维护）
+SNAPSHOT_FIELDS = (
+    "id", "name", "host", "port", "protocol", "username", "password",
+    "is_active", "is_healthy", "response_time", "success_rate", "check_success_rate",
+    "weight", "max_connections", "country", "region", "tags",
+)
+
+# 由健康检查历史计算的延迟分位数（毫秒），不保存在 proxy_nodes 表中，
+# 随快照在进程间同步；没有历史时为 None
+LATENCY_FIELDS = ("latency_p50", "latency_p95", "latency_p99")
+
+# 变更日志最多保留的条目数，超出后调度器需要全量重建
+JOURNAL_SIZE = 4096
+
+# 位图索引的维度
+INDEX_TAG = "tag"
+INDEX_COUNTRY = "country"
+INDEX_REGION = "region"
+INDEX_PROTOCOL = "protocol"
+
+
+def parse_tags(tags: Optional[str]) -> List[str]:
+    """将逗号分隔的标签字符串解析为规范化的标签列表"""
+    if not tags:
+        return []
+    return [tag.strip().lower() for tag in tags.split(",") if tag.strip()]
+
+
+def _index_keys(snapshot: "NodeSnapshot") -> List[Tuple[str, str]]:
+    """节点在位图索引中的所有键"""
+    keys = [(INDEX_TAG, tag) for tag in parse_tags(snapshot.tags)]
+    if snapshot.country:
+        keys.append((INDEX_COUNTRY, snapshot.country.strip().lower()))
+    if snapshot.region:
+        keys.append((INDEX_REGION, snapshot.region.strip().lower()))
+    if snapshot.protocol:
+        keys.append((INDEX_PROTOCOL, getattr(snapshot.protocol, "value", snapshot.protocol).lower()))
+    return keys
+
+
+class NodeSnapshot:
+    """代理节点的进程内快照，调度器只读取该对象而不访问数据库"""
+    
+    __slots__ = SNAPSHOT_FIELDS + LATENCY_FIELDS + ("current_connections", "slot")
+    
+    def __init__(self, node: ProxyNode):
+        # 连接数只统计本进程内的连接，由 ConnectionCounter 维护
+        self.current_connections = 0
+        self.slot = -1
+        for field in LATENCY_FIELDS:
+            setattr(self, field, None)
+        self.update_from(node)
+    
+    def update_from(self, node: ProxyNode):
+        """从数据库模型同步字段（ProxyNode 不带延迟分位数，保留原值）"""
+        for field in SNAPSHOT_FIELDS:
+            setattr(self, field, getattr(node, field))
+        for field in LATENCY_FIELDS:
+            value = getattr(node, field, None)
+            if value is not None:
+                setattr(self, field, value)
+        # 数据库默认值只在插入时生效，这里补齐未落库前可能为空的字段
+        if self.weight is None:
+            self.weight = 1
+        if self.max_connections is None:
+            self.max_connections = 100
+        if self.response_time is None:
+            self.response_time = 0.0
+        if self.success_rate is None:
+            self.success_rate = 100.0
+        if self.check_success_rate is None:
+            self.check_success_rate = 100.0
+    
+    @property
+    def available(self) -> bool:
+        """节点是否可被调度"""
+        return bool(self.is_active and self.is_healthy)
+    
+    def state(self) -> Dict[str, Any]:
+        """可跨进程传递的节点字段（不含本进程的连接计数和槽位）"""
+        return {field: getattr(self, field) for field in SNAPSHOT_FIELDS + LATENCY_FIELDS}
+    
+    def __repr__(self) -> str:
+        return f"<NodeSnapshot id={self.id} {self.host}:{self.port}>"
+
+
+class NodeRegistry:
+    """
+    进程内代理节点注册表
+    
+    启动时从数据库全量加载一次，之后由 ProxyNodeRepository 和 HealthChecker
+    增量更新（多进程模式下工作进程的注册表由控制进程推送，见 ipool.node.sync）。节点按槽位存放，可用节点另外保存在一个数组中，支持 O(1) 增删和随机选取。
+    调度器通过 version 和 changed_since() 感知变化并增量维护自己的索引。
+    
+    另外维护以槽位为位的倒排位图（标签、国家、地区、协议 -> int 位集），
+    定向选择（如 "US + premium"）只需几次按位与即可得到候选集合。
+    """
+    
+    def __init__(self):
+        self._slots: List[Optional[NodeSnapshot]] = []
+        self._free_slots: List[int] = []
+        self._by_id: Dict[int, NodeSnapshot] = {}
+        # 可用节点数组及其位置索引
+        self._available: List[NodeSnapshot] = []
+        self._available_pos: Dict[int, int] = {}
+        # 位图索引: 维度 -> 键 -> 槽位位集
+        self._bitmaps: Dict[str, Dict[str, int]] = {}
+        self._available_bits = 0
+        # 各槽位当前登记在位图中的键
+        self._slot_keys: Dict[int, List[Tuple[str, str]]] = {}
+        # 变更日志: (版本号, 节点ID)
+        self._journal: Deque[Tuple[int, int]] = deque(maxlen=JOURNAL_SIZE)
+        self.version = 0
+        self.loaded = False
+        # 注册表发生变化时调用的回调
+        self._listeners: List[Callable[[], None]] = []
+    
+    def __len__(self) -> int:
+        return len(self._by_id)
+    
+    async def load(self):
+        """从数据库全量加载节点"""
+        async with get_session() as session:
+            result = await session.execute(select(ProxyNode))
+            nodes = result.scalars().all()
+        self.replace(nodes)
+    
+    def replace(self, nodes: Iterable[ProxyNode]):
+        """
+        用给定的节点全量替换注册表内容
+        nodes 可以是 ProxyNode 或任何带有 SNAPSHOT_FIELDS 属性的对象
+        """
+        previous = self._by_id
+        self._slots = []
+        self._free_slots = []
+        self._by_id = {}
+        self._available = []
+        self._available_pos = {}
+        self._bitmaps = {}
+        self._available_bits = 0
+        self._slot_keys = {}
+        self._journal.clear()
+        for node in nodes:
+            # 已有节点原地更新快照：进行中的请求仍持有该对象，释放连接时要减在同一个对象上，
+            # 本进程的连接计数和（新数据不带时的）延迟分位数也随之保留
+            snapshot = previous.get(node.id)
+            if snapshot is None:
+                snapshot = NodeSnapshot(node)
+            else:
+                snapshot.update_from(node)
+            self._insert(snapshot)
+        
+        self.version += 1
+        self.loaded = True
+        logger.info(f"节点注册表已加载 {len(self._by_id)} 个节点，其中可用 {len(self._available)} 个")
+        self._notify()
+    
+    def add_listener(self, callback: Callable[[], None]):
+        """注册变更回调，每次变更后同步调用（回调内不应修改注册表）"""
+        self._listeners.append(callback)
+    
+    def get(self, node_id: int) -> Optional[NodeSnapshot]:
+        """根据ID获取节点快照"""
+        return self._by_id.get(node_id)
+    
+    def get_slot(self, slot: int) -> Optional[NodeSnapshot]:
+        """根据槽位获取节点快照"""
+        return self._slots[slot]
+    
+    def nodes(self) -> Iterable[NodeSnapshot]:
+        """所有节点快照"""
+        return self._by_id.values()
+    
+    def available_nodes(self) -> List[NodeSnapshot]:
+        """所有可调度节点（返回内部数组，调用方不得修改）"""
+        return self._available
+    
+    def random_available(self) -> Optional[NodeSnapshot]:
+        """O(1) 随机选取一个可调度节点"""
+        if not self._available:
+            return None
+        return self._available[random.randrange(len(self._available))]
+    
+    def upsert(self, node: ProxyNode) -> NodeSnapshot:
+        """新增或更新节点"""
+        snapshot = self._by_id.get(node.id)
+        if snapshot is None:
+            snapshot = NodeSnapshot(node)
+            self._insert(snapshot)
+        else:
+            snapshot.update_from(node)
+            self._reindex(snapshot)
+            self._sync_available(snapshot)
+        self._record(snapshot.id)
+        return snapshot
+    
+    def update_health(
+        self,
+        node_id: int,
+        is_healthy: bool,
+        response_time: float,
+        check_success_rate: float,
+        latencies: Optional[Tuple[Optional[float], Optional[float], Optional[float]]] = None
+    ):
+        """
+        更新节点健康状态，latencies 为 (p50, p95, p99)，为 None 时保持不变
+        成功率写入 check_success_rate，success_rate 只由请求结果反馈维护
+        """
+        snapshot = self._by_id.get(node_id)
+        if snapshot is None:
+            return
+        snapshot.is_healthy = is_healthy
+        snapshot.response_time = response_time
+        snapshot.check_success_rate = check_success_rate
+        if latencies is not None:
+            snapshot.latency_p50, snapshot.latency_p95, snapshot.latency_p99 = latencies
+        self._sync_available(snapshot)
+        self._record(node_id)
+    
+    def remove(self, node_id: int):
+        """移除节点"""
+        snapshot = self._by_id.pop(node_id, None)
+        if snapshot is None:
+            return
+        self._remove_available(snapshot)
+        self._unindex(snapshot.slot)
+        self._slots[snapshot.slot] = None
+        self._free_slots.append(snapshot.slot)
+        self._record(node_id)
+    
+    def bitmap(self, dimension: str, key: str) -> int:
+        """返回某个索引键对应的槽位位集（包含不可用节点）"""
+        return self._bitmaps.get(dimension, {}).get(key.strip().lower(), 0)
+    
+    def match(
+        self,
+        country: Optional[str] = None,
+        region: Optional[str] = None,
+        protocol: Optional[str] = None,
+        tags: Sequence[str] = (),
+        available_only: bool = True
+    ) -> int:
+        """
+        按条件求交集，返回满足所有条件的槽位位集
+        未指定任何条件时返回全部（可用）节点
+        """
+        mask = self._available_bits if available_only else self._all_bits()
+        for dimension, key in (
+            (INDEX_COUNTRY, country),
+            (INDEX_REGION, region),
+            (INDEX_PROTOCOL, getattr(protocol, "value", protocol)),
+        ):
+            if key:
+                mask &= self.bitmap(dimension, key)
+        for tag in tags:
+            mask &= self.bitmap(INDEX_TAG, tag)
+        return mask
+    
+    def nodes_in(self, mask: int) -> Iterator[NodeSnapshot]:
+        """遍历位集中的节点"""
+        while mask:
+            low = mask & -mask
+            snapshot = self._slots[low.bit_length() - 1]
+            if snapshot is not None:
+                yield snapshot
+            mask ^= low
+    
+    def ids_in(self, mask: int) -> List[int]:
+        """位集中的节点ID列表"""
+        return [snapshot.id for snapshot in self.nodes_in(mask)]
+    
+    def _all_bits(self) -> int:
+        mask = 0
+        for snapshot in self._by_id.values():
+            mask |= 1 << snapshot.slot
+        return mask
+    
+    def changed_since(self, version: int) -> Optional[Set[int]]:
+        """
+        返回指定版本之后发生变化的节点ID集合
+        如果变更日志已被截断，返回 None，调用方应全量重建
+        """
+        if version == self.version:
+            return set()
+        if not self._journal or self._journal[0][0] > version + 1:
+            return None
+        return {node_id for v, node_id in self._journal if v > version}
+    
+    def _insert(self, snapshot: NodeSnapshot):
+        if self._free_slots:
+            snapshot.slot = self._free_slots.pop()
+            self._slots[snapshot.slot] = snapshot
+        else:
+            snapshot.slot = len(self._slots)
+            self._slots.append(snapshot)
+        self._by_id[snapshot.id] = snapshot
+        self._reindex(snapshot)
+        self._sync_available(snapshot)
+    
+    def _sync_available(self, snapshot: NodeSnapshot):
+        if snapshot.available:
+            if snapshot.id not in self._available_pos:
+                self._available_pos[snapshot.id] = len(self._available)
+                self._available.append(snapshot)
+                self._available_bits |= 1 << snapshot.slot
+        else:
+            self._remove_available(snapshot)
+    
+    def _remove_available(self, snapshot: NodeSnapshot):
+        pos = self._available_pos.pop(snapshot.id, None)
+        if pos is None:
+            return
+        self._available_bits &= ~(1 << snapshot.slot)
+        # 与末尾元素交换后弹出，保持 O(1)
+        last = self._available.pop()
+        if last is not snapshot:
+            self._available[pos] = last
+            self._available_pos[last.id] = pos
+    
+    def _reindex(self, snapshot: NodeSnapshot):
+        """更新节点在位图索引中的登记"""
+        keys = _index_keys(snapshot)
+        if self._slot_keys.get(snapshot.slot) == keys:
+            return
+        self._unindex(snapshot.slot)
+        bit = 1 << snapshot.slot
+        for dimension, key in keys:
+            index = self._bitmaps.setdefault(dimension, {})
+            index[key] = index.get(key, 0) | bit
+        self._slot_keys[snapshot.slot] = keys
+    
+    def _unindex(self, slot: int):
+        """从位图索引中移除槽位"""
+        keys = self._slot_keys.pop(slot, None)
+        if not keys:
+            return
+        bit = 1 << slot
+        for dimension, key in keys:
+            index = self._bitmaps[dimension]
+            remaining = index[key] & ~bit
+            if remaining:
+                index[key] = remaining
+            else:
+                del index[key]
+    
+    def _record(self, node_id: int):
+        self.version += 1
+        self._journal.append((self.version, node_id))
+        self._notify()
+    
+    def _notify(self):
+        for callback in self._listeners:
+            callback()
+
+
+# 全局节点注册表实例
+node_registry = NodeRegistry()
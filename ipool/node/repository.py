@@ -5,6 +5,7 @@ from sqlalchemy import select, update, delete, func
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from ipool.node.models import ProxyNode, ProxyNodeCreate, ProxyNodeUpdate
+from ipool.node.registry import INDEX_TAG, node_registry
 from ipool.storage.database import get_session
 
 logger = logging.getLogger(__name__)
@@ -37,6 +38,9 @@ class ProxyNodeRepository:
             await session.commit()
             await session.refresh(node)
             
+            # 同步到进程内注册表
+            node_registry.upsert(node)
+            
             logger.info(f"创建新代理节点: {node.host}:{node.port}")
             return node
     
@@ -57,7 +61,8 @@ class ProxyNodeRepository:
         is_healthy: Optional[bool] = None,
         protocol: Optional[str] = None,
         country: Optional[str] = None,
-        search: Optional[str] = None
+        search: Optional[str] = None,
+        tag: Optional[str] = None
     ) -> List[ProxyNode]:
         """获取所有代理节点"""
         async with get_session() as session:
@@ -76,6 +81,11 @@ class ProxyNodeRepository:
             if country:
                 query = query.where(ProxyNode.country == country)
             
+            if tag:
+                # 通过注册表的标签位图精确匹配，避免对 tags 列做 LIKE 扫描
+                node_ids = node_registry.ids_in(node_registry.bitmap(INDEX_TAG, tag))
+                query = query.where(ProxyNode.id.in_(node_ids))
+            
             if search:
                 search_term = f"%{search}%"
                 query = query.where(
@@ -112,6 +122,9 @@ class ProxyNodeRepository:
             await session.commit()
             await session.refresh(node)
             
+            # 同步到进程内注册表
+            node_registry.upsert(node)
+            
             logger.info(f"更新代理节点 ID={node_id}: {node.host}:{node.port}")
             return node
     
@@ -128,6 +141,7 @@ class ProxyNodeRepository:
                 return False
             
             await session.commit()
+            node_registry.remove(node_id)
             logger.info(f"删除代理节点 ID={node_id}")
             return True
     
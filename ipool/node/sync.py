@@ -0,0 +1,187 @@
+"""
+控制进程与工作进程之间的节点注册表同步
+
+多进程模式下只有控制进程访问数据库维护节点状态（API、健康检查），
+工作进程的注册表由控制进程通过单向 Pipe 推送：连接建立时发送全量快照，
+之后按变更日志只发送发生变化的节点。
+"""
+import asyncio
+import logging
+from multiprocessing.connection import Connection
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional
+
+from ipool.node.registry import NodeRegistry, node_registry
+from ipool.scheduler.base import SchedulerBase, get_scheduler, scheduler_factory, set_scheduler
+
+logger = logging.getLogger(__name__)
+
+# 消息类型
+MESSAGE_RESET = "reset"
+MESSAGE_UPDATE = "update"
+MESSAGE_SCHEDULER = "scheduler"
+
+
+class _Channel:
+    """到一个工作进程的推送通道，消息由独立的任务按顺序写入 Pipe"""
+    
+    def __init__(self, worker_id: int, conn: Connection):
+        self.worker_id = worker_id
+        self.conn = conn
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+    
+    def send(self, message):
+        self._queue.put_nowait(message)
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await self._queue.get()
+            try:
+                # 大消息写满管道时会阻塞，放到线程中执行，避免拖住控制进程的事件循环
+                await loop.run_in_executor(None, self.conn.send, message)
+            except (OSError, EOFError) as e:
+                logger.warning(f"向工作进程 {self.worker_id} 推送注册表失败: {str(e)}")
+                return
+    
+    def close(self):
+        self._task.cancel()
+        self.conn.close()
+
+
+class RegistryPublisher:
+    """
+    控制进程一侧：把注册表变更推送给所有工作进程
+    
+    同一轮事件循环内的多次变更合并为一条消息，只包含变化节点的字段和被删除的节点ID；
+    变更日志已被截断时改为推送全量快照。没有工作进程时不做任何事。
+    """
+    
+    def __init__(self, registry: NodeRegistry = node_registry):
+        self.registry = registry
+        self._channels: Dict[int, _Channel] = {}
+        self._version = registry.version
+        self._scheduled = False
+        self._scheduler_type: Optional[str] = None
+        registry.add_listener(self._on_change)
+    
+    def attach(self, worker_id: int, conn: Connection):
+        """登记一个工作进程，并发送全量快照和当前调度策略"""
+        self.detach(worker_id)
+        channel = _Channel(worker_id, conn)
+        self._channels[worker_id] = channel
+        channel.send((MESSAGE_RESET, self._full_state()))
+        if self._scheduler_type is not None:
+            channel.send((MESSAGE_SCHEDULER, self._scheduler_type))
+    
+    def detach(self, worker_id: int):
+        """移除一个工作进程的通道"""
+        channel = self._channels.pop(worker_id, None)
+        if channel is not None:
+            channel.close()
+    
+    def publish_scheduler(self, scheduler_type: str):
+        """通知所有工作进程切换调度策略"""
+        self._scheduler_type = scheduler_type
+        self._broadcast((MESSAGE_SCHEDULER, scheduler_type))
+    
+    def _on_change(self):
+        if not self._channels or self._scheduled:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._scheduled = True
+        loop.call_soon(self._flush)
+    
+    def _flush(self):
+        self._scheduled = False
+        changed = self.registry.changed_since(self._version)
+        self._version = self.registry.version
+        if changed is None:
+            self._broadcast((MESSAGE_RESET, self._full_state()))
+            return
+        if not changed:
+            return
+        
+        states, removed = [], []
+        for node_id in changed:
+            node = self.registry.get(node_id)
+            if node is None:
+                removed.append(node_id)
+            else:
+                states.append(node.state())
+        self._broadcast((MESSAGE_UPDATE, states, removed))
+    
+    def _full_state(self) -> List[dict]:
+        self._version = self.registry.version
+        return [node.state() for node in self.registry.nodes()]
+    
+    def _broadcast(self, message):
+        for channel in self._channels.values():
+            channel.send(message)
+
+
+class RegistrySubscriber:
+    """
+    工作进程一侧：接收控制进程推送的注册表变更并应用到本进程的注册表
+    
+    Pipe 注册到事件循环的可读回调中，消息到达时立即应用；
+    控制进程退出（Pipe 关闭）后 wait_closed() 返回，工作进程随之退出。
+    """
+    
+    def __init__(self, conn: Connection, registry: NodeRegistry = node_registry):
+        self.conn = conn
+        self.registry = registry
+        # 调度策略切换后的回调，参数为新的调度器实例
+        self.on_scheduler: Optional[Callable[[SchedulerBase], None]] = None
+        self._ready: Optional[asyncio.Event] = None
+        self._closed: Optional[asyncio.Event] = None
+    
+    async def start(self):
+        """开始接收消息，等待第一份全量快照到达后返回"""
+        self._ready = asyncio.Event()
+        self._closed = asyncio.Event()
+        asyncio.get_running_loop().add_reader(self.conn.fileno(), self._on_readable)
+        await self._ready.wait()
+    
+    async def wait_closed(self):
+        """等待控制进程断开连接"""
+        await self._closed.wait()
+    
+    def _on_readable(self):
+        try:
+            while self.conn.poll():
+                self._apply(self.conn.recv())
+        except (EOFError, OSError):
+            logger.warning("与控制进程的连接已断开")
+            asyncio.get_running_loop().remove_reader(self.conn.fileno())
+            self._closed.set()
+            # 控制进程在首份快照之前就退出时，也要让 start() 返回
+            self._ready.set()
+    
+    def _apply(self, message):
+        kind = message[0]
+        if kind == MESSAGE_RESET:
+            self.registry.replace(SimpleNamespace(**state) for state in message[1])
+            self._ready.set()
+        elif kind == MESSAGE_UPDATE:
+            _, states, removed = message
+            for state in states:
+                self.registry.upsert(SimpleNamespace(**state))
+            for node_id in removed:
+                self.registry.remove(node_id)
+        elif kind == MESSAGE_SCHEDULER:
+            factory = scheduler_factory(message[1])
+            if factory is None:
+                logger.warning(f"不支持的调度器类型: {message[1]}")
+                return
+            set_scheduler(factory)
+            if self.on_scheduler is not None:
+                self.on_scheduler(get_scheduler())
+
+
+# 全局注册表推送实例（控制进程使用）
+registry_publisher = RegistryPublisher()
@@ -1,10 +1,13 @@
 import asyncio
 import logging
 from abc import ABC, abstractmethod
-from typing import Optional
+from typing import Dict, Optional, Set, Tuple
 
+from ipool.config import settings
+from ipool.protocols.upstream import UpstreamError, open_upstream
 from ipool.scheduler.base import get_scheduler
-from ipool.node.models import ProxyNode
+from ipool.node.registry import NodeSnapshot
+from ipool.scheduler.filters import NodeFilter
 
 logger = logging.getLogger(__name__)
 
@@ -12,9 +15,12 @@ logger = logging.getLogger(__name__)
 class ProxyServer(ABC):
     """代理服务器基类"""
     
-    def __init__(self, host: str = "0.0.0.0", port: int = 8080):
+    def __init__(self, host: str = "0.0.0.0", port: int = 8080, reuse_port: bool = False):
         self.host = host
         self.port = port
+        # 多个工作进程监听同一端口时开启 SO_REUSEPORT，由内核分发连接
+        self.reuse_port = reuse_port
+        self.backlog = settings.listen_backlog
         self.server = None
         self._running = False
         self.scheduler = get_scheduler()  # 获取当前配置的调度器
@@ -44,9 +50,108 @@ class ProxyServer(ABC):
         self._running = False
         logger.info(f"{self.__class__.__name__} 已停止")
     
-    async def get_proxy(self) -> Optional[ProxyNode]:
-        """获取一个代理节点"""
-        return await self.scheduler.next_proxy()
+    async def get_proxy(self, node_filter: Optional[NodeFilter] = None) -> Optional[NodeSnapshot]:
+        """获取一个代理节点，node_filter 为客户端指定的筛选条件"""
+        if node_filter is not None and node_filter.session:
+            # 会话保持：同一会话键固定使用同一个出口节点
+            return await self.scheduler.session_proxy(node_filter)
+        return await self.scheduler.next_proxy(node_filter)
+    
+    async def connect_target(
+        self,
+        host: str,
+        port: int,
+        node_filter: Optional[NodeFilter] = None
+    ) -> Optional[Tuple[NodeSnapshot, asyncio.StreamReader, asyncio.StreamWriter, float]]:
+        """
+        通过代理节点建立到目标的隧道
+        
+        每次尝试的超时为 upstream_connect_timeout。当前节点在 connect_race_delay 内没有连通时，
+        并行向调度器另选的节点发起连接，先连通者胜出，其余尝试被取消；失败的节点立即报告给调度器，
+        并换一个节点重试，最多尝试 connect_max_attempts 个节点。另选节点时把已尝试的节点作为
+        筛选条件排除，调度器选不出时才停止重试。会话保持请求固定使用会话节点，只尝试一次。
+        
+        返回 (节点, reader, writer, 该节点的连接耗时毫秒)，节点的成功结果由调用方在连接结束后报告；
+        没有可用节点时返回 None，所有尝试都失败时抛出最后一个 UpstreamError。
+        """
+        loop = asyncio.get_running_loop()
+        max_attempts = 1 if node_filter is not None and node_filter.session else max(1, settings.connect_max_attempts)
+        # 进行中的尝试: 任务 -> (节点, 开始时间)
+        attempts: Dict[asyncio.Task, Tuple[NodeSnapshot, float]] = {}
+        tried: Set[int] = set()
+        error: Optional[UpstreamError] = None
+        
+        async def launch() -> bool:
+            """向调度器选出的新节点发起一次连接，没有新节点可用时返回 False"""
+            if len(tried) >= max_attempts:
+                return False
+            if tried:
+                # 排除已尝试的节点，只在满足条件的其余节点中另选
+                proxy_node = await self.get_proxy((node_filter or NodeFilter()).excluding(tried))
+            else:
+                proxy_node = await self.get_proxy(node_filter)
+            if proxy_node is None:
+                return False
+            if proxy_node.id in tried:
+                # 调度器选不出其他节点
+                await self.scheduler.report_aborted(proxy_node)
+                return False
+            tried.add(proxy_node.id)
+            logger.info(f"使用代理节点 {proxy_node.host}:{proxy_node.port} 连接到 {host}:{port}")
+            task = asyncio.create_task(open_upstream(proxy_node, host, port))
+            attempts[task] = (proxy_node, loop.time())
+            return True
+        
+        try:
+            exhausted = not await launch()
+            while attempts:
+                done, _ = await asyncio.wait(
+                    attempts,
+                    timeout=None if exhausted else settings.connect_race_delay,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    # 当前节点迟迟没有连通，并行尝试另一个节点
+                    exhausted = not await launch()
+                    continue
+                
+                winner = None
+                for task in done:
+                    proxy_node, started = attempts.pop(task)
+                    try:
+                        proxy_reader, proxy_writer = task.result()
+                    except UpstreamError as e:
+                        error = e
+                        logger.warning(f"通过代理节点 {proxy_node.host}:{proxy_node.port} 连接 {host}:{port} 失败: {str(e)}")
+                        await self.scheduler.report_failure(proxy_node, str(e), e.kind)
+                        continue
+                    if winner is None:
+                        winner = (proxy_node, proxy_reader, proxy_writer, (loop.time() - started) * 1000)
+                    else:
+                        # 同时连通的其他节点不再使用
+                        proxy_writer.close()
+                        await self.scheduler.report_aborted(proxy_node)
+                if winner is not None:
+                    return winner
+                
+                # 失败的节点立即换一个节点重试
+                if not exhausted:
+                    exhausted = not await launch()
+        finally:
+            # 取消尚未完成的尝试（其他节点已胜出或客户端中断）
+            for task in attempts:
+                task.cancel()
+            for task, (proxy_node, _) in attempts.items():
+                try:
+                    _, proxy_writer = await task
+                    proxy_writer.close()
+                except (asyncio.CancelledError, UpstreamError):
+                    pass
+                await self.scheduler.report_aborted(proxy_node)
+        
+        if error is not None:
+            raise error
+        return None
     
     @abstractmethod
     async def _create_server(self):
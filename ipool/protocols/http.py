@@ -1,22 +1,103 @@
 import asyncio
+import base64
+import binascii
 import logging
-import re
+import time
+from http import HTTPStatus
+from typing import Optional, Tuple
 from urllib.parse import urlparse
 
+from ipool.config import settings
 from ipool.protocols.base import ProxyServer
+from ipool.protocols.parser import HttpParseError, HttpRequest, HttpResponse, parse_response_head, read_request
+from ipool.protocols.relay import AdaptiveBuffer, relay, tune_connection
+from ipool.protocols.pool import stream_alive, upstream_pool
+from ipool.protocols.upstream import (
+    FORWARD_KEY,
+    UpstreamError,
+    format_authority,
+    forward_key,
+    open_forward,
+    proxy_authorization,
+)
+from ipool.node.registry import NodeSnapshot
+from ipool.scheduler.filters import NodeFilter
 
 logger = logging.getLogger(__name__)
 
+# 客户端指定节点筛选条件的请求头
+FILTER_HEADER = 'x-ipool-filter'
+
+# 转发时需要去掉的请求头（逐跳头和筛选条件头），另外去掉所有 Proxy-* 头
+HOP_BY_HOP_HEADERS = frozenset(('connection', 'keep-alive', FILTER_HEADER))
+
+# 转发响应时需要去掉的逐跳头，另外去掉 Connection 中列出的头；
+# 客户端连接是否保持由代理自己的 Connection 头声明
+HOP_BY_HOP_RESPONSE_HEADERS = frozenset((
+    'connection', 'keep-alive', 'proxy-connection', 'proxy-authenticate', 'te', 'upgrade'
+))
+
+
+class _ClientAborted(Exception):
+    """客户端在请求体转发完成前断开了连接"""
+
+
+class _BoundUpstream:
+    """
+    客户端 keep-alive 连接上绑定的上游连接
+    
+    同一客户端连接的下一个请求被调度到同一节点（且池化键相同）时直接复用，
+    否则归还连接池。
+    """
+    
+    __slots__ = ("proxy_node", "key", "reader", "writer")
+    
+    def __init__(self):
+        self.proxy_node: Optional[NodeSnapshot] = None
+        self.key: Optional[str] = None
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+    
+    def take(self, proxy_node: NodeSnapshot, key: str) -> Optional[Tuple[asyncio.StreamReader, asyncio.StreamWriter]]:
+        """节点和池化键相同时取出绑定的连接，否则将其归还连接池"""
+        if self.writer is None:
+            return None
+        if self.proxy_node.id == proxy_node.id and self.key == key and stream_alive(self.reader, self.writer):
+            conn = self.reader, self.writer
+            self._clear()
+            return conn
+        self.release()
+        return None
+    
+    def bind(self, proxy_node: NodeSnapshot, key: str, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.release()
+        self.proxy_node = proxy_node
+        self.key = key
+        self.reader = reader
+        self.writer = writer
+    
+    def release(self):
+        """将绑定的连接归还连接池"""
+        if self.writer is not None:
+            upstream_pool.checkin(self.proxy_node, self.key, self.reader, self.writer)
+        self._clear()
+    
+    def _clear(self):
+        self.proxy_node = self.key = self.reader = self.writer = None
+
 
 class HttpProxyServer(ProxyServer):
     """HTTP代理服务器实现"""
-
+    
     async def _create_server(self):
         """创建HTTP代理服务器"""
         return await asyncio.start_server(
             self.handle_client,
             self.host,
-            self.port
+            self.port,
+            limit=settings.http_max_header_size,
+            reuse_port=self.reuse_port,
+            backlog=self.backlog
         )
     
     async def _run_server(self):
@@ -28,117 +109,129 @@ class HttpProxyServer(ProxyServer):
         """处理HTTP代理客户端连接"""
         client_addr = writer.get_extra_info('peername')
         logger.debug(f"新的HTTP代理客户端连接: {client_addr}")
+        tune_connection(writer)
         
+        bound = _BoundUpstream()
+        requests = 0
         try:
-            # 读取HTTP请求头
-            headers = await self._read_http_headers(reader)
-            if not headers:
-                logger.warning("无效的HTTP请求")
-                return
-            
-            # 解析请求行
-            request_line = headers[0]
-            method, url, version = self._parse_request_line(request_line)
-            
-            if not method or not url:
-                logger.warning(f"无法解析HTTP请求行: {request_line}")
-                return
-            
-            # 处理CONNECT方法（HTTPS隧道）
-            if method.upper() == 'CONNECT':
-                await self._handle_connect(reader, writer, url, headers)
-            else:
-                # 处理普通HTTP请求
-                await self._handle_http_request(reader, writer, method, url, version, headers)
+            # 客户端连接保持期间循环处理请求，流水线发送的请求按顺序处理
+            while True:
+                # 读取并解析请求行和请求头
+                try:
+                    request = await read_request(reader)
+                except HttpParseError as e:
+                    logger.warning(f"无法解析HTTP请求: {str(e)}")
+                    writer.write(f'HTTP/1.1 {e.status} {HTTPStatus(e.status).phrase}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'.encode('latin-1'))
+                    await writer.drain()
+                    return
+                if request is None:
+                    return
+                requests += 1
+                
+                # 解析客户端指定的节点筛选条件
+                node_filter = self._parse_node_filter(request)
+                
+                # 处理CONNECT方法（HTTPS隧道），之后连接不再承载HTTP请求
+                if request.method.upper() == 'CONNECT':
+                    bound.release()
+                    await self._handle_connect(reader, writer, request, node_filter)
+                    return
                 
+                # 处理普通HTTP请求
+                keep_alive = await self._handle_http_request(reader, writer, request, node_filter, bound)
+                if not keep_alive or not request.keep_alive:
+                    return
+        
         except (asyncio.IncompleteReadError, ConnectionError) as e:
             logger.debug(f"HTTP连接错误: {str(e)}")
         except Exception as e:
             logger.error(f"处理HTTP客户端时出错: {str(e)}", exc_info=True)
         finally:
+            bound.release()
             writer.close()
             await writer.wait_closed()
-            logger.debug(f"HTTP客户端连接关闭: {client_addr}")
+            logger.debug(f"HTTP客户端连接关闭: {client_addr}，共处理 {requests} 个请求")
     
-    async def _read_http_headers(self, reader):
-        """读取HTTP请求头"""
-        headers = []
-        while True:
-            line = await reader.readline()
-            if not line or line == b'\r\n':
-                break
-            headers.append(line.decode('utf-8', errors='ignore').strip())
-        return headers
+    def _parse_node_filter(self, request: HttpRequest) -> Optional[NodeFilter]:
+        """
+        从请求头解析节点筛选条件
+        优先使用 X-IPool-Filter 头，其次使用 Proxy-Authorization 中的用户名
+        """
+        filter_text = request.get(FILTER_HEADER)
+        authorization = request.get('proxy-authorization')
+        if filter_text is None and authorization:
+            scheme, _, credentials = authorization.partition(' ')
+            if scheme.lower() == 'basic':
+                try:
+                    decoded = base64.b64decode(credentials.strip()).decode('utf-8', errors='ignore')
+                    filter_text = decoded.partition(':')[0]
+                except (binascii.Error, ValueError):
+                    logger.debug("无法解析Proxy-Authorization头")
+        
+        node_filter = NodeFilter.parse(filter_text)
+        if node_filter:
+            logger.debug(f"客户端指定节点筛选条件: {node_filter}")
+        return node_filter
     
-    def _parse_request_line(self, request_line):
-        """解析HTTP请求行"""
-        try:
-            parts = request_line.split()
-            if len(parts) != 3:
-                return None, None, None
-            return parts[0], parts[1], parts[2]
-        except:
-            return None, None, None
-    
-    async def _handle_connect(self, reader, writer, url, headers):
+    async def _handle_connect(self, reader, writer, request: HttpRequest, node_filter=None):
         """处理HTTPS隧道连接请求"""
         try:
-            host, port = url.split(':', 1)
+            host, port = request.target.rsplit(':', 1)
+            host = host.strip('[]')
             port = int(port)
             
-            # 获取代理节点
-            proxy_node = await self.get_proxy()
-            if not proxy_node:
+            # 通过代理节点连接到目标服务器，失败时自动换节点重试
+            try:
+                upstream = await self.connect_target(host, port, node_filter)
+            except UpstreamError as e:
+                logger.error(f"连接目标服务器失败: {str(e)}")
+                await self._send_gateway_error(writer, e)
+                return
+            if upstream is None:
                 logger.error("没有可用的代理节点")
                 writer.write(b'HTTP/1.1 502 Bad Gateway\r\n\r\n')
                 await writer.drain()
                 return
+            proxy_node, proxy_reader, proxy_writer, connect_time = upstream
             
-            logger.info(f"使用代理节点 {proxy_node.host}:{proxy_node.port} 连接到 {host}:{port}")
-            
-            # 尝试通过代理连接到目标服务器
+            uploaded = downloaded = 0
             try:
-                proxy_reader, proxy_writer = await asyncio.open_connection(
-                    proxy_node.host, proxy_node.port
-                )
-                
                 # 发送连接成功响应
                 writer.write(b'HTTP/1.1 200 Connection Established\r\n\r\n')
                 await writer.drain()
                 
                 # 双向转发数据
-                await asyncio.gather(
-                    self._transfer_data(reader, proxy_writer),
-                    self._transfer_data(proxy_reader, writer)
+                uploaded, downloaded = await relay(reader, writer, proxy_reader, proxy_writer)
+            finally:
+                proxy_writer.close()
+                await self.scheduler.report_success(
+                    proxy_node, connect_time, bytes_up=uploaded, bytes_down=downloaded
                 )
-            except Exception as e:
-                logger.error(f"连接目标服务器失败: {str(e)}")
-                writer.write(b'HTTP/1.1 502 Bad Gateway\r\n\r\n')
-                await writer.drain()
-                
+        
         except Exception as e:
             logger.error(f"处理CONNECT请求失败: {str(e)}")
             writer.write(b'HTTP/1.1 400 Bad Request\r\n\r\n')
             await writer.drain()
     
-    async def _handle_http_request(self, reader, writer, method, url, version, headers):
-        """处理普通HTTP请求"""
+    async def _handle_http_request(self, reader, writer, request: HttpRequest, node_filter=None, bound=None) -> bool:
+        """
+        处理普通HTTP请求
+        返回客户端连接能否继续处理下一个请求（响应已完整转发且边界明确）
+        """
+        bound = bound or _BoundUpstream()
+        url = request.target
+        # 开始向客户端转发响应之后，出错时只能关闭客户端连接，不能再写入错误响应
+        response_started = False
         try:
-            # 解析URL
+            # 解析URL，相对地址从 Host 头中获取目标主机
             parsed_url = urlparse(url)
-            host = parsed_url.netloc
-            if not host:
-                # 从 Host 头中获取
-                for header in headers[1:]:
-                    if header.lower().startswith('host:'):
-                        host = header[5:].strip()
-                        break
+            host = parsed_url.netloc or request.get('host', '')
             
             if not host:
                 logger.warning(f"无法确定目标主机: {url}")
                 writer.write(b'HTTP/1.1 400 Bad Request\r\n\r\n')
                 await writer.drain()
-                return
+                return False
             
             # 分离主机名和端口
             if ':' in host:
@@ -147,92 +240,385 @@ class HttpProxyServer(ProxyServer):
             else:
                 port = 80
             
+            # 重构请求
+            path = parsed_url.path
+            if not path:
+                path = '/'
+            if parsed_url.query:
+                path += f'?{parsed_url.query}'
+            
             # 获取代理节点
-            proxy_node = await self.get_proxy()
+            proxy_node = await self.get_proxy(node_filter)
             if not proxy_node:
                 logger.error("没有可用的代理节点")
                 writer.write(b'HTTP/1.1 502 Bad Gateway\r\n\r\n')
                 await writer.drain()
-                return
+                return False
             
             logger.info(f"使用代理节点 {proxy_node.host}:{proxy_node.port} 连接到 {host}:{port}")
             
-            # 重构请求
-            path = parsed_url.path
-            if not path:
-                path = '/'
-            if parsed_url.query:
-                path += f'?{parsed_url.query}'
-            
-            # 构建新的请求头
-            request_headers = [f"{method} {path} {version}"]
-            for header in headers[1:]:
-                # 跳过Connection相关头
-                if not header.lower().startswith(('proxy-', 'connection:')):
-                    request_headers.append(header)
+            # 请求体在发出请求头之后边读边转发，不在内存中缓冲
+            has_body = request.chunked or bool(request.content_length)
+            expect_continue = has_body and '100-continue' in (request.get('expect') or '').lower()
+            body_started = body_skipped = False
             
-            # 添加必要的头部
-            request_headers.append('Connection: close')
+            start_time = time.time()
+            bytes_up = 0
+            key = forward_key(proxy_node, host, port)
+            for attempt in range(2):
+                # 优先复用客户端连接上绑定的上游连接和连接池中的 keep-alive 连接，
+                # 复用的连接在请求体开始转发之前失败时换新连接重试一次
+                connect_start = time.time()
+                try:
+                    conn = bound.take(proxy_node, key) if attempt == 0 else None
+                    if conn is not None:
+                        proxy_reader, proxy_writer = conn
+                        absolute, reused = key == FORWARD_KEY, True
+                    else:
+                        proxy_reader, proxy_writer, absolute, reused = await open_forward(
+                            proxy_node, host, port, reuse=attempt == 0
+                        )
+                except UpstreamError as e:
+                    await self._upstream_failed(writer, proxy_node, e)
+                    return False
+                except BaseException:
+                    # 任务被取消等与节点无关的中断
+                    await self.scheduler.report_aborted(proxy_node)
+                    raise
+                connect_time = (time.time() - connect_start) * 1000
+                
+                if not absolute:
+                    target = path
+                elif parsed_url.scheme:
+                    target = url
+                else:
+                    target = f"http://{format_authority(host, port)}{path}"
+                upstream_request = self._build_request(request, target, proxy_node if absolute else None)
+                try:
+                    proxy_writer.write(upstream_request)
+                    await proxy_writer.drain()
+                    head = None
+                    if has_body:
+                        if expect_continue:
+                            head = await self._await_continue(proxy_reader, writer)
+                        if head is None:
+                            body_started = True
+                            bytes_up = await self._send_request_body(reader, proxy_writer, request)
+                        else:
+                            # 上游未等请求体就给出了最终响应
+                            body_skipped = True
+                    if head is None:
+                        head = await proxy_reader.readuntil(b'\r\n\r\n')
+                    break
+                except (_ClientAborted, HttpParseError) as e:
+                    # 客户端的请求体中断或不合法，与节点无关
+                    proxy_writer.close()
+                    logger.warning(f"转发请求体失败: {str(e)}")
+                    await self.scheduler.report_aborted(proxy_node)
+                    if isinstance(e, HttpParseError):
+                        writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                        await writer.drain()
+                    return False
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError) as e:
+                    proxy_writer.close()
+                    if reused and not body_started:
+                        logger.debug(f"复用的上游连接已失效，重新连接: {str(e)}")
+                        continue
+                    await self._upstream_failed(writer, proxy_node, UpstreamError(f"读取响应失败: {str(e)}"))
+                    return False
+                except BaseException:
+                    proxy_writer.close()
+                    await self.scheduler.report_aborted(proxy_node)
+                    raise
             
-            # 尝试通过代理连接到目标服务器
+            # 以首字节时间作为本次请求的响应时间
+            response_time = (time.time() - start_time) * 1000
+            response_started = True
             try:
-                proxy_reader, proxy_writer = await asyncio.open_connection(
-                    proxy_node.host, proxy_node.port
+                framed, upstream_reusable, bytes_down = await self._forward_response(
+                    proxy_reader, writer, request.method, head, request.keep_alive
                 )
-                
-                # 发送请求到目标服务器
-                request = '\r\n'.join(request_headers) + '\r\n\r\n'
-                proxy_writer.write(request.encode('utf-8'))
-                await proxy_writer.drain()
-                
-                # 如果有请求体，转发请求体
-                content_length = 0
-                for header in headers:
-                    match = re.match(r'content-length:\s*(\d+)', header.lower())
-                    if match:
-                        content_length = int(match.group(1))
-                        break
-                
-                if content_length > 0:
-                    body = await reader.read(content_length)
-                    proxy_writer.write(body)
-                    await proxy_writer.drain()
-                
-                # 读取并转发响应
-                response = await proxy_reader.read(8192)
-                while response:
-                    writer.write(response)
-                    await writer.drain()
-                    response = await proxy_reader.read(8192)
-                
-                # 关闭代理连接
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, HttpParseError, ConnectionError) as e:
                 proxy_writer.close()
-                await proxy_writer.wait_closed()
-                
-            except Exception as e:
-                logger.error(f"通过代理请求目标服务器失败: {str(e)}")
-                writer.write(b'HTTP/1.1 502 Bad Gateway\r\n\r\n')
-                await writer.drain()
-                
+                if writer.is_closing():
+                    # 客户端先断开了连接，与节点无关
+                    logger.debug(f"客户端在响应转发完成前断开了连接: {str(e)}")
+                    await self.scheduler.report_aborted(proxy_node)
+                else:
+                    logger.error(f"通过代理请求目标服务器失败: {str(e)}")
+                    await self.scheduler.report_failure(proxy_node, f"转发响应失败: {str(e)}", UpstreamError.PROXY)
+                return False
+            except BaseException:
+                proxy_writer.close()
+                await self.scheduler.report_aborted(proxy_node)
+                raise
+            
+            if body_skipped:
+                # 请求体没有读取也没有发出，两端连接都不能再用于下一个请求
+                framed = upstream_reusable = False
+            if upstream_reusable:
+                # 响应已完整转发，上游连接留给同一客户端连接的下一个请求
+                bound.bind(proxy_node, key, proxy_reader, proxy_writer)
+            else:
+                proxy_writer.close()
+            await self.scheduler.report_success(
+                proxy_node, connect_time, ttfb=response_time, bytes_up=bytes_up, bytes_down=bytes_down
+            )
+            return framed
+        
         except Exception as e:
             logger.error(f"处理HTTP请求失败: {str(e)}")
-            writer.write(b'HTTP/1.1 400 Bad Request\r\n\r\n')
-            await writer.drain()
+            if not response_started:
+                writer.write(b'HTTP/1.1 400 Bad Request\r\n\r\n')
+                await writer.drain()
+            return False
     
-    async def _transfer_data(self, reader, writer):
-        """在两个连接之间传输数据"""
+    def _build_request(self, request: HttpRequest, target, proxy_node=None) -> bytes:
+        """
+        构建发往上游的请求头
+        proxy_node 不为空时请求直接发给 HTTP 代理节点，需要附带节点的认证信息
+        """
+        request_headers = [f"{request.method} {target} {request.version}"]
+        for name, value in request.headers:
+            # 跳过逐跳头和筛选条件头
+            lower_name = name.lower()
+            if lower_name not in HOP_BY_HOP_HEADERS and not lower_name.startswith('proxy-'):
+                request_headers.append(f"{name}: {value}")
+        
+        if proxy_node is not None:
+            authorization = proxy_authorization(proxy_node)
+            if authorization:
+                request_headers.append(f"Proxy-Authorization: {authorization}")
+        
+        # HTTP/1.1 默认保持连接，HTTP/1.0 需要显式声明
+        if request.version == 'HTTP/1.0':
+            request_headers.append('Connection: keep-alive')
+        
+        return ('\r\n'.join(request_headers) + '\r\n\r\n').encode('latin-1')
+    
+    async def _send_request_body(self, reader, proxy_writer, request: HttpRequest):
+        """
+        按 Content-Length 或 chunked 编码把请求体流式转发给上游
+        每次读取有界的一块并等待上游写缓冲区排空，内存占用与请求体大小无关；
+        chunked 请求体保持原始编码，返回转发的字节数
+        """
+        if not request.chunked:
+            return await self._send_exactly(reader, proxy_writer, request.content_length or 0)
+        
+        sent = 0
+        while True:
+            line = await self._client_readline(reader)
+            proxy_writer.write(line)
+            sent += len(line)
+            try:
+                size = int(line.split(b';', 1)[0].strip(), 16)
+            except ValueError:
+                raise HttpParseError(f"无效的 chunk 长度: {line[:20]!r}")
+            if size == 0:
+                break
+            # 数据块及其结尾的 CRLF
+            sent += await self._send_exactly(reader, proxy_writer, size + 2)
+        
+        # trailer 及结束空行
+        while True:
+            line = await self._client_readline(reader)
+            proxy_writer.write(line)
+            sent += len(line)
+            if line == b'\r\n':
+                break
+        await proxy_writer.drain()
+        return sent
+    
+    async def _send_exactly(self, reader, proxy_writer, size: int) -> int:
+        """转发客户端固定长度的请求体"""
+        total = size
+        buffer = AdaptiveBuffer()
+        while size > 0:
+            try:
+                data = await reader.read(min(size, buffer.size))
+            except ConnectionError as e:
+                raise _ClientAborted(str(e)) from e
+            if not data:
+                raise _ClientAborted(f"客户端在请求体结束前关闭了连接，还差 {size} 字节")
+            buffer.record(len(data))
+            size -= len(data)
+            proxy_writer.write(data)
+            await proxy_writer.drain()
+        return total
+    
+    async def _client_readline(self, reader) -> bytes:
+        """读取请求体中的一行（chunk 长度行或 trailer）"""
         try:
-            while True:
-                data = await reader.read(8192)
-                if not data:
-                    break
-                writer.write(data)
+            return await reader.readuntil(b'\r\n')
+        except asyncio.LimitOverrunError as e:
+            raise HttpParseError("chunk 长度行过长") from e
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            raise _ClientAborted("客户端在请求体结束前关闭了连接") from e
+    
+    async def _await_continue(self, proxy_reader, writer) -> Optional[bytes]:
+        """
+        等待上游对 Expect: 100-continue 的答复
+        上游回复 100 Continue 或在 http_expect_timeout 内没有答复时返回 None，客户端随后发送请求体
+        （超时由代理代为回复 100 Continue）；上游直接给出最终响应时返回该响应头
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.http_expect_timeout
+        while True:
+            try:
+                head = await asyncio.wait_for(
+                    proxy_reader.readuntil(b'\r\n\r\n'),
+                    max(0, deadline - loop.time())
+                )
+            except asyncio.TimeoutError:
+                head = b'HTTP/1.1 100 Continue\r\n\r\n'
+            
+            try:
+                status = parse_response_head(head).status
+            except HttpParseError:
+                # 交给 _forward_response 处理
+                return head
+            if status >= 200 or status == 101:
+                return head
+            
+            try:
+                writer.write(head)
                 await writer.drain()
-        except Exception as e:
-            logger.debug(f"数据传输错误: {str(e)}")
-        finally:
+            except ConnectionError as e:
+                raise _ClientAborted(str(e)) from e
+            if status == 100:
+                return None
+    
+    async def _forward_response(
+        self, proxy_reader, writer, method, head: bytes, client_keep_alive: bool = True
+    ) -> Tuple[bool, bool, int]:
+        """
+        按响应的消息长度转发响应给客户端
+        返回 (响应边界是否明确, 上游连接能否继续复用, 转发的字节数)：边界明确时客户端连接可以继续使用，
+        上游连接还要求上游没有声明关闭连接
+        """
+        response = parse_response_head(head)
+        sent = 0
+        
+        # 1xx 中间响应之后还有最终响应
+        while 100 <= response.status < 200 and response.status != 101:
+            writer.write(head)
+            sent += len(head)
+            head = await proxy_reader.readuntil(b'\r\n\r\n')
+            response = parse_response_head(head)
+        
+        if response.status == 101:
+            # 协议升级，Connection/Upgrade 头原样转发，之后的数据没有 HTTP 边界
+            writer.write(head)
+            sent += len(head)
+            await writer.drain()
+            sent += await self._copy_until_eof(proxy_reader, writer)
+            return False, False, sent
+        
+        keep_alive = response.keep_alive
+        bodyless = method.upper() == 'HEAD' or response.status in (204, 304)
+        # 带有 Transfer-Encoding 时忽略 Content-Length，chunked 不是最后一个编码时响应以连接关闭结束
+        content_length = None if 'transfer-encoding' in response else response.content_length
+        framed = bodyless or response.chunked or content_length is not None
+        
+        head = self._build_response_head(head, response, framed and client_keep_alive)
+        writer.write(head)
+        sent += len(head)
+        await writer.drain()
+        
+        if bodyless:
+            return True, keep_alive, sent
+        if response.chunked:
+            sent += await self._copy_chunked(proxy_reader, writer)
+            return True, keep_alive, sent
+        if content_length is not None:
+            sent += await self._copy_exactly(proxy_reader, writer, content_length)
+            return True, keep_alive, sent
+        
+        # 没有长度信息，响应以连接关闭结束
+        sent += await self._copy_until_eof(proxy_reader, writer)
+        return False, False, sent
+    
+    def _build_response_head(self, head: bytes, response: HttpResponse, keep_alive: bool) -> bytes:
+        """
+        构建发给客户端的响应头
+        去掉上游的逐跳头（包括 Connection 中列出的头），带有 Transfer-Encoding 的响应去掉 Content-Length，
+        再按客户端连接能否继续使用写入代理自己的 Connection 头
+        """
+        dropped = set(HOP_BY_HOP_RESPONSE_HEADERS)
+        for value in response.get_all('connection'):
+            dropped.update(token.strip().lower() for token in value.split(','))
+        if 'transfer-encoding' in response:
+            dropped.add('content-length')
+        
+        response_headers = [head.split(b'\r\n', 1)[0].decode('latin-1')]
+        for name, value in response.headers:
+            if name.lower() not in dropped:
+                response_headers.append(f"{name}: {value}")
+        response_headers.append('Connection: keep-alive' if keep_alive else 'Connection: close')
+        return ('\r\n'.join(response_headers) + '\r\n\r\n').encode('latin-1')
+    
+    async def _copy_exactly(self, source, writer, size: int) -> int:
+        """转发固定长度的消息体"""
+        total = size
+        buffer = AdaptiveBuffer()
+        while size > 0:
+            data = await source.read(min(size, buffer.size))
+            if not data:
+                raise asyncio.IncompleteReadError(b'', size)
+            buffer.record(len(data))
+            size -= len(data)
+            writer.write(data)
+            await writer.drain()
+        return total
+    
+    async def _copy_chunked(self, source, writer) -> int:
+        """转发 chunked 编码的消息体（包括结尾的 trailer）"""
+        sent = 0
+        while True:
+            line = await source.readuntil(b'\r\n')
+            writer.write(line)
+            sent += len(line)
             try:
-                writer.close()
-                await writer.wait_closed()
-            except:
-                pass
+                size = int(line.split(b';', 1)[0].strip(), 16)
+            except ValueError:
+                raise HttpParseError(f"无效的 chunk 长度: {line[:20]!r}")
+            if size == 0:
+                break
+            # 数据块及其结尾的 CRLF
+            sent += await self._copy_exactly(source, writer, size + 2)
+        
+        while True:
+            line = await source.readuntil(b'\r\n')
+            writer.write(line)
+            sent += len(line)
+            if line == b'\r\n':
+                break
+        await writer.drain()
+        return sent
+    
+    async def _copy_until_eof(self, source, writer) -> int:
+        """转发数据直到上游关闭连接"""
+        sent = 0
+        buffer = AdaptiveBuffer()
+        data = await source.read(buffer.size)
+        while data:
+            buffer.record(len(data))
+            sent += len(data)
+            writer.write(data)
+            await writer.drain()
+            data = await source.read(buffer.size)
+        return sent
+    
+    async def _upstream_failed(self, writer, proxy_node, error: UpstreamError):
+        """向调度器报告上游失败，并给客户端返回 502/504"""
+        logger.error(f"连接目标服务器失败: {str(error)}")
+        await self.scheduler.report_failure(proxy_node, str(error), error.kind)
+        await self._send_gateway_error(writer, error)
+    
+    async def _send_gateway_error(self, writer, error: UpstreamError):
+        """按上游失败原因给客户端返回 502/504"""
+        if error.kind == UpstreamError.TIMEOUT:
+            writer.write(b'HTTP/1.1 504 Gateway Timeout\r\n\r\n')
+        else:
+            writer.write(b'HTTP/1.1 502 Bad Gateway\r\n\r\n')
+        await writer.drain()
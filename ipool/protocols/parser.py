@@ -0,0 +1,291 @@
+"""
+HTTP 请求头解析
+
+请求头块由 StreamReader.readuntil 增量查找结束标记（只扫描新到达的数据），
+取出后一次性解析为 HttpRequest，请求头按小写名称建立索引，之后不再重复扫描。
+
+解析后端通过 http_parser 配置选择：默认使用纯 Python 实现（请求头块已完整取出，
+按行切分比逐次创建 C 解析器更快）；安装了 httptools 或 h11 时可以切换到
+更严格的校验实现。
+"""
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import httptools
+except ImportError:  # pragma: no cover - httptools 为可选依赖
+    httptools = None
+
+try:
+    import h11
+except ImportError:  # pragma: no cover - h11 为可选依赖
+    h11 = None
+
+from ipool.config import settings
+
+logger = logging.getLogger(__name__)
+
+HEAD_TERMINATOR = b"\r\n\r\n"
+
+
+class HttpParseError(ValueError):
+    """请求不合法，status 为返回给客户端的状态码"""
+    
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+class HttpMessage:
+    """请求头或响应头，按小写名称索引"""
+    
+    __slots__ = ("version", "headers", "_index")
+    
+    def __init__(self, version: str, headers: List[Tuple[str, str]]):
+        self.version = version
+        # 保持原始大小写和顺序，用于转发
+        self.headers = headers
+        self._index: Dict[str, List[str]] = {}
+        for name, value in headers:
+            self._index.setdefault(name.lower(), []).append(value)
+    
+    def get(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        """获取请求头的值，出现多次时以逗号连接"""
+        values = self._index.get(name)
+        if not values:
+            return default
+        return values[0] if len(values) == 1 else ", ".join(values)
+    
+    def get_all(self, name: str) -> List[str]:
+        return self._index.get(name, [])
+    
+    def __contains__(self, name: str) -> bool:
+        return name in self._index
+    
+    @property
+    def transfer_codings(self) -> List[str]:
+        """Transfer-Encoding 中按顺序列出的编码（可能分布在多个头中）"""
+        return [
+            token.strip().lower()
+            for value in self.get_all("transfer-encoding")
+            for token in value.split(",")
+            if token.strip()
+        ]
+    
+    @property
+    def chunked(self) -> bool:
+        """消息体是否使用 chunked 编码（chunked 必须是最后一个编码）"""
+        codings = self.transfer_codings
+        return bool(codings) and codings[-1] == "chunked"
+    
+    @property
+    def content_length(self) -> Optional[int]:
+        """Content-Length，未声明时返回 None"""
+        values = self._index.get("content-length")
+        if not values:
+            return None
+        lengths = {value.strip() for value in values}
+        if len(lengths) != 1:
+            raise HttpParseError("Content-Length 不一致")
+        length = lengths.pop()
+        if not length.isdigit():
+            raise HttpParseError(f"无效的 Content-Length: {length}")
+        return int(length)
+    
+    def _connection_tokens(self, *names: str) -> str:
+        return ",".join(self.get(name, "") for name in names).lower()
+
+
+class HttpRequest(HttpMessage):
+    """解析后的请求行和请求头"""
+    
+    __slots__ = ("method", "target")
+    
+    def __init__(self, method: str, target: str, version: str, headers: List[Tuple[str, str]]):
+        super().__init__(version, headers)
+        self.method = method
+        self.target = target
+    
+    @property
+    def keep_alive(self) -> bool:
+        """客户端是否希望保持连接"""
+        connection = self._connection_tokens("connection", "proxy-connection")
+        if self.version == "HTTP/1.1":
+            return "close" not in connection
+        return "keep-alive" in connection
+    
+    def __repr__(self) -> str:
+        return f"<HttpRequest {self.method} {self.target} {self.version}>"
+
+
+class HttpResponse(HttpMessage):
+    """解析后的状态行和响应头"""
+    
+    __slots__ = ("status",)
+    
+    def __init__(self, status: int, version: str, headers: List[Tuple[str, str]]):
+        super().__init__(version, headers)
+        self.status = status
+    
+    @property
+    def keep_alive(self) -> bool:
+        """上游是否允许继续复用连接"""
+        connection = self._connection_tokens("connection")
+        if self.version == "HTTP/1.1":
+            return "close" not in connection
+        return "keep-alive" in connection
+
+
+def _split_headers(lines: List[str]) -> List[Tuple[str, str]]:
+    headers = []
+    for line in lines:
+        if not line:
+            continue
+        if line[0] in " \t":
+            raise HttpParseError("不支持折叠的消息头")
+        name, sep, value = line.partition(":")
+        if not sep or not name or name != name.strip():
+            raise HttpParseError(f"无效的消息头: {line[:100]}")
+        headers.append((name, value.strip()))
+    return headers
+
+
+def _parse_python(head: bytes) -> HttpRequest:
+    """纯 Python 实现"""
+    lines = head.decode("latin-1").split("\r\n")
+    parts = lines[0].split(" ")
+    if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+        raise HttpParseError(f"无效的请求行: {lines[0][:100]}")
+    method, target, version = parts
+    return HttpRequest(method, target, version.upper(), _split_headers(lines[1:]))
+
+
+class _HttptoolsCallbacks:
+    __slots__ = ("url", "headers")
+    
+    def __init__(self):
+        self.url = b""
+        self.headers: List[Tuple[str, str]] = []
+    
+    def on_url(self, url: bytes):
+        self.url += url
+    
+    def on_header(self, name: bytes, value: bytes):
+        self.headers.append((name.decode("latin-1"), value.decode("latin-1").strip()))
+
+
+def _parse_httptools(head: bytes) -> HttpRequest:
+    """httptools (llhttp) 实现"""
+    callbacks = _HttptoolsCallbacks()
+    parser = httptools.HttpRequestParser(callbacks)
+    try:
+        parser.feed_data(head)
+    except httptools.HttpParserUpgrade:
+        # CONNECT 和 Upgrade 请求在请求头结束处停止解析
+        pass
+    except httptools.HttpParserError as e:
+        raise HttpParseError(f"无效的请求: {str(e)}") from e
+    version = parser.get_http_version()
+    # llhttp 把没有版本号的请求行当作 HTTP/0.9 接受，与其它实现保持一致拒绝
+    if not version.startswith("1."):
+        raise HttpParseError(f"不支持的 HTTP 版本: {version}")
+    return HttpRequest(
+        parser.get_method().decode("latin-1"),
+        callbacks.url.decode("latin-1"),
+        f"HTTP/{version}",
+        callbacks.headers
+    )
+
+
+def _parse_h11(head: bytes) -> HttpRequest:
+    """h11 实现"""
+    # h11 会合并折叠的消息头，与其它实现保持一致拒绝
+    if b"\r\n " in head or b"\r\n\t" in head:
+        raise HttpParseError("不支持折叠的消息头")
+    conn = h11.Connection(h11.SERVER, max_incomplete_event_size=len(head) + 1)
+    conn.receive_data(head)
+    try:
+        event = conn.next_event()
+    except h11.RemoteProtocolError as e:
+        raise HttpParseError(f"无效的请求: {str(e)}") from e
+    if not isinstance(event, h11.Request):
+        raise HttpParseError("无效的请求")
+    return HttpRequest(
+        event.method.decode("latin-1"),
+        event.target.decode("latin-1"),
+        f"HTTP/{event.http_version.decode('latin-1')}",
+        [(name.decode("latin-1"), value.decode("latin-1")) for name, value in event.headers.raw_items()]
+    )
+
+
+_BACKENDS = {
+    "python": _parse_python,
+    "httptools": _parse_httptools if httptools is not None else None,
+    "h11": _parse_h11 if h11 is not None else None,
+}
+
+
+def _select_backend():
+    name = settings.http_parser
+    if name == "auto":
+        name = "python"
+    backend = _BACKENDS.get(name)
+    if backend is None:
+        logger.warning(f"HTTP解析器 {name} 不可用，使用纯 Python 实现")
+        return _parse_python
+    return backend
+
+
+parse_request_head = _select_backend()
+
+
+async def read_request(reader: asyncio.StreamReader) -> Optional[HttpRequest]:
+    """
+    读取并解析一个请求头块
+    客户端在请求之间正常关闭连接时返回 None
+    """
+    head = b""
+    while not head:
+        try:
+            head = await reader.readuntil(HEAD_TERMINATOR)
+        except asyncio.IncompleteReadError as e:
+            if not e.partial.strip():
+                return None
+            raise HttpParseError("请求头不完整") from e
+        except asyncio.LimitOverrunError as e:
+            raise HttpParseError("请求头过大", 431) from e
+        # 请求之间允许出现多余的空行
+        head = head.lstrip(b"\r\n")
+    
+    if len(head) > settings.http_max_header_size:
+        raise HttpParseError("请求头过大", 431)
+    
+    request = parse_request_head(head)
+    if len(request.headers) > settings.http_max_headers:
+        raise HttpParseError("请求头数量过多", 431)
+    _check_framing(request)
+    return request
+
+
+def _check_framing(request: HttpRequest):
+    """
+    检查请求体的边界是否明确
+    同时带有 Transfer-Encoding 和 Content-Length，或 chunked 不是最后一个编码时，
+    代理与上游对请求体边界的理解可能不一致（请求走私），直接拒绝
+    """
+    if "transfer-encoding" not in request:
+        return
+    if not request.chunked:
+        raise HttpParseError("请求的 Transfer-Encoding 必须以 chunked 结尾")
+    if "content-length" in request:
+        raise HttpParseError("请求同时带有 Transfer-Encoding 和 Content-Length")
+
+
+def parse_response_head(head: bytes) -> HttpResponse:
+    """解析上游的状态行和响应头"""
+    lines = head.decode("latin-1").split("\r\n")
+    parts = lines[0].split(None, 2)
+    if len(parts) < 2 or not parts[1].isdigit() or not parts[0].startswith("HTTP/"):
+        raise HttpParseError(f"无效的响应行: {lines[0][:100]}", 502)
+    return HttpResponse(int(parts[1]), parts[0].upper(), _split_headers(lines[1:]))
@@ -0,0 +1,282 @@
+import asyncio
+import logging
+import socket
+import ssl
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Set, Tuple
+
+from ipool.config import settings
+from ipool.node.registry import NodeSnapshot, node_registry
+
+logger = logging.getLogger(__name__)
+
+_ssl_context: Optional[ssl.SSLContext] = None
+
+
+def _get_ssl_context() -> ssl.SSLContext:
+    """与 https 节点握手使用的 SSL 上下文（加载证书开销较大，只创建一次）"""
+    global _ssl_context
+    if _ssl_context is None:
+        _ssl_context = ssl.create_default_context()
+    return _ssl_context
+
+
+def _socket_alive(sock: socket.socket) -> bool:
+    """检查空闲 socket 是否仍然可用（对端未关闭且没有未读数据）"""
+    try:
+        sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT)
+    except BlockingIOError:
+        return True
+    except OSError:
+        return False
+    # 读到 EOF 或代理主动发来了数据，都不能再使用
+    return False
+
+
+def stream_alive(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+    """检查空闲流是否仍然可用"""
+    if writer.is_closing() or reader.at_eof():
+        return False
+    # 空闲期间代理主动发来的数据留在 StreamReader 的缓冲区中（没有公开接口，取不到时忽略）
+    return not getattr(reader, "_buffer", None)
+
+
+def _close_stream(writer: asyncio.StreamWriter):
+    try:
+        writer.close()
+    except Exception:
+        pass
+
+
+class _NodePool:
+    """单个代理节点的连接池"""
+    
+    __slots__ = ("sockets", "streams", "idle", "refilling", "last_used")
+    
+    def __init__(self):
+        # 预热的 TCP 连接（http/socks 节点，握手前的原始 socket）
+        self.sockets: Deque[Tuple[socket.socket, float]] = deque()
+        # 预热的 TLS 连接（https 节点，握手前的流）
+        self.streams: Deque[Tuple[asyncio.StreamReader, asyncio.StreamWriter, float]] = deque()
+        # 可复用的 keep-alive 连接，按用途分组
+        self.idle: Dict[str, Deque[Tuple[asyncio.StreamReader, asyncio.StreamWriter, float]]] = {}
+        self.refilling = False
+        self.last_used = time.monotonic()
+
+
+class UpstreamPool:
+    """
+    上游代理节点连接池
+    
+    - 预热连接：节点被使用后，后台补足 warm_size 个已连通节点的空闲连接
+      （http/socks 节点为原始 TCP socket，供 python-socks 在其上握手；
+      https 节点为已完成 TLS 握手的流），下一次请求省去建连耗时。
+    - keep-alive 连接：转发普通 HTTP 请求后仍可复用的连接，按用途键归还和取出。
+    
+    只为最近使用过的节点保持预热，超过 idle_ttl 的空闲连接和不再可用节点的连接
+    由后台任务定期关闭。
+    """
+    
+    def __init__(
+        self,
+        warm_size: int = None,
+        max_idle: int = None,
+        idle_ttl: float = None,
+        maintain_interval: float = None
+    ):
+        self.warm_size = settings.pool_warm_size if warm_size is None else warm_size
+        self.max_idle = settings.pool_max_idle if max_idle is None else max_idle
+        self.idle_ttl = idle_ttl or settings.pool_idle_ttl
+        self.maintain_interval = maintain_interval or settings.pool_maintain_interval
+        self._pools: Dict[int, _NodePool] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._running = False
+    
+    def _pool(self, proxy_node: NodeSnapshot) -> _NodePool:
+        pool = self._pools.get(proxy_node.id)
+        if pool is None:
+            pool = self._pools[proxy_node.id] = _NodePool()
+        pool.last_used = time.monotonic()
+        return pool
+    
+    async def connect_socket(self, proxy_node: NodeSnapshot) -> Tuple[socket.socket, bool]:
+        """
+        获取一个已连通代理节点的 TCP socket
+        返回 (socket, 是否来自预热连接)
+        """
+        pool = self._pool(proxy_node)
+        now = time.monotonic()
+        sock = None
+        while pool.sockets:
+            candidate, created = pool.sockets.popleft()
+            if now - created <= self.idle_ttl and _socket_alive(candidate):
+                sock = candidate
+                break
+            candidate.close()
+        self._schedule_refill(proxy_node, pool, tls=False)
+        
+        if sock is not None:
+            return sock, True
+        return await self.open_socket(proxy_node), False
+    
+    async def connect_tls(self, proxy_node: NodeSnapshot) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter, bool]:
+        """
+        获取一个已与代理节点完成 TLS 握手的流
+        返回 (reader, writer, 是否来自预热连接)
+        """
+        pool = self._pool(proxy_node)
+        now = time.monotonic()
+        conn = None
+        while pool.streams:
+            reader, writer, created = pool.streams.popleft()
+            if now - created <= self.idle_ttl and stream_alive(reader, writer):
+                conn = reader, writer
+                break
+            _close_stream(writer)
+        self._schedule_refill(proxy_node, pool, tls=True)
+        
+        if conn is not None:
+            return conn[0], conn[1], True
+        reader, writer = await self.open_tls(proxy_node)
+        return reader, writer, False
+    
+    def checkout(self, proxy_node: NodeSnapshot, key: str) -> Optional[Tuple[asyncio.StreamReader, asyncio.StreamWriter]]:
+        """取出一个可复用的 keep-alive 连接"""
+        pool = self._pools.get(proxy_node.id)
+        if pool is None:
+            return None
+        conns = pool.idle.get(key)
+        now = time.monotonic()
+        while conns:
+            reader, writer, since = conns.pop()
+            if now - since <= self.idle_ttl and stream_alive(reader, writer):
+                pool.last_used = now
+                return reader, writer
+            _close_stream(writer)
+        return None
+    
+    def checkin(self, proxy_node: NodeSnapshot, key: str, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """归还一个可复用的 keep-alive 连接"""
+        if not stream_alive(reader, writer) or node_registry.get(proxy_node.id) is None:
+            _close_stream(writer)
+            return
+        pool = self._pool(proxy_node)
+        conns = pool.idle.setdefault(key, deque())
+        conns.append((reader, writer, time.monotonic()))
+        while len(conns) > self.max_idle:
+            _close_stream(conns.popleft()[1])
+    
+    async def open_socket(self, proxy_node: NodeSnapshot) -> socket.socket:
+        """建立到代理节点的 TCP 连接"""
+        loop = asyncio.get_running_loop()
+        infos = await loop.getaddrinfo(proxy_node.host, proxy_node.port, type=socket.SOCK_STREAM)
+        error: Optional[OSError] = None
+        for family, type_, proto, _, address in infos:
+            sock = socket.socket(family, type_, proto)
+            sock.setblocking(False)
+            try:
+                await loop.sock_connect(sock, address)
+                return sock
+            except OSError as e:
+                sock.close()
+                error = e
+            except BaseException:
+                sock.close()
+                raise
+        raise error or OSError(f"无法解析代理节点地址: {proxy_node.host}")
+    
+    async def open_tls(self, proxy_node: NodeSnapshot) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        """建立到代理节点的 TLS 连接"""
+        return await asyncio.open_connection(
+            proxy_node.host,
+            proxy_node.port,
+            ssl=_get_ssl_context(),
+            server_hostname=proxy_node.host
+        )
+    
+    def _schedule_refill(self, proxy_node: NodeSnapshot, pool: _NodePool, tls: bool):
+        """在后台补足节点的预热连接"""
+        if pool.refilling or not self.warm_size or not self._running:
+            return
+        pool.refilling = True
+        task = asyncio.create_task(self._refill(proxy_node, pool, tls))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+    
+    async def _refill(self, proxy_node: NodeSnapshot, pool: _NodePool, tls: bool):
+        try:
+            warm = pool.streams if tls else pool.sockets
+            while len(warm) < self.warm_size and self._pools.get(proxy_node.id) is pool:
+                timeout = settings.upstream_connect_timeout
+                if tls:
+                    reader, writer = await asyncio.wait_for(self.open_tls(proxy_node), timeout)
+                    warm.append((reader, writer, time.monotonic()))
+                else:
+                    sock = await asyncio.wait_for(self.open_socket(proxy_node), timeout)
+                    warm.append((sock, time.monotonic()))
+        except (OSError, ssl.SSLError, asyncio.TimeoutError) as e:
+            logger.debug(f"预热代理节点 {proxy_node.host}:{proxy_node.port} 连接失败: {str(e)}")
+        finally:
+            pool.refilling = False
+    
+    async def start(self):
+        """启动连接池维护循环"""
+        if self._running:
+            return
+        
+        self._running = True
+        logger.info(f"上游连接池启动，每节点预热连接数: {self.warm_size}，空闲超时: {self.idle_ttl}秒")
+        
+        while self._running:
+            try:
+                await asyncio.sleep(self.maintain_interval)
+                self.evict()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"维护上游连接池时发生错误: {str(e)}", exc_info=True)
+    
+    async def stop(self):
+        """停止维护循环并关闭所有连接"""
+        self._running = False
+        for task in list(self._tasks):
+            task.cancel()
+        for node_id in list(self._pools):
+            self.discard(node_id)
+    
+    def evict(self):
+        """关闭超时的空闲连接，丢弃不再可用或长期未使用节点的连接池"""
+        now = time.monotonic()
+        for node_id, pool in list(self._pools.items()):
+            node = node_registry.get(node_id)
+            if node is None or not node.available or now - pool.last_used > self.idle_ttl:
+                self.discard(node_id)
+                continue
+            
+            while pool.sockets and (now - pool.sockets[0][1] > self.idle_ttl or not _socket_alive(pool.sockets[0][0])):
+                pool.sockets.popleft()[0].close()
+            while pool.streams and (now - pool.streams[0][2] > self.idle_ttl or not stream_alive(*pool.streams[0][:2])):
+                _close_stream(pool.streams.popleft()[1])
+            for key, conns in list(pool.idle.items()):
+                while conns and (now - conns[0][2] > self.idle_ttl or not stream_alive(*conns[0][:2])):
+                    _close_stream(conns.popleft()[1])
+                if not conns:
+                    del pool.idle[key]
+    
+    def discard(self, node_id: int):
+        """关闭节点的所有池化连接"""
+        pool = self._pools.pop(node_id, None)
+        if pool is None:
+            return
+        for sock, _ in pool.sockets:
+            sock.close()
+        for _, writer, _ in pool.streams:
+            _close_stream(writer)
+        for conns in pool.idle.values():
+            for _, writer, _ in conns:
+                _close_stream(writer)
+
+
+# 全局上游连接池实例
+upstream_pool = UpstreamPool()
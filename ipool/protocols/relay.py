@@ -0,0 +1,434 @@
+"""
+隧道数据转发引擎
+
+客户端与上游的握手完成后，两条连接的数据转发不再经过 StreamReader/StreamWriter：
+
+- 通用路径：把两个 transport 的协议替换为 BufferedProtocol，数据直接读入
+  预分配的缓冲区（memoryview），在回调中写入对端 transport；对端没能立即发完时
+  写队列会引用这块缓冲区，此时改用新的缓冲区。流量控制通过对端的
+  pause_writing/resume_writing 暂停或恢复本端读取，不需要 await drain()。
+- Linux 快速路径：两端都是明文 TCP 时使用 os.splice 经由管道在内核中搬运数据，
+  数据不进入用户态。
+
+缓冲区大小按连接自适应：大流量时逐步增大，交互式的小数据量连接保持在下限附近。
+"""
+import asyncio
+import fcntl
+import logging
+import os
+import socket
+from typing import Optional, Tuple
+
+from ipool.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 内核是否支持 splice(2)
+HAS_SPLICE = hasattr(os, "splice")
+
+# 转发开始前每次从 StreamReader 取出的最大字节数
+MAX_TAKE = 65536
+
+if HAS_SPLICE:
+    _SPLICE_FLAGS = os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK
+
+
+def tune_connection(writer: asyncio.StreamWriter):
+    """按配置设置 TCP 连接的 TCP_NODELAY 和收发缓冲区大小"""
+    sock = writer.get_extra_info("socket")
+    if sock is None or sock.family not in (socket.AF_INET, socket.AF_INET6):
+        return
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 if settings.tcp_nodelay else 0)
+        if settings.relay_sndbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, settings.relay_sndbuf)
+        if settings.relay_rcvbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, settings.relay_rcvbuf)
+    except OSError as e:
+        logger.debug(f"设置socket选项失败: {str(e)}")
+
+
+class AdaptiveBuffer:
+    """
+    按连接自适应大小的读缓冲区
+    
+    一次读取填满缓冲区说明对端还有更多数据，缓冲区加倍（不超过上限）；
+    连续多次读取不足四分之一时减半（不低于下限），空闲和交互式连接只占用少量内存。
+    """
+    
+    __slots__ = ("minimum", "maximum", "size", "_small_reads", "_buffer")
+    
+    # 连续多少次小读取后缩小缓冲区
+    SHRINK_AFTER = 4
+    
+    def __init__(self, minimum: Optional[int] = None, maximum: Optional[int] = None):
+        self.minimum = minimum or settings.relay_buffer_min
+        self.maximum = max(self.minimum, maximum or settings.relay_buffer_max)
+        self.size = self.minimum
+        self._small_reads = 0
+        self._buffer: Optional[memoryview] = None
+    
+    def record(self, nbytes: int):
+        """记录一次读取的字节数，调整缓冲区大小"""
+        if nbytes >= self.size:
+            self._small_reads = 0
+            self.size = min(self.size * 2, self.maximum)
+        elif nbytes < self.size // 4:
+            self._small_reads += 1
+            if self._small_reads >= self.SHRINK_AFTER:
+                self._small_reads = 0
+                self.size = max(self.size // 2, self.minimum)
+        else:
+            self._small_reads = 0
+    
+    def detach(self):
+        """放弃当前缓冲区（仍被 transport 的写队列引用），下一次读取分配新的缓冲区"""
+        self._buffer = None
+    
+    def view(self) -> memoryview:
+        """当前大小的缓冲区，大小变化时重新分配"""
+        if self._buffer is None or len(self._buffer) != self.size:
+            self._buffer = memoryview(bytearray(self.size))
+        return self._buffer
+
+
+class _RelayProtocol(asyncio.BufferedProtocol):
+    """
+    转发连接的一个方向：从本端 transport 读取，写入对端 transport
+    
+    替换 transport 的协议后，原 StreamReaderProtocol 不再收到回调，
+    连接关闭时需要转交给它，StreamWriter.wait_closed() 才能正常返回。
+    """
+    
+    def __init__(self, relay: "_Relay", transport: asyncio.Transport):
+        self.relay = relay
+        self.transport = transport
+        self.peer: Optional["_RelayProtocol"] = None
+        self.eof = False
+        self.closed = False
+        self.bytes = 0
+        self._buffer = AdaptiveBuffer()
+        self._stream_protocol = transport.get_protocol()
+    
+    def get_buffer(self, sizehint: int) -> memoryview:
+        return self._buffer.view()
+    
+    def buffer_updated(self, nbytes: int):
+        self.bytes += nbytes
+        data = self._buffer.view()[:nbytes]
+        self._buffer.record(nbytes)
+        transport = self.peer.transport
+        if transport.is_closing():
+            return
+        if transport.get_write_buffer_size():
+            # 对端写队列中已有数据，本次数据只会排队，复制一份后缓冲区才能复用
+            transport.write(bytes(data))
+            return
+        transport.write(data)
+        if transport.get_write_buffer_size():
+            # 没能立即发完。Python 3.12 起 transport 不复制剩余部分，而是保存指向
+            # 缓冲区的视图，下一次读取前必须换一块新的缓冲区
+            self._buffer.detach()
+    
+    def eof_received(self) -> bool:
+        self.eof = True
+        keep_open = self.relay.half_close(self)
+        # TLS 连接不支持保持半关闭，返回 True 只会产生警告
+        return keep_open and self.transport.get_extra_info("sslcontext") is None
+    
+    def pause_writing(self):
+        # 本端写缓冲区已满，暂停读取对端
+        self.peer.transport.pause_reading()
+    
+    def resume_writing(self):
+        self.peer.transport.resume_reading()
+    
+    def connection_lost(self, exc: Optional[Exception]):
+        self.closed = True
+        if exc is not None:
+            logger.debug(f"转发连接断开: {str(exc)}")
+        try:
+            self._stream_protocol.connection_lost(exc)
+        finally:
+            self.relay.lost(self)
+
+
+class _Relay:
+    """基于 BufferedProtocol 的双向转发"""
+    
+    def __init__(self, client_transport, upstream_transport):
+        loop = asyncio.get_running_loop()
+        self.done = loop.create_future()
+        self.upload = _RelayProtocol(self, client_transport)
+        self.download = _RelayProtocol(self, upstream_transport)
+        self.upload.peer = self.download
+        self.download.peer = self.upload
+    
+    def start(self, client_eof: bool, upstream_eof: bool):
+        """替换协议并恢复读取"""
+        for leg in (self.upload, self.download):
+            leg.transport.set_protocol(leg)
+        
+        for leg, eof in ((self.upload, client_eof), (self.download, upstream_eof)):
+            if eof:
+                leg.eof = True
+                if not self.half_close(leg):
+                    leg.transport.close()
+            else:
+                leg.transport.resume_reading()
+    
+    def half_close(self, leg: _RelayProtocol) -> bool:
+        """
+        一个方向读到 EOF，向对端发送 EOF
+        返回 True 表示保持连接（等待另一方向结束）
+        """
+        peer = leg.peer
+        if peer.eof:
+            # 两个方向都已结束
+            leg.transport.close()
+            peer.transport.close()
+            return False
+        if peer.transport.is_closing() or not peer.transport.can_write_eof():
+            # TLS 等不支持半关闭的连接直接关闭
+            peer.transport.close()
+            return False
+        peer.transport.write_eof()
+        return True
+    
+    def lost(self, leg: _RelayProtocol):
+        """一端连接关闭，关闭另一端；两端都关闭后转发结束"""
+        if not leg.peer.closed:
+            leg.peer.transport.close()
+        elif not self.done.done():
+            self.done.set_result((self.upload.bytes, self.download.bytes))
+    
+    def abort(self):
+        for leg in (self.upload, self.download):
+            leg.transport.abort()
+
+
+class _SpliceLeg:
+    """
+    splice 转发的一个方向：源 socket -> 管道 -> 目标 socket
+    
+    事件循环中注册的是复制出来的文件描述符，不会与 transport 自身的注册冲突。
+    目标 socket 写满时停止读取源 socket，等待可写后再继续，实现背压。
+    """
+    
+    def __init__(self, relay: "_SpliceRelay", src_fd: int, dst_fd: int, dst_sock, chunk_size: int):
+        self.relay = relay
+        self.src_fd = src_fd
+        self.dst_fd = dst_fd
+        self.dst_sock = dst_sock
+        self.chunk_size = chunk_size
+        self.pipe_r, self.pipe_w = os.pipe()
+        os.set_blocking(self.pipe_r, False)
+        os.set_blocking(self.pipe_w, False)
+        try:
+            # 管道默认容量为 64KiB，按上限放大；内存只在数据实际写入时占用
+            fcntl.fcntl(self.pipe_w, fcntl.F_SETPIPE_SZ, chunk_size)
+        except (AttributeError, OSError):
+            pass
+        self.pending = 0
+        self.bytes = 0
+        self.eof = False
+        self.finished = False
+    
+    def start(self):
+        self.relay.loop.add_reader(self.src_fd, self._on_readable)
+    
+    def _on_readable(self):
+        try:
+            n = os.splice(self.src_fd, self.pipe_w, self.chunk_size, flags=_SPLICE_FLAGS)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self.relay.fail(e)
+            return
+        
+        if n == 0:
+            self.relay.loop.remove_reader(self.src_fd)
+            self.eof = True
+            if not self.pending:
+                self._finish()
+            return
+        
+        self.pending += n
+        self.bytes += n
+        self._flush()
+    
+    def _on_writable(self):
+        self._flush()
+    
+    def _flush(self):
+        loop = self.relay.loop
+        while self.pending:
+            try:
+                n = os.splice(self.pipe_r, self.dst_fd, self.pending, flags=_SPLICE_FLAGS)
+            except BlockingIOError:
+                # 目标写满，停止读取源连接直到可写
+                loop.remove_reader(self.src_fd)
+                loop.add_writer(self.dst_fd, self._on_writable)
+                return
+            except OSError as e:
+                self.relay.fail(e)
+                return
+            self.pending -= n
+        
+        loop.remove_writer(self.dst_fd)
+        if self.eof:
+            self._finish()
+        else:
+            loop.add_reader(self.src_fd, self._on_readable)
+    
+    def _finish(self):
+        """源连接已结束且数据已全部发出，半关闭目标连接"""
+        self.finished = True
+        try:
+            self.dst_sock.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+        self.relay.leg_finished()
+    
+    def close(self):
+        loop = self.relay.loop
+        loop.remove_reader(self.src_fd)
+        loop.remove_writer(self.dst_fd)
+        os.close(self.pipe_r)
+        os.close(self.pipe_w)
+
+
+class _SpliceRelay:
+    """基于 os.splice 的双向转发（仅 Linux 明文 TCP）"""
+    
+    def __init__(self, client_sock, upstream_sock, chunk_size: int):
+        self.loop = asyncio.get_running_loop()
+        self.done = self.loop.create_future()
+        # 复制出独立的 socket 对象，事件循环注册和半关闭都在副本上进行
+        # （uvloop 的 transport 只暴露不支持 shutdown 的伪 socket）
+        self._socks = [socket.fromfd(sock.fileno(), sock.family, sock.type) for sock in (client_sock, upstream_sock)]
+        client, upstream = self._socks
+        self.upload = _SpliceLeg(self, client.fileno(), upstream.fileno(), upstream, chunk_size)
+        self.download = _SpliceLeg(self, upstream.fileno(), client.fileno(), client, chunk_size)
+    
+    def start(self, client_eof: bool, upstream_eof: bool):
+        for leg, eof in ((self.upload, client_eof), (self.download, upstream_eof)):
+            if eof:
+                leg.eof = True
+                leg._finish()
+            else:
+                leg.start()
+    
+    def leg_finished(self):
+        if self.upload.finished and self.download.finished:
+            self._complete()
+    
+    def fail(self, exc: Exception):
+        logger.debug(f"splice 转发中断: {str(exc)}")
+        self._complete()
+    
+    def _complete(self):
+        if self.done.done():
+            return
+        self.done.set_result((self.upload.bytes, self.download.bytes))
+    
+    def close(self):
+        self.upload.close()
+        self.download.close()
+        for sock in self._socks:
+            sock.close()
+        self._socks = []
+
+
+async def _take_buffered(
+    reader: asyncio.StreamReader, transport: asyncio.Transport
+) -> Tuple[bytes, bool]:
+    """
+    取出 StreamReader 中已读入但尚未消费的数据，以及是否已读到 EOF
+    
+    只使用公开接口：transport 已暂停读取，缓冲区中有数据时 read() 在第一次调度时
+    就会返回；缓冲区为空时 read() 会等待新数据，让出一次事件循环后仍未完成即取消。
+    StreamReader 因缓冲区过大自行暂停过读取时，read() 会恢复读取，因此每次读取后
+    重新暂停。
+    """
+    chunks = []
+    while not reader.at_eof():
+        read = asyncio.ensure_future(reader.read(MAX_TAKE))
+        await asyncio.sleep(0)
+        transport.pause_reading()
+        if not read.done():
+            read.cancel()
+            try:
+                await read
+            except asyncio.CancelledError:
+                if not read.cancelled():
+                    raise
+            break
+        data = read.result()
+        if not data:
+            break
+        chunks.append(data)
+    return b"".join(chunks), reader.at_eof()
+
+
+def _can_splice(client_writer: asyncio.StreamWriter, upstream_writer: asyncio.StreamWriter) -> bool:
+    """两端都是明文 TCP socket 时才能使用 splice"""
+    if not (HAS_SPLICE and settings.relay_splice):
+        return False
+    for writer in (client_writer, upstream_writer):
+        if writer.get_extra_info("sslcontext") is not None:
+            return False
+        sock = writer.get_extra_info("socket")
+        if sock is None or sock.type != socket.SOCK_STREAM:
+            return False
+    return True
+
+
+async def relay(
+    client_reader: asyncio.StreamReader,
+    client_writer: asyncio.StreamWriter,
+    upstream_reader: asyncio.StreamReader,
+    upstream_writer: asyncio.StreamWriter
+) -> Tuple[int, int]:
+    """
+    在客户端与上游之间双向转发数据，直到两端都关闭
+    
+    返回 (上行字节数, 下行字节数)。
+    """
+    client_transport = client_writer.transport
+    upstream_transport = upstream_writer.transport
+    
+    # 暂停读取后 StreamReader 中的数据不再变化，先把它们发给对端
+    client_transport.pause_reading()
+    upstream_transport.pause_reading()
+    client_data, client_eof = await _take_buffered(client_reader, client_transport)
+    upstream_data, upstream_eof = await _take_buffered(upstream_reader, upstream_transport)
+    if client_data:
+        upstream_writer.write(client_data)
+    if upstream_data:
+        client_writer.write(upstream_data)
+    await asyncio.gather(client_writer.drain(), upstream_writer.drain())
+    
+    if _can_splice(client_writer, upstream_writer):
+        engine = _SpliceRelay(
+            client_writer.get_extra_info("socket"),
+            upstream_writer.get_extra_info("socket"),
+            settings.relay_buffer_max
+        )
+    else:
+        engine = _Relay(client_transport, upstream_transport)
+    
+    engine.start(client_eof, upstream_eof)
+    try:
+        uploaded, downloaded = await engine.done
+    except asyncio.CancelledError:
+        if isinstance(engine, _Relay):
+            engine.abort()
+        raise
+    finally:
+        if isinstance(engine, _SpliceRelay):
+            engine.close()
+            client_writer.close()
+            upstream_writer.close()
+    
+    return uploaded + len(client_data), downloaded + len(upstream_data)
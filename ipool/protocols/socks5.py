@@ -5,7 +5,9 @@ import struct
 from typing import Optional, Tuple
 
 from ipool.protocols.base import ProxyServer
-from ipool.node.models import ProxyNode
+from ipool.protocols.relay import relay, tune_connection
+from ipool.protocols.upstream import UpstreamError
+from ipool.scheduler.filters import NodeFilter
 
 logger = logging.getLogger(__name__)
 
@@ -13,6 +15,8 @@ logger = logging.getLogger(__name__)
 SOCKS_VER = 0x05
 SOCKS_AUTH_NONE = 0x00
 SOCKS_AUTH_USERNAME_PASSWORD = 0x02
+SOCKS_AUTH_NO_ACCEPTABLE = 0xFF
+SOCKS_AUTH_SUBNEGOTIATION_VER = 0x01
 SOCKS_CMD_CONNECT = 0x01
 SOCKS_ATYP_IPV4 = 0x01
 SOCKS_ATYP_DOMAINNAME = 0x03
@@ -29,6 +33,14 @@ SOCKS_TTL_EXPIRED = 0x06
 SOCKS_COMMAND_NOT_SUPPORTED = 0x07
 SOCKS_ADDRESS_TYPE_NOT_SUPPORTED = 0x08
 
+# 上游连接失败原因对应的 SOCKS5 响应码
+UPSTREAM_ERROR_REPLIES = {
+    UpstreamError.TIMEOUT: SOCKS_HOST_UNREACHABLE,
+    UpstreamError.REFUSED: SOCKS_CONNECTION_REFUSED,
+    UpstreamError.UNREACHABLE: SOCKS_NETWORK_UNREACHABLE,
+    UpstreamError.PROXY: SOCKS_GENERAL_FAILURE,
+}
+
 
 class Socks5Server(ProxyServer):
     """SOCKS5 代理服务器实现"""
@@ -38,7 +50,9 @@ class Socks5Server(ProxyServer):
         return await asyncio.start_server(
             self.handle_client,
             self.host,
-            self.port
+            self.port,
+            reuse_port=self.reuse_port,
+            backlog=self.backlog
         )
     
     async def _run_server(self):
@@ -50,26 +64,28 @@ class Socks5Server(ProxyServer):
         """处理SOCKS5客户端连接"""
         client_addr = writer.get_extra_info('peername')
         logger.debug(f"新的客户端连接: {client_addr}")
+        tune_connection(writer)
         
         try:
             # 验证方法协商
-            if not await self._handle_auth_negotiation(reader, writer):
+            ok, username = await self._handle_auth_negotiation(reader, writer)
+            if not ok:
                 return
             
-            # 处理客户端请求
-            if not await self._handle_client_request(reader, writer):
-                return
+            # 用户名中可以携带节点筛选条件，例如 country-US-tag-premium
+            node_filter = NodeFilter.parse(username)
+            if node_filter:
+                logger.debug(f"客户端指定节点筛选条件: {node_filter}")
             
-            # 获取代理节点
-            proxy_node = await self.get_proxy()
-            if not proxy_node:
-                logger.error("没有可用的代理节点")
-                await self._send_reply(writer, SOCKS_GENERAL_FAILURE)
+            # 处理客户端请求
+            target = await self._handle_client_request(reader, writer)
+            if not target:
                 return
+            target_addr, target_port = target
             
             # 建立与目标服务器的连接并转发流量
-            await self._handle_proxy_connection(reader, writer, proxy_node)
-            
+            await self._handle_proxy_connection(reader, writer, target_addr, target_port, node_filter)
+        
         except (asyncio.IncompleteReadError, ConnectionError) as e:
             logger.debug(f"连接错误: {str(e)}")
         except Exception as e:
@@ -79,68 +95,94 @@ class Socks5Server(ProxyServer):
             await writer.wait_closed()
             logger.debug(f"客户端连接关闭: {client_addr}")
     
-    async def _handle_auth_negotiation(self, reader, writer) -> bool:
-        """处理SOCKS5认证协商"""
+    async def _handle_auth_negotiation(self, reader, writer) -> Tuple[bool, Optional[str]]:
+        """
+        处理SOCKS5认证协商
+        返回 (是否成功, 客户端用户名)，用户名用于携带节点筛选条件
+        """
         try:
             # 接收客户端认证方法
             ver, nmethods = struct.unpack('!BB', await reader.readexactly(2))
             if ver != SOCKS_VER:
                 logger.warning(f"不支持的SOCKS版本: {ver}")
-                return False
+                return False, None
             
             methods = await reader.readexactly(nmethods)
             
-            # 目前只支持无认证模式
+            # 客户端提供用户名时优先使用用户名/密码方式，以便读取筛选条件
+            if SOCKS_AUTH_USERNAME_PASSWORD in methods:
+                writer.write(struct.pack('!BB', SOCKS_VER, SOCKS_AUTH_USERNAME_PASSWORD))
+                await writer.drain()
+                username = await self._handle_username_password_auth(reader, writer)
+                return username is not None, username
+            
             if SOCKS_AUTH_NONE not in methods:
                 # 发送不支持的认证方法响应
-                writer.write(struct.pack('!BB', SOCKS_VER, 0xFF))
+                writer.write(struct.pack('!BB', SOCKS_VER, SOCKS_AUTH_NO_ACCEPTABLE))
                 await writer.drain()
                 logger.warning("客户端不支持无认证模式")
-                return False
+                return False, None
             
             # 发送选择无认证模式的响应
             writer.write(struct.pack('!BB', SOCKS_VER, SOCKS_AUTH_NONE))
             await writer.drain()
-            return True
-            
+            return True, None
+        
         except Exception as e:
             logger.error(f"认证协商失败: {str(e)}")
-            return False
+            return False, None
     
-    async def _handle_client_request(self, reader, writer) -> bool:
-        """处理SOCKS5客户端请求"""
+    async def _handle_username_password_auth(self, reader, writer) -> Optional[str]:
+        """处理用户名/密码子协商 (RFC 1929)，返回用户名"""
+        ver, ulen = struct.unpack('!BB', await reader.readexactly(2))
+        if ver != SOCKS_AUTH_SUBNEGOTIATION_VER:
+            logger.warning(f"不支持的认证子协商版本: {ver}")
+            writer.write(struct.pack('!BB', SOCKS_AUTH_SUBNEGOTIATION_VER, 0x01))
+            await writer.drain()
+            return None
+        
+        username = (await reader.readexactly(ulen)).decode('utf-8', errors='ignore')
+        plen = (await reader.readexactly(1))[0]
+        await reader.readexactly(plen)  # 密码目前不做校验
+        
+        writer.write(struct.pack('!BB', SOCKS_AUTH_SUBNEGOTIATION_VER, 0x00))
+        await writer.drain()
+        return username
+    
+    async def _handle_client_request(self, reader, writer) -> Optional[Tuple[str, int]]:
+        """
+        处理SOCKS5客户端请求，返回目标地址和端口
+        成功响应在上游连接建立之后才发送
+        """
         try:
             # 解析客户端请求
             ver, cmd, rsv, atyp = struct.unpack('!BBBB', await reader.readexactly(4))
             
             if ver != SOCKS_VER:
                 logger.warning(f"不支持的SOCKS版本: {ver}")
-                return False
+                return None
             
             if cmd != SOCKS_CMD_CONNECT:
                 logger.warning(f"不支持的SOCKS命令: {cmd}")
                 await self._send_reply(writer, SOCKS_COMMAND_NOT_SUPPORTED)
-                return False
+                return None
             
             # 解析目标地址
             target_addr, target_port = await self._parse_target_address(reader, atyp)
             if not target_addr:
                 await self._send_reply(writer, SOCKS_ADDRESS_TYPE_NOT_SUPPORTED)
-                return False
+                return None
             
             logger.debug(f"目标连接请求: {target_addr}:{target_port}")
-            
-            # 发送成功响应
-            await self._send_reply(writer, SOCKS_SUCCESS)
-            return True
-            
+            return target_addr, target_port
+        
         except Exception as e:
             logger.error(f"处理客户端请求失败: {str(e)}")
             try:
                 await self._send_reply(writer, SOCKS_GENERAL_FAILURE)
             except:
                 pass
-            return False
+            return None
     
     async def _parse_target_address(self, reader, atyp) -> Tuple[Optional[str], int]:
         """解析目标地址和端口"""
@@ -177,47 +219,37 @@ class Socks5Server(ProxyServer):
         writer.write(response)
         await writer.drain()
     
-    async def _handle_proxy_connection(self, client_reader, client_writer, proxy_node: ProxyNode):
-        """处理代理连接和数据转发"""
-        # 此处应包含通过目标代理节点建立连接的逻辑
-        # 简单起见，这里仅展示基本框架
-        target_addr = writer.get_extra_info('target_addr')
-        target_port = writer.get_extra_info('target_port')
-        
-        logger.info(f"使用代理节点 {proxy_node.host}:{proxy_node.port} 连接到目标 {target_addr}:{target_port}")
+    async def _handle_proxy_connection(
+        self,
+        client_reader,
+        client_writer,
+        target_addr: str,
+        target_port: int,
+        node_filter: Optional[NodeFilter] = None
+    ):
+        """通过代理节点连接目标并转发数据"""
+        try:
+            # 通过代理节点完成到目标的上游握手，失败时自动换节点重试
+            upstream = await self.connect_target(target_addr, target_port, node_filter)
+        except UpstreamError as e:
+            logger.error(f"代理连接失败: {str(e)}")
+            await self._send_reply(client_writer, UPSTREAM_ERROR_REPLIES.get(e.kind, SOCKS_GENERAL_FAILURE))
+            return
+        if upstream is None:
+            logger.error("没有可用的代理节点")
+            await self._send_reply(client_writer, SOCKS_GENERAL_FAILURE)
+            return
+        proxy_node, proxy_reader, proxy_writer, connect_time = upstream
         
+        uploaded = downloaded = 0
         try:
-            # 创建与代理的连接
-            proxy_reader, proxy_writer = await asyncio.open_connection(
-                proxy_node.host, proxy_node.port
-            )
+            # 上游连通后才向客户端发送成功响应
+            await self._send_reply(client_writer, SOCKS_SUCCESS)
             
             # 双向转发数据
-            await asyncio.gather(
-                self._transfer_data(client_reader, proxy_writer),
-                self._transfer_data(proxy_reader, client_writer)
-            )
-        except Exception as e:
-            logger.error(f"代理连接失败: {str(e)}")
+            uploaded, downloaded = await relay(client_reader, client_writer, proxy_reader, proxy_writer)
         finally:
             proxy_writer.close()
-            await proxy_writer.wait_closed()
-    
-    async def _transfer_data(self, reader, writer):
-        """在两个连接之间传输数据"""
-        try:
-            while True:
-                data = await reader.read(8192)
-                if not data:
-                    break
-                writer.write(data)
-                await writer.drain()
-        except Exception as e:
-            logger.debug(f"数据传输错误: {str(e)}")
-        finally:
-            try:
-                writer.close()
-                await writer.wait_closed()
-            except:
-                pass
-
+            await self.scheduler.report_success(
+                proxy_node, connect_time, bytes_up=uploaded, bytes_down=downloaded
+            )
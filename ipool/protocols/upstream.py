@@ -0,0 +1,264 @@
+import asyncio
+import base64
+import inspect
+import logging
+import ssl
+from typing import Optional, Tuple
+
+from python_socks import ProxyConnectionError, ProxyError, ProxyTimeoutError, ProxyType
+from python_socks.async_.asyncio import Proxy
+
+from ipool.config import settings
+from ipool.node.models import ProxyProtocol
+from ipool.node.registry import NodeSnapshot
+from ipool.protocols.pool import upstream_pool
+from ipool.protocols.relay import tune_connection
+
+logger = logging.getLogger(__name__)
+
+# 通过 python-socks 完成握手的上游协议
+_PROXY_TYPES = {
+    ProxyProtocol.HTTP: ProxyType.HTTP,
+    ProxyProtocol.SOCKS4: ProxyType.SOCKS4,
+    ProxyProtocol.SOCKS5: ProxyType.SOCKS5,
+}
+
+# python-socks 能否在传入的 socket 上握手（2.x 的 _socket 参数，较新版本已移除且会被忽略，
+# 此时预热的 socket 用不上，由 python-socks 自行建连）
+_HANDSHAKE_ON_SOCKET = "_socket" in inspect.signature(
+    getattr(Proxy, "types", {}).get(ProxyType.SOCKS5, Proxy).connect
+).parameters
+
+# CONNECT 响应头的最大长度
+MAX_CONNECT_RESPONSE = 16 * 1024
+
+# 本身就是 HTTP 代理、可以直接转发绝对 URI 请求的节点协议
+_FORWARD_PROTOCOLS = (ProxyProtocol.HTTP, ProxyProtocol.HTTPS)
+
+# 转发普通 HTTP 请求时，直接发给 HTTP 代理节点的 keep-alive 连接的池化键
+FORWARD_KEY = "forward"
+
+
+class UpstreamError(Exception):
+    """通过上游代理节点连接目标失败"""
+    
+    # 失败原因分类
+    TIMEOUT = "timeout"
+    REFUSED = "refused"
+    UNREACHABLE = "unreachable"
+    PROXY = "proxy"
+    
+    def __init__(self, message: str, kind: str = PROXY):
+        super().__init__(message)
+        self.kind = kind
+
+
+def _protocol(proxy_node: NodeSnapshot) -> ProxyProtocol:
+    return ProxyProtocol(getattr(proxy_node.protocol, "value", proxy_node.protocol))
+
+
+def format_authority(host: str, port: int) -> str:
+    """格式化 host:port，IPv6 地址需要加方括号"""
+    if ":" in host and not host.startswith("["):
+        return f"[{host}]:{port}"
+    return f"{host}:{port}"
+
+
+async def open_upstream(
+    proxy_node: NodeSnapshot,
+    host: str,
+    port: int,
+    timeout: Optional[float] = None,
+    reuse: bool = True
+) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    """
+    通过代理节点建立到目标地址的隧道
+    
+    按 ProxyNode.protocol 完成上游握手（http/socks4/socks5 使用 python-socks，
+    https 先与代理建立 TLS 再发送 CONNECT），返回已经连通目标的流。
+    reuse 为 False 时不使用也不补充连接池中的预热连接。
+    """
+    timeout = timeout or settings.upstream_connect_timeout
+    try:
+        try:
+            return await _handshake(proxy_node, host, port, timeout, reuse=reuse)
+        except _StaleConnection:
+            # 预热连接在空闲期间被代理关闭，换一个新连接重试
+            return await _handshake(proxy_node, host, port, timeout, reuse=False)
+    
+    except (ProxyTimeoutError, asyncio.TimeoutError) as e:
+        raise UpstreamError(f"连接超时: {str(e) or '超过' + str(timeout) + '秒'}", UpstreamError.TIMEOUT) from e
+    except ProxyConnectionError as e:
+        raise UpstreamError(f"无法连接代理节点: {str(e)}", UpstreamError.UNREACHABLE) from e
+    except ConnectionRefusedError as e:
+        raise UpstreamError(f"连接被拒绝: {str(e)}", UpstreamError.REFUSED) from e
+    except (ProxyError, OSError, ssl.SSLError) as e:
+        raise UpstreamError(f"上游握手失败: {str(e)}", UpstreamError.PROXY) from e
+
+
+class _StaleConnection(Exception):
+    """池中取出的预热连接已不可用"""
+
+
+async def _handshake(proxy_node: NodeSnapshot, host: str, port: int, timeout: float, reuse: bool):
+    """
+    在到代理节点的连接上完成到目标的握手
+    reuse 为 True 时优先使用连接池中的预热连接，预热连接握手失败时抛出 _StaleConnection
+    """
+    protocol = _protocol(proxy_node)
+    if protocol == ProxyProtocol.HTTPS:
+        reader, writer = await asyncio.wait_for(
+            _open_https_tunnel(proxy_node, host, port, reuse),
+            timeout
+        )
+        tune_connection(writer)
+        return reader, writer
+    
+    proxy = Proxy.create(
+        proxy_type=_PROXY_TYPES[protocol],
+        host=proxy_node.host,
+        port=proxy_node.port,
+        username=proxy_node.username,
+        password=proxy_node.password,
+        rdns=True
+    )
+    if not _HANDSHAKE_ON_SOCKET:
+        sock = await proxy.connect(dest_host=host, dest_port=port, timeout=timeout)
+        reader, writer = await asyncio.open_connection(sock=sock)
+        tune_connection(writer)
+        return reader, writer
+    
+    if reuse:
+        sock, reused = await asyncio.wait_for(upstream_pool.connect_socket(proxy_node), timeout)
+    else:
+        sock = await asyncio.wait_for(upstream_pool.open_socket(proxy_node), timeout)
+        reused = False
+    try:
+        sock = await proxy.connect(dest_host=host, dest_port=port, timeout=timeout, _socket=sock)
+    except (ProxyConnectionError, ProxyError) as e:
+        sock.close()
+        if reused:
+            raise _StaleConnection() from e
+        raise
+    except BaseException:
+        sock.close()
+        raise
+    reader, writer = await asyncio.open_connection(sock=sock)
+    tune_connection(writer)
+    return reader, writer
+
+
+async def _open_https_tunnel(proxy_node: NodeSnapshot, host: str, port: int, reuse: bool = True):
+    """与 https 代理建立 TLS 连接并发送 CONNECT"""
+    if reuse:
+        reader, writer, reused = await upstream_pool.connect_tls(proxy_node)
+    else:
+        reader, writer = await upstream_pool.open_tls(proxy_node)
+        reused = False
+    try:
+        await http_connect(reader, writer, host, port, proxy_node.username, proxy_node.password)
+    except ProxyError as e:
+        writer.close()
+        if reused and reader.at_eof():
+            raise _StaleConnection() from e
+        raise
+    except BaseException:
+        writer.close()
+        raise
+    return reader, writer
+
+
+async def open_forward(
+    proxy_node: NodeSnapshot,
+    host: str,
+    port: int,
+    timeout: Optional[float] = None,
+    reuse: bool = True
+) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter, bool, bool]:
+    """
+    获取转发普通 HTTP 请求的上游连接，优先复用连接池中的 keep-alive 连接
+    
+    http/https 节点本身就是 HTTP 代理，请求以绝对 URI 直接发给节点，
+    同一连接可以转发到任意目标；socks 节点则建立到目标的隧道，按目标地址复用。
+    reuse 为 False 时跳过连接池，用于复用的连接发送请求失败后重试。
+    返回 (reader, writer, 是否使用绝对 URI, 是否为复用的连接)
+    """
+    protocol = _protocol(proxy_node)
+    absolute = protocol in _FORWARD_PROTOCOLS
+    if reuse:
+        conn = upstream_pool.checkout(proxy_node, forward_key(proxy_node, host, port))
+        if conn is not None:
+            return conn[0], conn[1], absolute, True
+    
+    if not absolute:
+        reader, writer = await open_upstream(proxy_node, host, port, timeout, reuse)
+        return reader, writer, False, False
+    
+    timeout = timeout or settings.upstream_connect_timeout
+    try:
+        if protocol == ProxyProtocol.HTTPS:
+            if reuse:
+                reader, writer, reused = await asyncio.wait_for(upstream_pool.connect_tls(proxy_node), timeout)
+            else:
+                reader, writer = await asyncio.wait_for(upstream_pool.open_tls(proxy_node), timeout)
+                reused = False
+        else:
+            if reuse:
+                sock, reused = await asyncio.wait_for(upstream_pool.connect_socket(proxy_node), timeout)
+            else:
+                sock = await asyncio.wait_for(upstream_pool.open_socket(proxy_node), timeout)
+                reused = False
+            reader, writer = await asyncio.open_connection(sock=sock)
+    except asyncio.TimeoutError as e:
+        raise UpstreamError(f"连接超时: 超过{timeout}秒", UpstreamError.TIMEOUT) from e
+    except ConnectionRefusedError as e:
+        raise UpstreamError(f"连接被拒绝: {str(e)}", UpstreamError.REFUSED) from e
+    except (OSError, ssl.SSLError) as e:
+        raise UpstreamError(f"无法连接代理节点: {str(e)}", UpstreamError.UNREACHABLE) from e
+    tune_connection(writer)
+    return reader, writer, True, reused
+
+
+def forward_key(proxy_node: NodeSnapshot, host: str, port: int) -> str:
+    """转发普通 HTTP 请求的 keep-alive 连接的池化键"""
+    if _protocol(proxy_node) in _FORWARD_PROTOCOLS:
+        return FORWARD_KEY
+    return format_authority(host, port)
+
+
+def proxy_authorization(proxy_node: NodeSnapshot) -> Optional[str]:
+    """节点需要认证时，返回 Proxy-Authorization 头的值"""
+    if not proxy_node.username:
+        return None
+    return _basic_auth(proxy_node.username, proxy_node.password)
+
+
+def _basic_auth(username: str, password: Optional[str]) -> str:
+    credentials = base64.b64encode(f"{username}:{password or ''}".encode("utf-8")).decode("ascii")
+    return f"Basic {credentials}"
+
+
+async def http_connect(reader, writer, host: str, port: int, username: Optional[str] = None, password: Optional[str] = None):
+    """在已建立的流上发送 HTTP CONNECT 请求并校验响应"""
+    authority = format_authority(host, port)
+    lines = [f"CONNECT {authority} HTTP/1.1", f"Host: {authority}"]
+    if username:
+        lines.append(f"Proxy-Authorization: {_basic_auth(username, password)}")
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("utf-8"))
+    await writer.drain()
+    
+    try:
+        response = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        raise ProxyError("代理在CONNECT响应前关闭了连接") from e
+    except asyncio.LimitOverrunError as e:
+        raise ProxyError("CONNECT响应头过长") from e
+    if len(response) > MAX_CONNECT_RESPONSE:
+        raise ProxyError("CONNECT响应头过长")
+    
+    status_line = response.split(b"\r\n", 1)[0].decode("latin-1")
+    parts = status_line.split(None, 2)
+    if len(parts) < 2 or not parts[1].isdigit():
+        raise ProxyError(f"无效的CONNECT响应: {status_line}")
+    if parts[1] != "200":
+        raise ProxyError(f"CONNECT被拒绝: {status_line}")
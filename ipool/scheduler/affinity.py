@@ -0,0 +1,227 @@
+import hashlib
+import heapq
+import logging
+import math
+import time
+from bisect import bisect_right
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from ipool.config import settings
+from ipool.node.connections import connection_counter
+from ipool.node.registry import NodeRegistry, NodeSnapshot
+from ipool.scheduler.filters import NodeFilter
+
+logger = logging.getLogger(__name__)
+
+# 沿哈希环查找时最多检查的不同节点数。筛选条件很严格时环上大部分节点都不符合，
+# 超过该数目后改为在筛选出的候选节点中直接选择，查找耗时不随环的大小增长
+MAX_PROBES = 32
+
+
+def _hash(key: str) -> int:
+    """64位哈希值"""
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class ConsistentHashRing:
+    """
+    一致性哈希环
+    
+    每个节点在环上放置 replicas 个虚拟点，节点增删时只影响相邻区间内的会话。
+    环以两个平行的有序数组保存；注册表的一批变更通过 update() 一次合并，
+    复杂度为 O(环大小 + 新增点数 · log 新增点数)，而不是逐个点插入数组。
+    """
+    
+    def __init__(self, replicas: int = None):
+        self.replicas = replicas or settings.session_ring_replicas
+        self._hashes: List[int] = []
+        self._node_ids: List[int] = []
+        self._members: Dict[int, List[int]] = {}
+    
+    def __len__(self) -> int:
+        return len(self._members)
+    
+    def __contains__(self, node_id: int) -> bool:
+        return node_id in self._members
+    
+    def _points(self, node_id: int) -> List[int]:
+        return [_hash(f"{node_id}#{i}") for i in range(self.replicas)]
+    
+    def rebuild(self, node_ids):
+        """全量重建哈希环"""
+        self._members = {node_id: self._points(node_id) for node_id in node_ids}
+        ring = sorted(
+            (point, node_id)
+            for node_id, points in self._members.items()
+            for point in points
+        )
+        self._hashes = [point for point, _ in ring]
+        self._node_ids = [node_id for _, node_id in ring]
+    
+    def update(self, added: Iterable[int] = (), removed: Iterable[int] = ()):
+        """批量加入和移出节点"""
+        removed = {node_id for node_id in removed if self._members.pop(node_id, None) is not None}
+        new_points = []
+        for node_id in added:
+            if node_id in self._members:
+                continue
+            points = self._members[node_id] = self._points(node_id)
+            new_points.extend((point, node_id) for point in points)
+        if not removed and not new_points:
+            return
+        
+        ring = zip(self._hashes, self._node_ids)
+        if removed:
+            ring = ((point, node_id) for point, node_id in ring if node_id not in removed)
+        if new_points:
+            new_points.sort()
+            ring = heapq.merge(ring, new_points)
+        merged = list(ring)
+        self._hashes = [point for point, _ in merged]
+        self._node_ids = [node_id for _, node_id in merged]
+    
+    def add(self, node_id: int):
+        """将节点加入环"""
+        self.update(added=(node_id,))
+    
+    def remove(self, node_id: int):
+        """将节点移出环"""
+        self.update(removed=(node_id,))
+    
+    def walk(self, key: str):
+        """从 key 的位置开始顺时针遍历环上的节点ID（每个节点只出现一次）"""
+        if not self._hashes:
+            return
+        start = bisect_right(self._hashes, _hash(key))
+        size = len(self._hashes)
+        seen = set()
+        for offset in range(size):
+            node_id = self._node_ids[(start + offset) % size]
+            if node_id not in seen:
+                seen.add(node_id)
+                yield node_id
+                if len(seen) == len(self._members):
+                    return
+
+
+class SessionAffinity:
+    """
+    会话保持
+    
+    会话键通过带有界负载的一致性哈希映射到节点：沿环顺时针找到第一个
+    满足筛选条件且负载未超过 ceil(load_factor · 平均负载) 的可用节点。
+    映射结果记录在 LRU 会话表中，同一会话的后续连接直接命中表项；
+    节点失效时只有落在该节点上的会话需要重新映射。
+    """
+    
+    def __init__(
+        self,
+        ttl: int = None,
+        max_sessions: int = None,
+        load_factor: float = None,
+        replicas: int = None
+    ):
+        self.ttl = ttl or settings.session_ttl
+        self.max_sessions = max_sessions or settings.session_table_size
+        self.load_factor = load_factor or settings.session_load_factor
+        self.ring = ConsistentHashRing(replicas)
+        # 会话键 -> (节点ID, 最后使用时间)
+        self._sessions: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+        self._registry: Optional[NodeRegistry] = None
+        self._version = -1
+    
+    def pick(self, session: str, registry: NodeRegistry, node_filter: Optional[NodeFilter] = None) -> Optional[NodeSnapshot]:
+        """为会话选择节点"""
+        self._sync(registry)
+        now = time.monotonic()
+        mask = None if node_filter is None or node_filter.is_empty else node_filter.mask(registry)
+        
+        # 命中会话表且节点仍然可用
+        entry = self._sessions.get(session)
+        if entry is not None:
+            node_id, last_used = entry
+            node = registry.get(node_id)
+            if now - last_used <= self.ttl and node is not None and node.available and \
+                    (mask is None or mask >> node.slot & 1):
+                self._sessions[session] = (node_id, now)
+                self._sessions.move_to_end(session)
+                return node
+            del self._sessions[session]
+        
+        node = self._lookup(session, registry, mask)
+        if node is None:
+            return None
+        
+        self._sessions[session] = (node.id, now)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+        return node
+    
+    def _lookup(self, session: str, registry: NodeRegistry, mask: Optional[int]) -> Optional[NodeSnapshot]:
+        """沿哈希环查找满足条件的第一个未超载节点"""
+        if not len(self.ring):
+            return None
+        capacity = self._capacity()
+        
+        fallback = None
+        probes = 0
+        for node_id in self.ring.walk(session):
+            probes += 1
+            if probes > MAX_PROBES:
+                if mask is not None:
+                    return self._pick_filtered(session, registry, mask, capacity)
+                break
+            node = registry.get(node_id)
+            if node is None or not node.available:
+                continue
+            if mask is not None and not mask >> node.slot & 1:
+                continue
+            if node.current_connections < capacity:
+                return node
+            if fallback is None:
+                fallback = node
+        # 所有符合条件的节点都已达到上限时，退回到环上的第一个候选
+        return fallback
+    
+    def _pick_filtered(self, session: str, registry: NodeRegistry, mask: int, capacity: int) -> Optional[NodeSnapshot]:
+        """
+        在筛选出的候选节点中按最高随机权重哈希（rendezvous hashing）选择，
+        同一会话在候选集合不变时总是得到同一个节点；优先选择未超载的节点
+        """
+        best = None
+        best_key = None
+        for node in registry.nodes_in(mask):
+            key = (node.current_connections < capacity, _hash(f"{session}#{node.id}"))
+            if best_key is None or key > best_key:
+                best, best_key = node, key
+        return best
+    
+    def _capacity(self) -> int:
+        """有界负载下单个节点的连接数上限"""
+        return math.ceil(self.load_factor * (connection_counter.total + 1) / len(self.ring))
+    
+    def _sync(self, registry: NodeRegistry):
+        """根据注册表的变更增量维护哈希环"""
+        if registry is self._registry and self._version == registry.version:
+            return
+        
+        changed = registry.changed_since(self._version) if registry is self._registry else None
+        if changed is None:
+            self.ring.rebuild(node.id for node in registry.available_nodes())
+        else:
+            added, removed = [], []
+            for node_id in changed:
+                node = registry.get(node_id)
+                if node is None or not node.available:
+                    removed.append(node_id)
+                else:
+                    added.append(node_id)
+            self.ring.update(added, removed)
+        
+        self._registry = registry
+        self._version = registry.version
+
+
+# 全局会话保持实例
+session_affinity = SessionAffinity()
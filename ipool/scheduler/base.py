@@ -1,8 +1,13 @@
 import logging
 from abc import ABC, abstractmethod
-from typing import Optional, Type
+from functools import partial
+from typing import Callable, List, Optional
 
-from ipool.node.models import ProxyNode
+from ipool.node.connections import connection_counter
+from ipool.node.registry import NodeSnapshot, node_registry
+from ipool.scheduler.affinity import session_affinity
+from ipool.scheduler.feedback import NodeFeedback, Outcome, feedback_queue
+from ipool.scheduler.filters import NodeFilter
 
 logger = logging.getLogger(__name__)
 
@@ -21,28 +26,95 @@ def get_scheduler():
     return _current_scheduler
 
 
-def set_scheduler(scheduler_class: Type["SchedulerBase"]):
-    """设置新的调度器类型"""
+def set_scheduler(scheduler_class: Callable[[], "SchedulerBase"]):
+    """设置新的调度器类型（可以是调度器类或返回调度器实例的工厂）"""
     global _current_scheduler
     _current_scheduler = scheduler_class()
     logger.info(f"设置新的调度器: {_current_scheduler.__class__.__name__}")
     return _current_scheduler
 
 
+def scheduler_factory(scheduler_type: str) -> Optional[Callable[[], "SchedulerBase"]]:
+    """按类型名返回调度器工厂，不支持的类型返回 None"""
+    from ipool.scheduler.health_first import HealthFirstScheduler
+    from ipool.scheduler.random import RandomScheduler
+    from ipool.scheduler.round_robin import RoundRobinScheduler
+    return {
+        "random": RandomScheduler,
+        "weighted_random": partial(RandomScheduler, weighted=True),
+        "round_robin": RoundRobinScheduler,
+        "least_conn": partial(RoundRobinScheduler, mode=RoundRobinScheduler.MODE_LEAST_CONN),
+        "health_first": HealthFirstScheduler
+    }.get(scheduler_type)
+
+
 class SchedulerBase(ABC):
     """代理调度器基类"""
     
-    @abstractmethod
-    async def next_proxy(self) -> Optional[ProxyNode]:
-        """获取下一个代理节点"""
-        pass
+    def __init__(self):
+        # 节点候选集来自进程内注册表，选择节点时不访问数据库
+        self.registry = node_registry
     
     @abstractmethod
-    async def report_success(self, proxy_node: ProxyNode, response_time: float):
-        """报告代理请求成功"""
+    async def next_proxy(self, node_filter: Optional[NodeFilter] = None) -> Optional[NodeSnapshot]:
+        """获取下一个代理节点，node_filter 为客户端指定的筛选条件"""
         pass
     
-    @abstractmethod
-    async def report_failure(self, proxy_node: ProxyNode, error: str):
-        """报告代理请求失败"""
+    async def report_success(
+        self,
+        proxy_node: NodeSnapshot,
+        connect_time: float,
+        ttfb: Optional[float] = None,
+        bytes_up: int = 0,
+        bytes_down: int = 0
+    ):
+        """
+        报告代理请求成功（时间单位为毫秒）
+        连接立即释放，结果进入反馈队列批量生效，不阻塞客户端连接
+        """
+        self._release(proxy_node)
+        feedback_queue.submit(Outcome(proxy_node, True, connect_time, ttfb, bytes_up, bytes_down))
+    
+    async def report_failure(self, proxy_node: NodeSnapshot, error: str, kind: Optional[str] = None):
+        """报告代理请求失败，kind 为失败原因分类（UpstreamError.kind）"""
+        self._release(proxy_node)
+        logger.warning(f"代理 {proxy_node.host}:{proxy_node.port} 请求失败: {error}")
+        feedback_queue.submit(Outcome(proxy_node, False, error_kind=kind))
+    
+    async def report_aborted(self, proxy_node: NodeSnapshot):
+        """报告与节点无关的中断（如客户端在上传请求体时断开），只释放连接，不计入节点的成功率和响应时间"""
+        self._release(proxy_node)
+    
+    def on_feedback(self, batch: List[NodeFeedback]):
+        """一批请求结果已写入节点快照（响应时间、成功率）后调用，调度器可在此更新自己的索引"""
         pass
+    
+    async def session_proxy(self, node_filter: NodeFilter) -> Optional[NodeSnapshot]:
+        """为带会话键的请求选择节点，同一会话尽量使用同一个节点"""
+        selected_proxy = session_affinity.pick(node_filter.session, self.registry, node_filter)
+        if not selected_proxy:
+            logger.warning("没有可用的健康代理节点")
+            return None
+        
+        # 更新连接计数
+        self._acquire(selected_proxy)
+        
+        logger.debug(f"会话 {node_filter.session} 使用代理节点: {selected_proxy.host}:{selected_proxy.port}")
+        return selected_proxy
+    
+    def _filter_candidates(self, node_filter: Optional[NodeFilter]) -> Optional[List[NodeSnapshot]]:
+        """
+        根据筛选条件返回候选节点
+        没有筛选条件时返回 None，调度器使用自己的全局索引
+        """
+        if node_filter is None or node_filter.is_empty:
+            return None
+        return list(self.registry.nodes_in(node_filter.mask(self.registry)))
+    
+    def _acquire(self, proxy_node: NodeSnapshot):
+        """占用节点的一个连接"""
+        connection_counter.acquire(proxy_node)
+    
+    def _release(self, proxy_node: NodeSnapshot):
+        """释放节点的一个连接"""
+        connection_counter.release(proxy_node)
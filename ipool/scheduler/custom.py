@@ -1,15 +1,19 @@
 import logging
-import json
-import ast
-from typing import Optional, Dict, List, Any
-import time
-
-from sqlalchemy import select
-from sqlalchemy.ext.asyncio import AsyncSession
+import random
+from typing import Optional, Dict, List, Any, Tuple
 
 from ipool.scheduler.base import SchedulerBase
-from ipool.node.models import ProxyNode
-from ipool.storage.database import get_session
+from ipool.scheduler.feedback import NodeFeedback
+from ipool.scheduler.filters import NodeFilter
+from ipool.scheduler.rules import (
+    FEEDBACK_FIELDS,
+    VOLATILE_FIELDS,
+    CompiledRule,
+    NodeColumns,
+    RuleSyntaxError,
+    compile_condition,
+)
+from ipool.node.registry import NodeSnapshot
 
 logger = logging.getLogger(__name__)
 
@@ -17,7 +21,11 @@ logger = logging.getLogger(__name__)
 class CustomRuleScheduler(SchedulerBase):
     """自定义规则引擎调度器"""
     
-    def __init__(self, rules: Optional[List[Dict[str, Any]]] = None):
+    def __init__(
+        self,
+        rules: Optional[List[Dict[str, Any]]] = None,
+        constraints: Optional[Dict[str, Any]] = None
+    ):
         """
         初始化自定义规则调度器
         
@@ -39,118 +47,138 @@ class CustomRuleScheduler(SchedulerBase):
                 "priority": 60
             }
         ]
+        
+        条件通过 ast 编译为受限表达式（见 ipool.scheduler.rules），
+        对所有可用节点按列一次性求值。得分在规则或节点属性变化前保持缓存，
+        选择时直接从最高分节点中挑选，无需排序。
+        
+        constraints 为评分前的硬性筛选条件，例如 {"country": "US", "tags": ["premium"]}，
+        通过注册表的位图索引求交集得到候选节点，只有候选节点参与评分。
         """
+        super().__init__()
         self.rules = rules or []
-        self._rule_cache = {}  # 缓存编译后的规则
+        self.constraints = constraints or {}
+        self._rule_cache: Dict[str, Optional[CompiledRule]] = {}  # 缓存编译后的规则
+        # 缓存的列快照和得分
+        self._columns: Optional[NodeColumns] = None
+        self._best: List[int] = []
+        self._best_score = 0.0
+        self._scores_version = -1
+        self._scores_valid = False
+        # 请求结果反馈改变、需要在下次评分前重新读取的列
+        self._stale_fields = set()
     
-    async def next_proxy(self) -> Optional[ProxyNode]:
+    async def next_proxy(self, node_filter: Optional[NodeFilter] = None) -> Optional[NodeSnapshot]:
         """基于自定义规则选择代理节点"""
-        async with get_session() as session:
-            # 获取所有活跃且健康的代理节点
-            result = await session.execute(
-                select(ProxyNode).where(
-                    ProxyNode.is_active == True,
-                    ProxyNode.is_healthy == True
-                )
-            )
-            proxies = result.scalars().all()
-            
-            if not proxies:
-                logger.warning("没有可用的健康代理节点")
-                return None
-            
-            # 应用规则并评分
-            scored_proxies = []
-            for proxy in proxies:
-                score = self._evaluate_rules(proxy)
-                scored_proxies.append((proxy, score))
-            
-            # 按分数降序排序
-            scored_proxies.sort(key=lambda x: x[1], reverse=True)
-            
-            if scored_proxies:
-                selected_proxy = scored_proxies[0][0]
-                
-                # 更新连接计数
-                selected_proxy.current_connections += 1
-                await session.commit()
-                
-                logger.debug(f"自定义规则选择代理节点: {selected_proxy.host}:{selected_proxy.port} (得分: {scored_proxies[0][1]})")
-                return selected_proxy
-            
+        candidates = self._filter_candidates(node_filter)
+        if candidates is not None:
+            # 客户端指定了筛选条件，只对候选节点评分（不缓存）
+            if self.constraints:
+                allowed = self.registry.match(**self.constraints)
+                candidates = [proxy for proxy in candidates if allowed >> proxy.slot & 1]
+            columns = NodeColumns(candidates)
+            scores = self._evaluate_rules(columns, self._compiled_rules())
+            best = columns.ops.best_indices(scores)
+            best_score = float(scores[best[0]]) if best else 0.0
+        else:
+            self._refresh_scores()
+            columns, best, best_score = self._columns, self._best, self._best_score
+        
+        if not best:
+            logger.warning("没有可用的健康代理节点")
             return None
+        
+        # 从得分最高的节点中随机选择
+        selected_proxy = columns.nodes[random.choice(best)]
+        
+        # 更新连接计数
+        self._acquire(selected_proxy)
+        
+        logger.debug(f"自定义规则选择代理节点: {selected_proxy.host}:{selected_proxy.port} (得分: {best_score})")
+        return selected_proxy
     
-    def _evaluate_rules(self, proxy: ProxyNode) -> float:
+    def _refresh_scores(self):
+        """在规则或节点属性变化后重新计算得分"""
+        compiled = self._compiled_rules()
+        volatile = any(rule.volatile for rule, _ in compiled)
+        if self._scores_valid and not volatile and self._scores_version == self.registry.version:
+            return
+        
+        if self._columns is None or self._scores_version != self.registry.version:
+            fields = set()
+            for rule, _ in compiled:
+                fields |= rule.fields
+            self._columns = NodeColumns(self._candidates(), fields)
+        else:
+            # 节点集合未变，只重新读取频繁变化的列和被请求结果反馈修改过的列
+            fields = set(self._stale_fields)
+            for rule, _ in compiled:
+                fields |= rule.fields & VOLATILE_FIELDS
+            for field in fields:
+                self._columns.load(field)
+        
+        self._scores_version = self.registry.version
+        self._scores_valid = True
+        self._stale_fields.clear()
+        
+        scores = self._evaluate_rules(self._columns, compiled)
+        self._best = self._columns.ops.best_indices(scores)
+        self._best_score = float(scores[self._best[0]]) if self._best else 0.0
+    
+    def on_feedback(self, batch: List[NodeFeedback]):
+        """
+        请求结果改变了节点的响应时间和成功率（不改变注册表版本），
+        规则引用了这些字段时使缓存的得分失效
         """
-        评估代理节点对所有规则的符合程度
-        返回总分数
+        if not any(item.latencies or item.failures or item.successes for item in batch):
+            return
+        fields = set()
+        for rule, _ in self._compiled_rules():
+            fields |= rule.fields & FEEDBACK_FIELDS
+        if fields:
+            self._stale_fields |= fields
+            self._scores_valid = False
+    
+    def _candidates(self) -> List[NodeSnapshot]:
+        """参与评分的候选节点"""
+        if not self.constraints:
+            return self.registry.available_nodes()
+        return list(self.registry.nodes_in(self.registry.match(**self.constraints)))
+    
+    def _evaluate_rules(self, columns: NodeColumns, compiled: List[Tuple[CompiledRule, float]]):
         """
-        total_score = 0.0
+        评估所有节点对所有规则的符合程度
+        返回每个节点的总分数
+        """
+        scores = columns.ops.zeros(len(columns))
+        if not len(columns):
+            return scores
         
-        for rule in self.rules:
+        for rule, priority in compiled:
             try:
-                # 获取规则属性
-                condition = rule.get("condition", "True")
-                priority = float(rule.get("priority", 1))
-                
-                # 评估条件
-                if self._eval_condition(proxy, condition):
-                    total_score += priority
+                mask = rule.evaluate(columns)
+                scores = columns.ops.add_where(scores, mask, priority)
             except Exception as e:
                 logger.error(f"规则评估出错: {str(e)}")
         
-        return total_score
-    
-    def _eval_condition(self, proxy: ProxyNode, condition: str) -> bool:
-        """
-        评估代理节点是否满足条件
-        使用Python语法允许灵活的条件表达式
-        """
-        try:
-            # 首先尝试从缓存获取已编译的规则
-            if condition in self._rule_cache:
-                condition_func = self._rule_cache[condition]
-            else:
-                # 编译条件表达式为可调用函数
-                condition_code = f"lambda node: {condition}"
-                condition_func = eval(condition_code)
-                # 缓存编译后的函数
-                self._rule_cache[condition] = condition_func
-            
-            # 执行条件评估
-            return condition_func(proxy)
-        except Exception as e:
-            logger.error(f"条件表达式'{condition}'评估失败: {str(e)}")
-            return False
+        return scores
     
-    async def report_success(self, proxy_node: ProxyNode, response_time: float):
-        """报告代理请求成功"""
-        async with get_session() as session:
-            # 获取最新的节点数据
-            result = await session.execute(
-                select(ProxyNode).where(ProxyNode.id == proxy_node.id)
-            )
-            db_proxy = result.scalars().first()
-            
-            if db_proxy:
-                # 更新连接计数
-                db_proxy.current_connections = max(0, db_proxy.current_connections - 1)
-                await session.commit()
-    
-    async def report_failure(self, proxy_node: ProxyNode, error: str):
-        """报告代理请求失败"""
-        async with get_session() as session:
-            # 获取最新的节点数据
-            result = await session.execute(
-                select(ProxyNode).where(ProxyNode.id == proxy_node.id)
-            )
-            db_proxy = result.scalars().first()
+    def _compiled_rules(self) -> List[Tuple[CompiledRule, float]]:
+        """返回编译后的规则及其优先级"""
+        compiled = []
+        for rule in self.rules:
+            condition = rule.get("condition", "True")
+            if condition not in self._rule_cache:
+                try:
+                    self._rule_cache[condition] = compile_condition(condition)
+                except RuleSyntaxError as e:
+                    logger.error(f"条件表达式'{condition}'编译失败: {str(e)}")
+                    self._rule_cache[condition] = None
             
-            if db_proxy:
-                # 更新连接计数
-                db_proxy.current_connections = max(0, db_proxy.current_connections - 1)
-                logger.warning(f"代理 {db_proxy.host}:{db_proxy.port} 请求失败: {error}")
-                await session.commit()
+            compiled_rule = self._rule_cache[condition]
+            if compiled_rule is not None:
+                compiled.append((compiled_rule, float(rule.get("priority", 1))))
+        return compiled
     
     def add_rule(self, name: str, condition: str, priority: float):
         """添加新规则"""
@@ -160,16 +188,18 @@ class CustomRuleScheduler(SchedulerBase):
             "priority": priority
         })
         # 清除受影响的缓存
-        if condition in self._rule_cache:
-            del self._rule_cache[condition]
+        self._rule_cache.pop(condition, None)
+        self._scores_valid = False
     
     def remove_rule(self, name: str):
         """移除指定名称的规则"""
         self.rules = [r for r in self.rules if r.get("name") != name]
         # 重置全部缓存
         self._rule_cache = {}
+        self._scores_valid = False
     
     def clear_rules(self):
         """清除所有规则"""
         self.rules = []
-        self._rule_cache = {}
\ No newline at end of file
+        self._rule_cache = {}
+        self._scores_valid = False
\ No newline at end of file
@@ -0,0 +1,274 @@
+"""
+数据面请求结果的批量反馈
+
+代理服务器在每个隧道或请求结束时提交一条 Outcome（连接耗时、首字节时间、
+传输字节数、失败原因），提交只是追加到内存队列，不会阻塞客户端连接。
+后台任务定期（或积累到 batch_size 条时）取出整批结果，按节点汇总后写入节点快照
+（响应时间加权平均、最近 feedback_rate_window 秒内的成功率），通知当前调度器更新索引，
+再以一次批量 UPDATE 写回数据库。
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from sqlalchemy import bindparam, update
+
+from ipool.config import settings
+from ipool.node.models import ProxyNode
+from ipool.node.registry import NodeSnapshot
+from ipool.storage.database import get_session
+
+logger = logging.getLogger(__name__)
+
+# 响应时间加权平均中新样本的权重
+LATENCY_ALPHA = 0.3
+
+# 窗口内至少有这么多条结果时才用它覆盖节点的成功率（样本太少时波动过大）
+MIN_RATE_SAMPLES = 5
+
+
+class Outcome:
+    """一次隧道或请求的结果"""
+    
+    __slots__ = ("node", "ok", "connect_time", "ttfb", "bytes_up", "bytes_down", "error_kind")
+    
+    def __init__(
+        self,
+        node: NodeSnapshot,
+        ok: bool,
+        connect_time: Optional[float] = None,
+        ttfb: Optional[float] = None,
+        bytes_up: int = 0,
+        bytes_down: int = 0,
+        error_kind: Optional[str] = None
+    ):
+        self.node = node
+        self.ok = ok
+        # 毫秒
+        self.connect_time = connect_time
+        self.ttfb = ttfb
+        self.bytes_up = bytes_up
+        self.bytes_down = bytes_down
+        self.error_kind = error_kind
+    
+    @property
+    def latency(self) -> Optional[float]:
+        """计入节点响应时间的延迟：有首字节时间时使用首字节时间，否则使用连接耗时"""
+        return self.ttfb if self.ttfb is not None else self.connect_time
+
+
+class NodeFeedback:
+    """一批结果中单个节点的汇总"""
+    
+    __slots__ = ("node", "successes", "failures", "latencies", "bytes_up", "bytes_down", "errors")
+    
+    def __init__(self, node: NodeSnapshot):
+        self.node = node
+        self.successes = 0
+        self.failures = 0
+        self.latencies: List[float] = []
+        self.bytes_up = 0
+        self.bytes_down = 0
+        # 失败原因 -> 次数
+        self.errors: Dict[str, int] = {}
+    
+    def add(self, outcome: Outcome):
+        if outcome.ok:
+            self.successes += 1
+            latency = outcome.latency
+            if latency is not None:
+                self.latencies.append(latency)
+        else:
+            self.failures += 1
+            kind = outcome.error_kind or "other"
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+        self.bytes_up += outcome.bytes_up
+        self.bytes_down += outcome.bytes_down
+
+
+class _RateWindow:
+    """单个节点在滑动窗口内的成功次数和总次数，按批累计"""
+    
+    __slots__ = ("batches", "successes", "total")
+    
+    def __init__(self):
+        # (时间, 成功次数, 总次数)
+        self.batches: Deque[Tuple[float, int, int]] = deque()
+        self.successes = 0
+        self.total = 0
+    
+    def add(self, now: float, successes: int, total: int):
+        self.batches.append((now, successes, total))
+        self.successes += successes
+        self.total += total
+    
+    def expire(self, since: float):
+        """去掉窗口外的批次"""
+        batches = self.batches
+        while batches and batches[0][0] < since:
+            _, successes, total = batches.popleft()
+            self.successes -= successes
+            self.total -= total
+    
+    @property
+    def rate(self) -> float:
+        """成功率（百分比）"""
+        return self.successes * 100 / self.total if self.total else 0.0
+
+
+class FeedbackQueue:
+    """
+    请求结果反馈队列
+    
+    队列有上限，后台任务长时间没有运行时丢弃最旧的结果，内存占用有界。
+    所有操作都在事件循环线程中完成，不需要加锁。
+    """
+    
+    def __init__(
+        self,
+        flush_interval: float = None,
+        batch_size: int = None,
+        max_pending: int = None,
+        rate_window: float = None
+    ):
+        self.flush_interval = flush_interval or settings.feedback_flush_interval
+        self.batch_size = batch_size or settings.feedback_batch_size
+        self.max_pending = max_pending or settings.feedback_max_pending
+        self.rate_window = rate_window or settings.feedback_rate_window
+        self._pending: Deque[Outcome] = deque(maxlen=self.max_pending)
+        # 节点ID -> 成功率滑动窗口
+        self._windows: Dict[int, _RateWindow] = {}
+        self._next_prune = 0.0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._running = False
+        # 累计统计
+        self.bytes_up = 0
+        self.bytes_down = 0
+    
+    def __len__(self) -> int:
+        return len(self._pending)
+    
+    def submit(self, outcome: Outcome):
+        """提交一条结果（非阻塞）"""
+        self._pending.append(outcome)
+        if self._wakeup is not None and len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+    
+    async def start(self):
+        """启动批量处理循环"""
+        if self._running:
+            return
+        
+        self._running = True
+        self._wakeup = asyncio.Event()
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+        logger.info(f"请求结果反馈服务启动，间隔: {self.flush_interval}秒，批大小: {self.batch_size}")
+        
+        while self._running:
+            try:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                await self.flush()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"处理请求结果反馈时发生错误: {str(e)}", exc_info=True)
+    
+    async def stop(self):
+        """停止处理循环并处理剩余结果"""
+        self._running = False
+        await self.flush()
+    
+    async def flush(self):
+        """处理队列中的全部结果"""
+        if not self._pending:
+            return
+        # 先整体交换队列，之后提交的结果进入下一批
+        outcomes, self._pending = self._pending, deque(maxlen=self.max_pending)
+        
+        feedback: Dict[int, NodeFeedback] = {}
+        for outcome in outcomes:
+            item = feedback.get(outcome.node.id)
+            if item is None:
+                item = feedback[outcome.node.id] = NodeFeedback(outcome.node)
+            item.add(outcome)
+        batch = list(feedback.values())
+        
+        now = time.monotonic()
+        changed = [item for item in batch if self._apply(item, now)]
+        self._prune(now)
+        
+        # 通知当前调度器更新索引
+        from ipool.scheduler.base import get_scheduler
+        get_scheduler().on_feedback(batch)
+        
+        await self._write_back(changed)
+    
+    def _apply(self, item: NodeFeedback, now: float) -> bool:
+        """把汇总结果写入节点快照，返回响应时间或成功率是否发生变化"""
+        node = item.node
+        before = node.response_time, node.success_rate
+        for latency in item.latencies:
+            node.response_time = (1 - LATENCY_ALPHA) * node.response_time + LATENCY_ALPHA * latency
+        
+        window = self._windows.get(node.id)
+        if window is None:
+            window = self._windows[node.id] = _RateWindow()
+        window.expire(now - self.rate_window)
+        window.add(now, item.successes, item.successes + item.failures)
+        if window.total >= MIN_RATE_SAMPLES:
+            node.success_rate = window.rate
+        
+        self.bytes_up += item.bytes_up
+        self.bytes_down += item.bytes_down
+        return (node.response_time, node.success_rate) != before
+    
+    def _prune(self, now: float):
+        """每个窗口周期丢弃一次整个窗口内都没有新结果的节点"""
+        if now < self._next_prune:
+            return
+        since = now - self.rate_window
+        for node_id, window in list(self._windows.items()):
+            if window.batches[-1][0] < since:
+                del self._windows[node_id]
+        self._next_prune = now + self.rate_window
+    
+    async def _write_back(self, batch: List[NodeFeedback]):
+        """以一次批量 UPDATE 写回发生变化的响应时间和成功率"""
+        params = [
+            {
+                "node_id": item.node.id,
+                "node_response_time": item.node.response_time,
+                "node_success_rate": item.node.success_rate,
+            }
+            for item in batch
+        ]
+        if not params:
+            return
+        
+        table = ProxyNode.__table__
+        stmt = (
+            update(table)
+            .where(table.c.id == bindparam("node_id"))
+            .values(
+                response_time=bindparam("node_response_time"),
+                success_rate=bindparam("node_success_rate"),
+                # 运行时统计不算作节点信息变更，保持 updated_at 不变
+                updated_at=table.c.updated_at,
+            )
+        )
+        async with get_session() as session:
+            await session.execute(stmt, params)
+            await session.commit()
+        
+        logger.debug(f"已写回 {len(params)} 个节点的请求结果")
+
+
+# 全局请求结果反馈队列实例
+feedback_queue = FeedbackQueue()
@@ -0,0 +1,107 @@
+import logging
+from typing import Iterable, List, Optional, Set
+
+from ipool.node.registry import NodeRegistry
+
+logger = logging.getLogger(__name__)
+
+# 客户端可以指定的筛选键
+FILTER_KEYS = ("country", "region", "protocol", "tag", "session")
+
+
+class NodeFilter:
+    """
+    客户端指定的节点筛选条件
+    
+    通过 SOCKS5 用户名或 HTTP Proxy-Authorization / X-IPool-Filter 头传入，
+    格式为以 '-' 分隔的键值对，例如::
+        
+        country-US-tag-premium
+        user-country-JP-region-tokyo-tag-residential-tag-fast
+    
+    不认识的片段会被忽略（例如开头的账号名），tag 可以出现多次。
+    session 用于会话保持，本身不参与节点筛选。
+    exclude 为需要排除的节点ID（例如本次连接已经尝试过的节点），不能由客户端指定。
+    """
+    
+    __slots__ = ("country", "region", "protocol", "tags", "session", "exclude")
+    
+    def __init__(
+        self,
+        country: Optional[str] = None,
+        region: Optional[str] = None,
+        protocol: Optional[str] = None,
+        tags: Optional[List[str]] = None,
+        session: Optional[str] = None,
+        exclude: Optional[Set[int]] = None
+    ):
+        self.country = country
+        self.region = region
+        self.protocol = protocol
+        self.tags = tags or []
+        self.session = session
+        self.exclude = exclude or set()
+    
+    @classmethod
+    def parse(cls, text: Optional[str]) -> Optional["NodeFilter"]:
+        """从客户端提供的字符串解析筛选条件，没有任何条件时返回 None"""
+        if not text:
+            return None
+        
+        node_filter = cls()
+        tokens = text.strip().split("-")
+        i = 0
+        while i < len(tokens):
+            key = tokens[i].lower()
+            if key in FILTER_KEYS and i + 1 < len(tokens) and tokens[i + 1]:
+                value = tokens[i + 1]
+                if key == "tag":
+                    node_filter.tags.append(value.lower())
+                elif key == "protocol":
+                    node_filter.protocol = value.lower()
+                else:
+                    setattr(node_filter, key, value)
+                i += 2
+            else:
+                i += 1
+        
+        if node_filter.is_empty and not node_filter.session:
+            return None
+        return node_filter
+    
+    @property
+    def is_empty(self) -> bool:
+        """是否没有任何节点筛选条件"""
+        return not (self.country or self.region or self.protocol or self.tags or self.exclude)
+    
+    def excluding(self, node_ids: Iterable[int]) -> "NodeFilter":
+        """返回额外排除给定节点的筛选条件副本（不修改客户端的筛选条件）"""
+        return NodeFilter(
+            country=self.country,
+            region=self.region,
+            protocol=self.protocol,
+            tags=list(self.tags),
+            session=self.session,
+            exclude=self.exclude | set(node_ids)
+        )
+    
+    def mask(self, registry: NodeRegistry) -> int:
+        """在注册表的位图索引上求交集，返回满足条件的可用节点位集"""
+        mask = registry.match(
+            country=self.country,
+            region=self.region,
+            protocol=self.protocol,
+            tags=self.tags
+        )
+        for node_id in self.exclude:
+            snapshot = registry.get(node_id)
+            if snapshot is not None:
+                mask &= ~(1 << snapshot.slot)
+        return mask
+    
+    def __repr__(self) -> str:
+        parts = [f"{key}={getattr(self, key)}" for key in ("country", "region", "protocol", "session") if getattr(self, key)]
+        parts.extend(f"tag={tag}" for tag in self.tags)
+        if self.exclude:
+            parts.append(f"exclude={sorted(self.exclude)}")
+        return f"<NodeFilter {' '.join(parts)}>"
@@ -1,14 +1,13 @@
+import heapq
 import logging
 import random
-from typing import Optional, List, Dict
-import time
-
-from sqlalchemy import select, func
-from sqlalchemy.ext.asyncio import AsyncSession
+from bisect import bisect_left, insort
+from typing import Optional, Dict, List, Tuple
 
 from ipool.scheduler.base import SchedulerBase
-from ipool.node.models import ProxyNode
-from ipool.storage.database import get_session
+from ipool.scheduler.feedback import NodeFeedback
+from ipool.scheduler.filters import NodeFilter
+from ipool.node.registry import NodeSnapshot
 
 logger = logging.getLogger(__name__)
 
@@ -16,132 +15,126 @@ logger = logging.getLogger(__name__)
 class HealthFirstScheduler(SchedulerBase):
     """健康状态优先的调度器"""
     
-    def __init__(self):
-        # 健康得分缓存
-        self._health_scores: Dict[int, float] = {}
-        # 最后更新时间
-        self._last_updated: Dict[int, float] = {}
-        # 缓存有效期（秒）
-        self._cache_ttl = 60
+    def __init__(self, top_k: int = 8):
+        """
+        初始化健康优先调度器
+        
+        节点按健康得分维护一个有序索引，只在得分输入（响应时间、成功率、
+        权重、健康检查结果）变化时更新。每次选择从得分最高的 top_k 个节点中
+        随机抽取两个，取负载较低的一个（power of two choices），
+        既优先使用健康节点又避免所有流量集中到同一节点，选择耗时与节点总数无关。
+        """
+        super().__init__()
+        self.top_k = max(1, top_k)
+        # 按 (-得分, 节点ID) 升序排列的索引
+        self._ranking: List[Tuple[float, int]] = []
+        self._scores: Dict[int, float] = {}
+        self._nodes: Dict[int, NodeSnapshot] = {}
+        self._version = -1
     
-    async def next_proxy(self) -> Optional[ProxyNode]:
+    async def next_proxy(self, node_filter: Optional[NodeFilter] = None) -> Optional[NodeSnapshot]:
         """基于健康状态选择代理节点"""
-        async with get_session() as session:
-            # 获取所有活跃且健康的代理节点
-            result = await session.execute(
-                select(ProxyNode).where(
-                    ProxyNode.is_active == True,
-                    ProxyNode.is_healthy == True
-                )
+        self._sync()
+        
+        candidates = self._filter_candidates(node_filter)
+        if candidates is not None:
+            # 客户端指定了筛选条件，只在候选节点中取前 K 名
+            ranking = heapq.nsmallest(
+                self.top_k,
+                ((-self._scores[proxy.id], proxy.id) for proxy in candidates if proxy.id in self._scores)
             )
-            proxies = result.scalars().all()
-            
-            if not proxies:
-                logger.warning("没有可用的健康代理节点")
-                return None
-            
-            # 计算健康得分并选择最佳节点
-            best_proxies = []
-            best_score = -float('inf')
-            
-            for proxy in proxies:
-                # 获取或计算健康得分
-                score = self._get_health_score(proxy)
-                
-                if score > best_score:
-                    best_score = score
-                    best_proxies = [proxy]
-                elif score == best_score:
-                    best_proxies.append(proxy)
-            
-            # 从得分相同的最佳节点中随机选择
-            selected_proxy = random.choice(best_proxies)
-            
-            # 更新连接计数
-            selected_proxy.current_connections += 1
-            await session.commit()
-            
-            logger.debug(f"健康优先选择代理节点: {selected_proxy.host}:{selected_proxy.port} (得分: {best_score:.2f})")
-            return selected_proxy
-    
-    def _get_health_score(self, proxy: ProxyNode) -> float:
-        """计算代理节点的健康得分"""
-        proxy_id = proxy.id
-        now = time.time()
+        else:
+            ranking = self._ranking
         
-        # 如果缓存有效，直接返回缓存的得分
-        if proxy_id in self._health_scores and now - self._last_updated.get(proxy_id, 0) < self._cache_ttl:
-            return self._health_scores[proxy_id]
+        if not ranking:
+            logger.warning("没有可用的健康代理节点")
+            return None
         
-        # 计算综合健康得分
+        # 从得分最高的 K 个节点中随机抽取两个，选择负载较低的
+        k = min(self.top_k, len(ranking))
+        if k == 1:
+            selected_proxy = self._nodes[ranking[0][1]]
+        else:
+            i, j = random.sample(range(k), 2)
+            first = self._nodes[ranking[min(i, j)][1]]
+            second = self._nodes[ranking[max(i, j)][1]]
+            # 负载相同时选择得分更高的节点
+            selected_proxy = second if self._load_ratio(second) < self._load_ratio(first) else first
+        
+        # 更新连接计数
+        self._acquire(selected_proxy)
+        
+        logger.debug(f"健康优先选择代理节点: {selected_proxy.host}:{selected_proxy.port} (得分: {self._scores[selected_proxy.id]:.2f})")
+        return selected_proxy
+    
+    @staticmethod
+    def _load_ratio(proxy: NodeSnapshot) -> float:
+        """节点的负载比例"""
+        return proxy.current_connections / max(proxy.max_connections, 1)
+    
+    def _get_health_score(self, proxy: NodeSnapshot) -> float:
+        """
+        计算代理节点的健康得分
+        负载不计入得分，由选择时的两次随机选择处理，因此得分只在输入变化时需要更新
+        """
         # 1. 响应时间分数 (较低的响应时间给予更高分数)
-        response_score = max(0, 100 - min(proxy.response_time, 1000) / 10)
+        # 有检查历史时按 p95 延迟计分，尾延迟高的节点排名靠后
+        latency = proxy.latency_p95 if proxy.latency_p95 is not None else proxy.response_time
+        response_score = max(0, 100 - min(latency, 1000) / 10)
         
         # 2. 成功率分数
         success_score = proxy.success_rate
         
-        # 3. 负载分数 (较低的负载给予更高分数)
-        load_ratio = proxy.current_connections / max(proxy.max_connections, 1)
-        load_score = 100 * (1 - min(load_ratio, 1))
-        
-        # 4. 权重分数
+        # 3. 权重分数
         weight_score = min(proxy.weight * 10, 100)
         
         # 综合得分 (可根据需要调整权重)
-        final_score = (
-            response_score * 0.4 + 
-            success_score * 0.3 + 
-            load_score * 0.2 + 
+        return (
+            response_score * 0.4 +
+            success_score * 0.3 +
             weight_score * 0.1
         )
+    
+    def _sync(self):
+        """根据注册表的变更增量维护得分索引"""
+        if self._version == self.registry.version:
+            return
         
-        # 更新缓存
-        self._health_scores[proxy_id] = final_score
-        self._last_updated[proxy_id] = now
+        changed = self.registry.changed_since(self._version)
+        if changed is None:
+            # 变更日志已截断，全量重建
+            self._nodes = {node.id: node for node in self.registry.available_nodes()}
+            self._scores = {node_id: self._get_health_score(node) for node_id, node in self._nodes.items()}
+            self._ranking = sorted((-score, node_id) for node_id, score in self._scores.items())
+        else:
+            for node_id in changed:
+                node = self.registry.get(node_id)
+                if node is None or not node.available:
+                    self._unrank(node_id)
+                else:
+                    self._rescore(node)
         
-        return final_score
+        self._version = self.registry.version
     
-    async def report_success(self, proxy_node: ProxyNode, response_time: float):
-        """报告代理请求成功"""
-        async with get_session() as session:
-            # 获取最新的节点数据
-            result = await session.execute(
-                select(ProxyNode).where(ProxyNode.id == proxy_node.id)
-            )
-            db_proxy = result.scalars().first()
-            
-            if db_proxy:
-                # 更新连接计数
-                db_proxy.current_connections = max(0, db_proxy.current_connections - 1)
-                
-                # 更新响应时间 (加权平均)
-                db_proxy.response_time = 0.7 * db_proxy.response_time + 0.3 * response_time
-                
-                # 清除缓存，强制重新计算得分
-                if db_proxy.id in self._health_scores:
-                    del self._health_scores[db_proxy.id]
-                
-                await session.commit()
+    def _rescore(self, proxy: NodeSnapshot):
+        """重新计算节点得分并更新索引位置"""
+        self._unrank(proxy.id)
+        score = self._get_health_score(proxy)
+        self._nodes[proxy.id] = proxy
+        self._scores[proxy.id] = score
+        insort(self._ranking, (-score, proxy.id))
     
-    async def report_failure(self, proxy_node: ProxyNode, error: str):
-        """报告代理请求失败"""
-        async with get_session() as session:
-            # 获取最新的节点数据
-            result = await session.execute(
-                select(ProxyNode).where(ProxyNode.id == proxy_node.id)
-            )
-            db_proxy = result.scalars().first()
-            
-            if db_proxy:
-                # 更新连接计数
-                db_proxy.current_connections = max(0, db_proxy.current_connections - 1)
-                
-                # 更新成功率
-                db_proxy.success_rate = max(0, db_proxy.success_rate - 1)
-                
-                # 清除缓存，强制重新计算得分
-                if db_proxy.id in self._health_scores:
-                    del self._health_scores[db_proxy.id]
-                
-                logger.warning(f"代理 {db_proxy.host}:{db_proxy.port} 请求失败: {error}")
-                await session.commit()
+    def _unrank(self, node_id: int):
+        """从得分索引中移除节点"""
+        score = self._scores.pop(node_id, None)
+        if score is None:
+            return
+        self._nodes.pop(node_id, None)
+        pos = bisect_left(self._ranking, (-score, node_id))
+        del self._ranking[pos]
+    
+    def on_feedback(self, batch: List[NodeFeedback]):
+        """请求结果改变了节点的响应时间和成功率，只更新这些节点在索引中的位置"""
+        for item in batch:
+            if item.node.id in self._scores:
+                self._rescore(item.node)
@@ -0,0 +1,107 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class IndexedHeap:
+    """
+    带位置索引的最小堆
+    
+    以元素ID定位堆中位置，支持 O(log n) 的插入、删除和修改键值，
+    O(1) 读取最小元素。
+    """
+    
+    __slots__ = ("_heap", "_pos")
+    
+    def __init__(self):
+        # 堆中的每一项为 [键值, 元素ID]
+        self._heap: List[list] = []
+        self._pos: Dict[Any, int] = {}
+    
+    def __len__(self) -> int:
+        return len(self._heap)
+    
+    def __contains__(self, item_id) -> bool:
+        return item_id in self._pos
+    
+    def clear(self):
+        """清空堆"""
+        self._heap.clear()
+        self._pos.clear()
+    
+    def peek(self) -> Optional[Tuple[Any, Any]]:
+        """返回键值最小的 (元素ID, 键值)"""
+        if not self._heap:
+            return None
+        key, item_id = self._heap[0]
+        return item_id, key
+    
+    def key(self, item_id):
+        """返回元素当前的键值"""
+        return self._heap[self._pos[item_id]][0]
+    
+    def push(self, item_id, key):
+        """插入元素，已存在时更新键值"""
+        pos = self._pos.get(item_id)
+        if pos is not None:
+            self._update_at(pos, key)
+            return
+        self._heap.append([key, item_id])
+        self._pos[item_id] = len(self._heap) - 1
+        self._sift_up(len(self._heap) - 1)
+    
+    def update(self, item_id, key):
+        """修改元素键值，元素不存在时忽略"""
+        pos = self._pos.get(item_id)
+        if pos is not None:
+            self._update_at(pos, key)
+    
+    def remove(self, item_id):
+        """移除元素，元素不存在时忽略"""
+        pos = self._pos.pop(item_id, None)
+        if pos is None:
+            return
+        last = self._heap.pop()
+        if pos < len(self._heap):
+            self._heap[pos] = last
+            self._pos[last[1]] = pos
+            self._sift_down(pos)
+            self._sift_up(pos)
+    
+    def _update_at(self, pos: int, key):
+        old = self._heap[pos][0]
+        self._heap[pos][0] = key
+        if key < old:
+            self._sift_up(pos)
+        else:
+            self._sift_down(pos)
+    
+    def _sift_up(self, pos: int):
+        heap = self._heap
+        entry = heap[pos]
+        while pos > 0:
+            parent = (pos - 1) >> 1
+            if not entry[0] < heap[parent][0]:
+                break
+            heap[pos] = heap[parent]
+            self._pos[heap[pos][1]] = pos
+            pos = parent
+        heap[pos] = entry
+        self._pos[entry[1]] = pos
+    
+    def _sift_down(self, pos: int):
+        heap = self._heap
+        size = len(heap)
+        entry = heap[pos]
+        while True:
+            child = 2 * pos + 1
+            if child >= size:
+                break
+            right = child + 1
+            if right < size and heap[right][0] < heap[child][0]:
+                child = right
+            if not heap[child][0] < entry[0]:
+                break
+            heap[pos] = heap[child]
+            self._pos[heap[pos][1]] = pos
+            pos = child
+        heap[pos] = entry
+        self._pos[entry[1]] = pos
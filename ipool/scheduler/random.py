@@ -1,71 +1,151 @@
 import logging
 import random
-from typing import Optional, List
-
-from sqlalchemy import select
-from sqlalchemy.ext.asyncio import AsyncSession
+from array import array
+from typing import Optional, List, Dict, Sequence
 
 from ipool.scheduler.base import SchedulerBase
-from ipool.node.models import ProxyNode
-from ipool.storage.database import get_session
+from ipool.scheduler.filters import NodeFilter
+from ipool.node.registry import NodeSnapshot
 
 logger = logging.getLogger(__name__)
 
 
+class AliasTable:
+    """
+    Walker/Vose 别名表
+    
+    构建复杂度 O(n)，每次加权采样 O(1)。
+    """
+    
+    __slots__ = ("items", "_prob", "_alias")
+    
+    def __init__(self, items: List[NodeSnapshot], weights: Sequence[float]):
+        self.items = items
+        n = len(items)
+        self._prob = array('d', [0.0]) * n
+        self._alias = array('l', [0]) * n
+        
+        total = float(sum(weights))
+        if total <= 0:
+            # 权重全部为 0 时退化为均匀随机
+            for i in range(n):
+                self._prob[i] = 1.0
+            return
+        
+        # 将权重缩放到平均值为 1
+        scaled = [w * n / total for w in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self._prob[s] = scaled[s]
+            self._alias[s] = l
+            scaled[l] = (scaled[l] + scaled[s]) - 1.0
+            if scaled[l] < 1.0:
+                small.append(l)
+            else:
+                large.append(l)
+        
+        # 剩余项由于浮点误差可能略偏离 1，直接视为满概率
+        for i in large:
+            self._prob[i] = 1.0
+        for i in small:
+            self._prob[i] = 1.0
+    
+    def __len__(self) -> int:
+        return len(self.items)
+    
+    def sample(self) -> Optional[NodeSnapshot]:
+        """O(1) 加权随机采样"""
+        n = len(self.items)
+        if n == 0:
+            return None
+        i = random.randrange(n)
+        if random.random() < self._prob[i]:
+            return self.items[i]
+        return self.items[self._alias[i]]
+
+
 class RandomScheduler(SchedulerBase):
     """随机选择代理节点的调度器"""
     
-    async def next_proxy(self) -> Optional[ProxyNode]:
+    def __init__(self, weighted: bool = False):
+        """
+        初始化随机调度器
+        
+        weighted 为 True 时按 ProxyNode.weight 加权随机，权重为 0 的节点不参与选择，
+        别名表只在可用节点集合或权重变化时重建。
+        """
+        super().__init__()
+        self.weighted = weighted
+        self._alias_table: Optional[AliasTable] = None
+        # 别名表中各节点的权重，用于判断变更是否影响采样
+        self._table_weights: Dict[int, int] = {}
+        self._table_version = -1
+    
+    async def next_proxy(self, node_filter: Optional[NodeFilter] = None) -> Optional[NodeSnapshot]:
         """随机获取一个健康的代理节点"""
-        async with get_session() as session:
-            # 获取所有活跃且健康的代理节点
-            result = await session.execute(
-                select(ProxyNode).where(
-                    ProxyNode.is_active == True,
-                    ProxyNode.is_healthy == True
-                )
-            )
-            proxies = result.scalars().all()
-            
-            if not proxies:
-                logger.warning("没有可用的健康代理节点")
+        candidates = self._filter_candidates(node_filter)
+        if candidates is not None:
+            # 客户端指定了筛选条件，在候选节点中选择
+            selected_proxy = self._choose_from(candidates)
+        elif self.weighted:
+            selected_proxy = self._weighted_choice()
+        else:
+            # 从注册表中 O(1) 随机选择一个可用节点
+            selected_proxy = self.registry.random_available()
+        
+        if not selected_proxy:
+            logger.warning("没有可用的健康代理节点")
+            return None
+        
+        logger.debug(f"随机选择代理节点: {selected_proxy.host}:{selected_proxy.port}")
+        
+        # 更新连接计数
+        self._acquire(selected_proxy)
+        
+        return selected_proxy
+    
+    def _choose_from(self, candidates: List[NodeSnapshot]) -> Optional[NodeSnapshot]:
+        """在筛选出的候选节点中随机选择"""
+        if not candidates:
+            return None
+        if self.weighted:
+            candidates = [proxy for proxy in candidates if proxy.weight > 0]
+            if not candidates:
                 return None
-            
-            # 随机选择一个节点
-            selected_proxy = random.choice(proxies)
-            logger.debug(f"随机选择代理节点: {selected_proxy.host}:{selected_proxy.port}")
-            
-            # 更新连接计数
-            selected_proxy.current_connections += 1
-            await session.commit()
-            
-            return selected_proxy
+            return random.choices(candidates, weights=[proxy.weight for proxy in candidates])[0]
+        return random.choice(candidates)
+    
+    def _weighted_choice(self) -> Optional[NodeSnapshot]:
+        """基于别名表的加权随机选择"""
+        if self._alias_table is None or self._table_version != self.registry.version:
+            if self._alias_table is None or self._weights_changed():
+                self._rebuild_alias_table()
+            self._table_version = self.registry.version
+        return self._alias_table.sample()
     
-    async def report_success(self, proxy_node: ProxyNode, response_time: float):
-        """报告代理请求成功"""
-        async with get_session() as session:
-            # 获取最新的节点数据
-            result = await session.execute(
-                select(ProxyNode).where(ProxyNode.id == proxy_node.id)
-            )
-            db_proxy = result.scalars().first()
-            
-            if db_proxy:
-                # 更新连接计数
-                db_proxy.current_connections = max(0, db_proxy.current_connections - 1)
-                await session.commit()
+    def _weights_changed(self) -> bool:
+        """检查注册表的变更是否影响可用节点集合或权重"""
+        changed = self.registry.changed_since(self._table_version)
+        if changed is None:
+            return True
+        for node_id in changed:
+            node = self.registry.get(node_id)
+            in_table = node_id in self._table_weights
+            if node is None or not node.available:
+                if in_table:
+                    return True
+            elif not in_table or self._table_weights[node_id] != node.weight:
+                return True
+        return False
     
-    async def report_failure(self, proxy_node: ProxyNode, error: str):
-        """报告代理请求失败"""
-        async with get_session() as session:
-            # 获取最新的节点数据
-            result = await session.execute(
-                select(ProxyNode).where(ProxyNode.id == proxy_node.id)
-            )
-            db_proxy = result.scalars().first()
-            
-            if db_proxy:
-                # 更新连接计数
-                db_proxy.current_connections = max(0, db_proxy.current_connections - 1)
-                logger.warning(f"代理 {db_proxy.host}:{db_proxy.port} 请求失败: {error}")
-                await session.commit()
+    def _rebuild_alias_table(self):
+        """重建别名表（只包含权重为正的节点，权重为 0 的节点仍记录在 _table_weights 中）"""
+        available = self.registry.available_nodes()
+        proxies = [proxy for proxy in available if proxy.weight > 0]
+        self._alias_table = AliasTable(proxies, [proxy.weight for proxy in proxies])
+        self._table_weights = {proxy.id: proxy.weight for proxy in available}
+        logger.debug(f"重建加权随机别名表，节点数: {len(proxies)}")
@@ -1,13 +1,10 @@
 import logging
 from typing import Optional, Dict, List
-import time
-
-from sqlalchemy import select
-from sqlalchemy.ext.asyncio import AsyncSession
 
 from ipool.scheduler.base import SchedulerBase
-from ipool.node.models import ProxyNode
-from ipool.storage.database import get_session
+from ipool.scheduler.heap import IndexedHeap
+from ipool.scheduler.filters import NodeFilter
+from ipool.node.registry import NodeSnapshot
 
 logger = logging.getLogger(__name__)
 
@@ -15,78 +12,131 @@ logger = logging.getLogger(__name__)
 class RoundRobinScheduler(SchedulerBase):
     """轮询加权负载均衡调度器"""
     
-    def __init__(self):
-        # 记录上次使用时间
-        self._last_used: Dict[int, float] = {}
+    MODE_SMOOTH = "smooth"
+    MODE_LEAST_CONN = "least_conn"
+    
+    def __init__(self, mode: str = MODE_SMOOTH):
+        """
+        初始化轮询调度器
+        
+        支持两种模式，均由带索引的最小堆实现，每次选择 O(log n):
+        - smooth: 平滑加权轮询。采用步长调度（stride scheduling），每个节点
+          被选中后虚拟时间前进 1/weight，效果与 Nginx 的平滑加权轮询一致，
+          按权重比例交错选择节点，而不需要每次扫描全部节点。
+        - least_conn: 加权最少连接。按 当前连接数/权重 排序，负载相同时选择
+          最久未使用的节点，连接占用和释放时增量更新堆。
+        
+        与加权随机调度一致，权重为 0 的节点不参与选择。
+        """
+        super().__init__()
+        if mode not in (self.MODE_SMOOTH, self.MODE_LEAST_CONN):
+            raise ValueError(f"不支持的轮询模式: {mode}")
+        self.mode = mode
+        self._heap = IndexedHeap()
+        self._nodes: Dict[int, NodeSnapshot] = {}
+        # 平滑轮询模式下各节点的步长
+        self._strides: Dict[int, float] = {}
+        # 选择序号，用于负载相同时的先后顺序
+        self._seq = 0
+        self._version = -1
     
-    async def next_proxy(self) -> Optional[ProxyNode]:
+    async def next_proxy(self, node_filter: Optional[NodeFilter] = None) -> Optional[NodeSnapshot]:
         """轮询获取一个代理节点，考虑权重"""
-        async with get_session() as session:
-            # 获取所有活跃且健康的代理节点
-            result = await session.execute(
-                select(ProxyNode).where(
-                    ProxyNode.is_active == True,
-                    ProxyNode.is_healthy == True
-                ).order_by(ProxyNode.weight.desc())
-            )
-            proxies = result.scalars().all()
-            
-            if not proxies:
-                logger.warning("没有可用的健康代理节点")
-                return None
-            
-            # 找到当前负载最小的代理节点
-            best_proxy = None
-            min_load = float('inf')
-            
-            for proxy in proxies:
-                # 计算相对负载，考虑节点权重和当前连接数
-                relative_load = proxy.current_connections / max(1, proxy.weight)
-                
-                # 如果负载相同，选择最近最少使用的节点
-                if relative_load < min_load or (
-                    relative_load == min_load and
-                    self._last_used.get(proxy.id, 0) < self._last_used.get(best_proxy.id if best_proxy else -1, 0)
-                ):
-                    min_load = relative_load
-                    best_proxy = proxy
-            
-            if best_proxy:
-                # 更新连接计数和最后使用时间
-                best_proxy.current_connections += 1
-                self._last_used[best_proxy.id] = time.time()
-                await session.commit()
-                
-                logger.debug(f"轮询选择代理节点: {best_proxy.host}:{best_proxy.port} (权重: {best_proxy.weight}, 当前连接: {best_proxy.current_connections})")
-                return best_proxy
-            
+        self._sync()
+        
+        candidates = self._filter_candidates(node_filter)
+        if candidates is not None:
+            # 客户端指定了筛选条件，在候选节点中取堆键值最小者
+            top = self._peek_among(candidates)
+        else:
+            top = self._heap.peek()
+        if top is None:
+            logger.warning("没有可用的健康代理节点")
             return None
+        
+        node_id, (virtual_time, _) = top
+        best_proxy = self._nodes[node_id]
+        
+        if self.mode == self.MODE_SMOOTH:
+            # 虚拟时间前进一个步长
+            self._seq += 1
+            self._heap.update(node_id, (virtual_time + self._strides[node_id], self._seq))
+        
+        # 更新连接计数（最少连接模式下同时更新堆）
+        self._acquire(best_proxy)
+        
+        logger.debug(f"轮询选择代理节点: {best_proxy.host}:{best_proxy.port} (权重: {best_proxy.weight}, 当前连接: {best_proxy.current_connections})")
+        return best_proxy
+    
+    def _peek_among(self, candidates: List[NodeSnapshot]):
+        """在候选节点中找出键值最小的 (节点ID, 键值)"""
+        best = None
+        for proxy in candidates:
+            if proxy.id not in self._heap:
+                continue
+            key = self._heap.key(proxy.id)
+            if best is None or key < best[1]:
+                best = (proxy.id, key)
+        return best
+    
+    def _acquire(self, proxy_node: NodeSnapshot):
+        super()._acquire(proxy_node)
+        if self.mode == self.MODE_LEAST_CONN and proxy_node.id in self._heap:
+            self._seq += 1
+            self._heap.update(proxy_node.id, (self._relative_load(proxy_node), self._seq))
+    
+    def _release(self, proxy_node: NodeSnapshot):
+        super()._release(proxy_node)
+        if self.mode == self.MODE_LEAST_CONN and proxy_node.id in self._heap:
+            _, seq = self._heap.key(proxy_node.id)
+            self._heap.update(proxy_node.id, (self._relative_load(proxy_node), seq))
+    
+    @staticmethod
+    def _relative_load(proxy_node: NodeSnapshot) -> float:
+        """计算相对负载，考虑节点权重和当前连接数"""
+        # 权重可能在下一次同步前被改为 0，这里仍需保护
+        return proxy_node.current_connections / max(1, proxy_node.weight)
     
-    async def report_success(self, proxy_node: ProxyNode, response_time: float):
-        """报告代理请求成功"""
-        async with get_session() as session:
-            # 获取最新的节点数据
-            result = await session.execute(
-                select(ProxyNode).where(ProxyNode.id == proxy_node.id)
-            )
-            db_proxy = result.scalars().first()
-            
-            if db_proxy:
-                # 更新连接计数
-                db_proxy.current_connections = max(0, db_proxy.current_connections - 1)
-                await session.commit()
+    def _sync(self):
+        """根据注册表的变更增量维护堆"""
+        if self._version == self.registry.version:
+            return
+        
+        changed = self.registry.changed_since(self._version)
+        if changed is None:
+            # 变更日志已截断，全量重建
+            self._heap.clear()
+            self._nodes.clear()
+            self._strides.clear()
+            changed = [node.id for node in self.registry.available_nodes()]
+        
+        # 新加入的节点统一从当前虚拟时间开始，避免积压的份额集中爆发
+        top = self._heap.peek()
+        now = top[1][0] if top else 0.0
+        
+        for node_id in changed:
+            node = self.registry.get(node_id)
+            if node is None or not node.available or node.weight <= 0:
+                self._heap.remove(node_id)
+                self._nodes.pop(node_id, None)
+                self._strides.pop(node_id, None)
+            else:
+                self._track(node, now)
+        
+        self._version = self.registry.version
     
-    async def report_failure(self, proxy_node: ProxyNode, error: str):
-        """报告代理请求失败"""
-        async with get_session() as session:
-            # 获取最新的节点数据
-            result = await session.execute(
-                select(ProxyNode).where(ProxyNode.id == proxy_node.id)
-            )
-            db_proxy = result.scalars().first()
-            
-            if db_proxy:
-                # 更新连接计数
-                db_proxy.current_connections = max(0, db_proxy.current_connections - 1)
-                logger.warning(f"代理 {db_proxy.host}:{db_proxy.port} 请求失败: {error}")
-                await session.commit()
+    def _track(self, node: NodeSnapshot, now: float):
+        """将可用节点加入堆或更新其键值"""
+        is_new = node.id not in self._heap
+        self._nodes[node.id] = node
+        
+        if self.mode == self.MODE_LEAST_CONN:
+            seq = 0 if is_new else self._heap.key(node.id)[1]
+            self._heap.push(node.id, (self._relative_load(node), seq))
+            return
+        
+        stride = 1.0 / node.weight
+        self._strides[node.id] = stride
+        if is_new:
+            self._seq += 1
+            self._heap.push(node.id, (now + stride / 2, self._seq))
@@ -0,0 +1,407 @@
+"""
+自定义规则表达式编译器
+
+规则条件使用 Python 表达式语法书写，例如::
+    
+    node.response_time < 100 and node.success_rate > 90
+    node.latency_p99 < 500
+    node.country in ('US', 'JP')
+    'premium' in (node.tags or '')
+
+表达式通过 ast 解析为受限的语法树（不使用 eval），只允许访问 node 的白名单字段、
+常量、比较、布尔运算和四则运算（除数为 0 时结果为 NaN），然后编译为对整列数据进行运算的函数。
+还没有延迟历史的节点，其 latency_p50/p95/p99 列为 NaN，与这些字段的任何大小比较均为假。
+安装了 NumPy 时列为 ndarray，使用向量化运算；否则列为普通 list，逐列计算。
+"""
+import ast
+import logging
+import math
+import operator
+from typing import Any, Callable, Dict, FrozenSet, List, Sequence
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - NumPy 为可选依赖
+    np = None
+
+from ipool.node.registry import NodeSnapshot
+
+logger = logging.getLogger(__name__)
+
+# 规则中可以访问的节点字段及列的缺省值（没有延迟历史不能当作延迟为 0）
+NUMERIC_FIELDS = {
+    "id": 0, "port": 0, "response_time": 0.0, "success_rate": 0.0, "check_success_rate": 0.0,
+    "weight": 0, "max_connections": 0, "current_connections": 0,
+    "latency_p50": math.nan, "latency_p95": math.nan, "latency_p99": math.nan,
+}
+BOOL_FIELDS = {"is_active": False, "is_healthy": False}
+STRING_FIELDS = {"name": "", "host": "", "protocol": "", "country": "", "region": "", "tags": ""}
+FIELDS = {**NUMERIC_FIELDS, **BOOL_FIELDS, **STRING_FIELDS}
+
+# 随每个连接变化、不会记录在注册表变更日志中的字段
+VOLATILE_FIELDS = frozenset({"current_connections"})
+
+# 由请求结果反馈直接写入节点快照、同样不会记录在变更日志中的字段
+FEEDBACK_FIELDS = frozenset({"response_time", "success_rate"})
+
+_COMPARE_OPS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+}
+
+
+def _divide(a, b):
+    """除法，除数为 0 时结果为 NaN（NumPy 与 list 两种列运算一致，NaN 参与的比较均为假）"""
+    if b == 0:
+        return math.nan
+    return a / b
+
+
+_ARITH_OPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: _divide,
+}
+
+
+class RuleSyntaxError(ValueError):
+    """规则表达式不合法"""
+
+
+class CompiledRule:
+    """编译后的规则条件"""
+    
+    __slots__ = ("condition", "fields", "_func")
+    
+    def __init__(self, condition: str, func: Callable, fields: FrozenSet[str]):
+        self.condition = condition
+        self.fields = fields
+        self._func = func
+    
+    @property
+    def volatile(self) -> bool:
+        """规则是否依赖频繁变化的字段"""
+        return bool(self.fields & VOLATILE_FIELDS)
+    
+    def evaluate(self, columns: "NodeColumns"):
+        """对所有节点求值，返回布尔列"""
+        return columns.ops.as_mask(self._func(columns), len(columns))
+
+
+class _NumpyOps:
+    """基于 NumPy 的列运算"""
+    
+    @staticmethod
+    def column(values: List[Any], field: str):
+        if field in STRING_FIELDS:
+            return np.array(values, dtype=object)
+        if field in BOOL_FIELDS:
+            return np.array(values, dtype=bool)
+        return np.array(values, dtype=float)
+    
+    @staticmethod
+    def compare(op, a, b):
+        return op(a, b)
+    
+    @staticmethod
+    def arith(op, a, b):
+        if op is _divide and (isinstance(a, np.ndarray) or isinstance(b, np.ndarray)):
+            a, b = np.broadcast_arrays(np.asarray(a, dtype=float), np.asarray(b, dtype=float))
+            return np.divide(a, b, out=np.full(a.shape, np.nan), where=b != 0)
+        return op(a, b)
+    
+    @staticmethod
+    def neg(a):
+        return -a
+    
+    @staticmethod
+    def logical_and(a, b):
+        return np.logical_and(a, b)
+    
+    @staticmethod
+    def logical_or(a, b):
+        return np.logical_or(a, b)
+    
+    @staticmethod
+    def logical_not(a):
+        return np.logical_not(a)
+    
+    @staticmethod
+    def coalesce(a, default):
+        if isinstance(a, np.ndarray):
+            return np.where(a.astype(bool), a, default)
+        return a or default
+    
+    @staticmethod
+    def contains(needle, haystack):
+        if isinstance(needle, np.ndarray):
+            # node.field in ('a', 'b')
+            return np.isin(needle, list(haystack))
+        if isinstance(haystack, np.ndarray):
+            # 'x' in node.field
+            return np.fromiter((needle in value for value in haystack), dtype=bool, count=len(haystack))
+        return needle in haystack
+    
+    @staticmethod
+    def as_mask(value, size: int):
+        if isinstance(value, np.ndarray):
+            return value.astype(bool)
+        return np.full(size, bool(value))
+    
+    @staticmethod
+    def zeros(size: int):
+        return np.zeros(size, dtype=float)
+    
+    @staticmethod
+    def add_where(scores, mask, priority: float):
+        scores += mask * priority
+        return scores
+    
+    @staticmethod
+    def best_indices(scores) -> List[int]:
+        if not len(scores):
+            return []
+        return np.flatnonzero(scores == scores.max()).tolist()
+
+
+class _ListOps:
+    """基于 list 的列运算（未安装 NumPy 时使用）"""
+    
+    @staticmethod
+    def column(values: List[Any], field: str):
+        return list(values)
+    
+    @staticmethod
+    def _apply(func, a, b):
+        if isinstance(a, list):
+            if isinstance(b, list):
+                return [func(x, y) for x, y in zip(a, b)]
+            return [func(x, b) for x in a]
+        if isinstance(b, list):
+            return [func(a, y) for y in b]
+        return func(a, b)
+    
+    @classmethod
+    def compare(cls, op, a, b):
+        return cls._apply(op, a, b)
+    
+    @classmethod
+    def arith(cls, op, a, b):
+        return cls._apply(op, a, b)
+    
+    @staticmethod
+    def neg(a):
+        return [-x for x in a] if isinstance(a, list) else -a
+    
+    @classmethod
+    def logical_and(cls, a, b):
+        return cls._apply(lambda x, y: bool(x) and bool(y), a, b)
+    
+    @classmethod
+    def logical_or(cls, a, b):
+        return cls._apply(lambda x, y: bool(x) or bool(y), a, b)
+    
+    @staticmethod
+    def logical_not(a):
+        return [not x for x in a] if isinstance(a, list) else not a
+    
+    @staticmethod
+    def coalesce(a, default):
+        return [x or default for x in a] if isinstance(a, list) else (a or default)
+    
+    @classmethod
+    def contains(cls, needle, haystack):
+        if isinstance(needle, list):
+            members = set(haystack)
+            return [x in members for x in needle]
+        if isinstance(haystack, list):
+            return [needle in value for value in haystack]
+        return needle in haystack
+    
+    @staticmethod
+    def as_mask(value, size: int):
+        if isinstance(value, list):
+            return [bool(x) for x in value]
+        return [bool(value)] * size
+    
+    @staticmethod
+    def zeros(size: int):
+        return [0.0] * size
+    
+    @staticmethod
+    def add_where(scores, mask, priority: float):
+        for i, matched in enumerate(mask):
+            if matched:
+                scores[i] += priority
+        return scores
+    
+    @staticmethod
+    def best_indices(scores) -> List[int]:
+        if not scores:
+            return []
+        best = max(scores)
+        return [i for i, score in enumerate(scores) if score == best]
+
+
+def _default_ops():
+    return _NumpyOps if np is not None else _ListOps
+
+
+class NodeColumns:
+    """节点属性的列式快照"""
+    
+    def __init__(self, nodes: Sequence[NodeSnapshot], fields=None, ops=None):
+        self.nodes = list(nodes)
+        self.ops = ops or _default_ops()
+        self._columns: Dict[str, Any] = {}
+        for field in fields or ():
+            self.load(field)
+    
+    def __len__(self) -> int:
+        return len(self.nodes)
+    
+    def load(self, field: str):
+        """(重新)读取一列数据"""
+        default = FIELDS[field]
+        values = []
+        for node in self.nodes:
+            value = getattr(node, field)
+            if value is None:
+                value = default
+            elif field == "protocol":
+                value = getattr(value, "value", value)
+            values.append(value)
+        self._columns[field] = self.ops.column(values, field)
+    
+    def __getitem__(self, field: str):
+        if field not in self._columns:
+            self.load(field)
+        return self._columns[field]
+
+
+class _Compiler:
+    """将受限的表达式语法树编译为列运算函数"""
+    
+    def __init__(self, condition: str):
+        self.condition = condition
+        self.fields = set()
+    
+    def compile(self) -> CompiledRule:
+        try:
+            tree = ast.parse(self.condition.strip(), mode="eval")
+        except SyntaxError as e:
+            raise RuleSyntaxError(f"规则语法错误: {e.msg}") from e
+        func = self._visit(tree.body)
+        return CompiledRule(self.condition, func, frozenset(self.fields))
+    
+    def _visit(self, node) -> Callable:
+        method = getattr(self, f"_visit_{type(node).__name__}", None)
+        if method is None:
+            raise RuleSyntaxError(f"规则中不允许使用 {type(node).__name__}")
+        return method(node)
+    
+    def _visit_Constant(self, node):
+        value = node.value
+        if not isinstance(value, (int, float, str, bool)) and value is not None:
+            raise RuleSyntaxError(f"不支持的常量: {value!r}")
+        return lambda cols: value
+    
+    def _visit_Tuple(self, node):
+        values = tuple(self._literal(elt) for elt in node.elts)
+        return lambda cols: values
+    
+    _visit_List = _visit_Tuple
+    _visit_Set = _visit_Tuple
+    
+    def _literal(self, node):
+        if not isinstance(node, ast.Constant):
+            raise RuleSyntaxError("集合中只允许常量")
+        return node.value
+    
+    def _visit_Attribute(self, node):
+        if not isinstance(node.value, ast.Name) or node.value.id != "node":
+            raise RuleSyntaxError("只允许访问 node 的属性")
+        field = node.attr
+        if field not in FIELDS:
+            raise RuleSyntaxError(f"不支持的节点字段: {field}")
+        self.fields.add(field)
+        return lambda cols: cols[field]
+    
+    def _visit_BoolOp(self, node):
+        # `node.tags or ''` 这类写法视为空值合并
+        last = node.values[-1]
+        if isinstance(node.op, ast.Or) and isinstance(last, ast.Constant) and not isinstance(last.value, bool):
+            head = self._visit(ast.BoolOp(op=ast.Or(), values=node.values[:-1])) if len(node.values) > 2 \
+                else self._visit(node.values[0])
+            default = last.value
+            return lambda cols: cols.ops.coalesce(head(cols), default)
+        
+        operands = [self._visit(value) for value in node.values]
+        if isinstance(node.op, ast.And):
+            def evaluate(cols):
+                result = operands[0](cols)
+                for operand in operands[1:]:
+                    result = cols.ops.logical_and(result, operand(cols))
+                return result
+        else:
+            def evaluate(cols):
+                result = operands[0](cols)
+                for operand in operands[1:]:
+                    result = cols.ops.logical_or(result, operand(cols))
+                return result
+        return evaluate
+    
+    def _visit_UnaryOp(self, node):
+        operand = self._visit(node.operand)
+        if isinstance(node.op, ast.Not):
+            return lambda cols: cols.ops.logical_not(operand(cols))
+        if isinstance(node.op, ast.USub):
+            return lambda cols: cols.ops.neg(operand(cols))
+        raise RuleSyntaxError(f"不支持的运算符: {type(node.op).__name__}")
+    
+    def _visit_BinOp(self, node):
+        op = _ARITH_OPS.get(type(node.op))
+        if op is None:
+            raise RuleSyntaxError(f"不支持的运算符: {type(node.op).__name__}")
+        left = self._visit(node.left)
+        right = self._visit(node.right)
+        return lambda cols: cols.ops.arith(op, left(cols), right(cols))
+    
+    def _visit_Compare(self, node):
+        parts = []
+        left = self._visit(node.left)
+        for op_node, comparator in zip(node.ops, node.comparators):
+            right = self._visit(comparator)
+            parts.append(self._compare(op_node, left, right))
+            left = right
+        
+        if len(parts) == 1:
+            return parts[0]
+        
+        # 链式比较 a < b < c 等价于 a < b and b < c
+        def evaluate(cols):
+            result = parts[0](cols)
+            for part in parts[1:]:
+                result = cols.ops.logical_and(result, part(cols))
+            return result
+        return evaluate
+    
+    def _compare(self, op_node, left, right):
+        if isinstance(op_node, ast.In):
+            return lambda cols: cols.ops.contains(left(cols), right(cols))
+        if isinstance(op_node, ast.NotIn):
+            return lambda cols: cols.ops.logical_not(cols.ops.contains(left(cols), right(cols)))
+        op = _COMPARE_OPS.get(type(op_node))
+        if op is None:
+            raise RuleSyntaxError(f"不支持的比较运算: {type(op_node).__name__}")
+        return lambda cols: cols.ops.compare(op, left(cols), right(cols))
+
+
+def compile_condition(condition: str) -> CompiledRule:
+    """编译规则条件表达式"""
+    return _Compiler(condition).compile()
@@ -0,0 +1,160 @@
+"""
+多进程工作模式
+
+控制进程（API、健康检查、数据库维护）派生 N 个数据面工作进程，每个工作进程运行
+自己的事件循环和 Socks5Server/HttpProxyServer，通过 SO_REUSEPORT 共享监听端口，
+由内核在进程间分发新连接。工作进程不从数据库加载节点，注册表由控制进程推送
+（见 ipool.node.sync）；连接计数和请求结果反馈仍由各进程批量写回数据库。
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+from multiprocessing.connection import Connection
+from multiprocessing.process import BaseProcess
+from typing import Dict
+
+from ipool.config import settings
+from ipool.loop import install_event_loop
+from ipool.node.connections import connection_counter
+from ipool.node.sync import RegistrySubscriber, registry_publisher
+from ipool.protocols.http import HttpProxyServer
+from ipool.protocols.pool import upstream_pool
+from ipool.protocols.socks5 import Socks5Server
+from ipool.scheduler.feedback import feedback_queue
+
+logger = logging.getLogger(__name__)
+
+# 工作进程异常退出后重新拉起前的等待时间（秒）
+RESTART_DELAY = 1.0
+
+
+def worker_count() -> int:
+    """配置的工作进程数，平台不支持 SO_REUSEPORT 时退回单进程"""
+    count = settings.workers or os.cpu_count() or 1
+    if count > 1 and not hasattr(socket, "SO_REUSEPORT"):
+        logger.warning("当前平台不支持 SO_REUSEPORT，使用单进程模式")
+        return 1
+    return count
+
+
+def run_worker(worker_id: int, conn: Connection):
+    """工作进程入口"""
+    install_event_loop()
+    try:
+        asyncio.run(_serve(worker_id, conn))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _serve(worker_id: int, conn: Connection):
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+    
+    # 等待控制进程推送的首份节点快照
+    subscriber = RegistrySubscriber(conn)
+    await subscriber.start()
+    
+    socks5_server = Socks5Server(host=settings.host, port=settings.socks5_port, reuse_port=True)
+    http_proxy = HttpProxyServer(host=settings.host, port=settings.http_proxy_port, reuse_port=True)
+    
+    def on_scheduler(scheduler):
+        socks5_server.scheduler = scheduler
+        http_proxy.scheduler = scheduler
+    subscriber.on_scheduler = on_scheduler
+    
+    tasks = [
+        asyncio.create_task(connection_counter.start()),
+        asyncio.create_task(upstream_pool.start()),
+        asyncio.create_task(feedback_queue.start()),
+        asyncio.create_task(socks5_server.start()),
+        asyncio.create_task(http_proxy.start()),
+    ]
+    logger.info(f"工作进程 {worker_id} (pid {os.getpid()}) 已启动")
+    
+    # 收到退出信号或控制进程退出时停止
+    waiters = [asyncio.create_task(stopping.wait()), asyncio.create_task(subscriber.wait_closed())]
+    await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+    
+    for task in tasks + waiters:
+        task.cancel()
+    await asyncio.gather(*tasks, *waiters, return_exceptions=True)
+    await upstream_pool.stop()
+    await feedback_queue.stop()
+    await connection_counter.stop()
+    logger.info(f"工作进程 {worker_id} 已退出")
+
+
+class WorkerSupervisor:
+    """
+    在控制进程中管理数据面工作进程
+    
+    每个工作进程一个单向 Pipe 用于推送注册表；工作进程异常退出时重新拉起，
+    新进程同样先收到全量快照再开始监听。
+    """
+    
+    def __init__(self, count: int = None):
+        self.count = count or worker_count()
+        # 使用 spawn 启动，子进程不继承控制进程的事件循环和数据库连接
+        self._context = multiprocessing.get_context("spawn")
+        self._processes: Dict[int, BaseProcess] = {}
+        self._running = False
+    
+    async def start(self):
+        """启动所有工作进程并监视其退出"""
+        if self._running:
+            return
+        
+        self._running = True
+        logger.info(f"启动 {self.count} 个工作进程，代理端口通过 SO_REUSEPORT 共享")
+        for worker_id in range(self.count):
+            self._spawn(worker_id)
+    
+    async def stop(self):
+        """通知所有工作进程退出并等待结束"""
+        self._running = False
+        loop = asyncio.get_running_loop()
+        for worker_id, process in list(self._processes.items()):
+            loop.remove_reader(process.sentinel)
+            registry_publisher.detach(worker_id)
+            process.terminate()
+        for process in self._processes.values():
+            await loop.run_in_executor(None, process.join, 10)
+            if process.is_alive():
+                process.kill()
+        self._processes.clear()
+        logger.info("所有工作进程已退出")
+    
+    def _spawn(self, worker_id: int):
+        receiver, sender = self._context.Pipe(duplex=False)
+        process = self._context.Process(
+            target=run_worker,
+            args=(worker_id, receiver),
+            name=f"ipool-worker-{worker_id}",
+            daemon=True
+        )
+        process.start()
+        # 子进程已持有接收端，父进程关闭自己的副本，控制进程退出时子进程才能读到 EOF
+        receiver.close()
+        self._processes[worker_id] = process
+        registry_publisher.attach(worker_id, sender)
+        asyncio.get_running_loop().add_reader(process.sentinel, self._on_exit, worker_id)
+    
+    def _on_exit(self, worker_id: int):
+        loop = asyncio.get_running_loop()
+        process = self._processes.pop(worker_id)
+        loop.remove_reader(process.sentinel)
+        registry_publisher.detach(worker_id)
+        process.join()
+        if not self._running:
+            return
+        logger.error(f"工作进程 {worker_id} 异常退出 (exitcode {process.exitcode})，{RESTART_DELAY}秒后重启")
+        loop.call_later(RESTART_DELAY, self._restart, worker_id)
+    
+    def _restart(self, worker_id: int):
+        if self._running and worker_id not in self._processes:
+            self._spawn(worker_id)
@@ -10,7 +10,14 @@ from ipool.api.app import create_app
 from ipool.protocols.socks5 import Socks5Server
 from ipool.protocols.http import HttpProxyServer
 from ipool.health.checker import HealthChecker
+from ipool.health.history import health_history
 from ipool.storage.database import init_db
+from ipool.node.registry import node_registry
+from ipool.node.connections import connection_counter
+from ipool.protocols.pool import upstream_pool
+from ipool.scheduler.feedback import feedback_queue
+from ipool.loop import install_event_loop
+from ipool.workers import WorkerSupervisor, worker_count
 
 # 配置日志
 logging.basicConfig(
@@ -29,6 +36,15 @@ async def start_services():
     # 初始化数据库
     await init_db()
     
+    # 上次运行遗留的连接计数已失效
+    await connection_counter.reset()
+    
+    # 加载节点注册表，调度器从内存中选择节点
+    await node_registry.load()
+    
+    # 从数据库恢复健康检查历史，延迟分位数随注册表快照提供给调度规则
+    await health_history.load()
+    
     # 创建FastAPI应用
     app = create_app()
     
@@ -36,13 +52,28 @@ async def start_services():
     health_checker = HealthChecker()
     asyncio.create_task(health_checker.start())
     
-    # 启动Socks5服务器
-    socks5_server = Socks5Server(host=settings.host, port=settings.socks5_port)
-    asyncio.create_task(socks5_server.start())
-    
-    # 启动HTTP代理服务器
-    http_proxy = HttpProxyServer(host=settings.host, port=settings.http_proxy_port)
-    asyncio.create_task(http_proxy.start())
+    workers = worker_count()
+    if workers > 1:
+        # 多进程模式：代理服务运行在工作进程中，本进程只作为控制进程
+        supervisor = WorkerSupervisor(workers)
+        await supervisor.start()
+    else:
+        # 启动连接计数批量写回
+        asyncio.create_task(connection_counter.start())
+        
+        # 启动上游连接池维护
+        asyncio.create_task(upstream_pool.start())
+        
+        # 启动请求结果批量反馈
+        asyncio.create_task(feedback_queue.start())
+        
+        # 启动Socks5服务器
+        socks5_server = Socks5Server(host=settings.host, port=settings.socks5_port)
+        asyncio.create_task(socks5_server.start())
+        
+        # 启动HTTP代理服务器
+        http_proxy = HttpProxyServer(host=settings.host, port=settings.http_proxy_port)
+        asyncio.create_task(http_proxy.start())
     
     # 启动API服务器
     config = uvicorn.Config(
@@ -53,7 +84,13 @@ async def start_services():
         reload=settings.debug
     )
     server = uvicorn.Server(config)
-    await server.serve()
+    try:
+        await server.serve()
+    finally:
+        if workers > 1:
+            await supervisor.stop()
+        else:
+            await feedback_queue.stop()
 
 
 if __name__ == "__main__":
@@ -69,7 +106,8 @@ if __name__ == "__main__":
     logger.info("="*50)
     
     try:
-        # 启动所有服务
+        # 选择事件循环后端，之后启动所有服务
+        logger.info(f"事件循环: {install_event_loop()}")
         asyncio.run(start_services())
     except KeyboardInterrupt:
         logger.info("正在关闭服务...")
@@ -0,0 +1,144 @@
+import asyncio
+import contextlib
+import socket
+import struct
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def make_node(node_id: int, **fields) -> SimpleNamespace:
+    """构造带有全部快照字段的节点对象，可直接交给 NodeRegistry"""
+    node = dict(
+        id=node_id, name=f"node-{node_id}", host=f"10.0.0.{node_id}", port=1080,
+        protocol="socks5", username=None, password=None,
+        is_active=True, is_healthy=True, response_time=50.0, success_rate=100.0,
+        check_success_rate=100.0,
+        weight=1, max_connections=100, country=None, region=None, tags=None,
+    )
+    node.update(fields)
+    return SimpleNamespace(**node)
+
+
+class FakeSession:
+    """记录执行参数的数据库会话替身，fail 为 True 时执行失败"""
+    
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.executed = []
+    
+    async def execute(self, stmt, params=None):
+        if self.fail:
+            raise RuntimeError("database unavailable")
+        self.executed.append(params)
+    
+    async def commit(self):
+        pass
+
+
+def patch_session(monkeypatch, module) -> FakeSession:
+    """把模块中的 get_session 替换为返回 FakeSession 的版本"""
+    fake = FakeSession()
+    
+    @contextlib.asynccontextmanager
+    async def get_session():
+        yield fake
+    
+    monkeypatch.setattr(module, "get_session", get_session)
+    return fake
+
+
+@pytest.fixture
+def registry():
+    from ipool.node.registry import NodeRegistry
+    return NodeRegistry()
+
+
+async def _pipe(reader, writer):
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+    except (ConnectionError, OSError):
+        pass
+    finally:
+        try:
+            writer.close()
+        except Exception:
+            pass
+
+
+async def _splice(client_reader, client_writer, host, port):
+    remote_reader, remote_writer = await asyncio.open_connection(host, port)
+    await asyncio.gather(_pipe(client_reader, remote_writer), _pipe(remote_reader, client_writer))
+
+
+class FakeProxy:
+    """测试用的最小上游代理（socks5 或 http CONNECT），记录收到的连接数"""
+    
+    def __init__(self, protocol: str):
+        self.protocol = protocol
+        self.connections = 0
+        self.server = None
+        self.port = None
+    
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+    
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+    
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        try:
+            if self.protocol == "socks5":
+                await self._socks5(reader, writer)
+            else:
+                await self._http_connect(reader, writer)
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            writer.close()
+    
+    async def _socks5(self, reader, writer):
+        _, nmethods = await reader.readexactly(2)
+        await reader.readexactly(nmethods)
+        writer.write(b"\x05\x00")
+        _, _, _, atyp = await reader.readexactly(4)
+        if atyp == 1:
+            host = socket.inet_ntoa(await reader.readexactly(4))
+        elif atyp == 3:
+            host = (await reader.readexactly((await reader.readexactly(1))[0])).decode()
+        else:
+            host = socket.inet_ntop(socket.AF_INET6, await reader.readexactly(16))
+        port = struct.unpack("!H", await reader.readexactly(2))[0]
+        try:
+            remote_reader, remote_writer = await asyncio.open_connection(host, port)
+        except OSError:
+            writer.write(b"\x05\x05\x00\x01\x00\x00\x00\x00\x00\x00")
+            writer.close()
+            return
+        writer.write(b"\x05\x00\x00\x01\x00\x00\x00\x00\x00\x00")
+        await asyncio.gather(_pipe(reader, remote_writer), _pipe(remote_reader, writer))
+    
+    async def _http_connect(self, reader, writer):
+        head = await reader.readuntil(b"\r\n\r\n")
+        method, authority, _ = head.split(b"\r\n", 1)[0].decode().split(" ", 2)
+        assert method == "CONNECT"
+        host, port = authority.rsplit(":", 1)
+        writer.write(b"HTTP/1.1 200 Connection established\r\n\r\n")
+        await _splice(reader, writer, host, int(port))
+
+
+async def start_echo_server():
+    """回显服务器，返回 (server, port)"""
+    server = await asyncio.start_server(_pipe, "127.0.0.1", 0)
+    return server, server.sockets[0].getsockname()[1]
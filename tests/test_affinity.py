@@ -0,0 +1,76 @@
+from conftest import make_node
+
+from ipool.node.connections import connection_counter
+from ipool.scheduler.affinity import ConsistentHashRing, SessionAffinity
+from ipool.scheduler.filters import NodeFilter
+
+
+def _affinity():
+    return SessionAffinity(ttl=600, max_sessions=1000, load_factor=1.25, replicas=20)
+
+
+def test_incremental_ring_updates_match_rebuild():
+    ring = ConsistentHashRing(replicas=10)
+    ring.rebuild(range(10))
+    ring.update(added=[10, 11, 3], removed=[2, 5, 99])
+    ring.remove(7)
+    ring.add(12)
+    
+    expected = ConsistentHashRing(replicas=10)
+    expected.rebuild([0, 1, 3, 4, 6, 8, 9, 10, 11, 12])
+    assert ring._hashes == expected._hashes
+    assert ring._node_ids == expected._node_ids
+    assert len(ring) == 10
+
+
+def test_walk_visits_each_node_once():
+    ring = ConsistentHashRing(replicas=10)
+    ring.rebuild(range(5))
+    assert sorted(ring.walk("session")) == [0, 1, 2, 3, 4]
+
+
+def test_sessions_stick_and_only_remap_from_removed_node(registry):
+    registry.replace([make_node(i) for i in range(1, 11)])
+    affinity = _affinity()
+    before = {f"s{i}": affinity.pick(f"s{i}", registry).id for i in range(200)}
+    assert {f"s{i}": affinity.pick(f"s{i}", registry).id for i in range(200)} == before
+    
+    registry.update_health(3, False, 10000, 0.0)
+    # 清空会话表，只看哈希环的映射变化
+    affinity._sessions.clear()
+    after = {f"s{i}": affinity.pick(f"s{i}", registry).id for i in range(200)}
+    moved = {key for key in before if before[key] != after[key]}
+    assert moved == {key for key, node_id in before.items() if node_id == 3}
+
+
+def test_bounded_load_spills_to_next_node(registry):
+    registry.replace([make_node(1), make_node(2)])
+    affinity = _affinity()
+    node = affinity.pick("hot", registry)
+    node.current_connections = 100
+    connection_counter.total = 100
+    try:
+        affinity._sessions.clear()
+        assert affinity.pick("hot", registry).id != node.id
+    finally:
+        node.current_connections = 0
+        connection_counter.total = 0
+
+
+def test_selective_filter_falls_back_to_filtered_pick(registry):
+    nodes = [make_node(i, country="US") for i in range(1, 200)] + [make_node(500, country="JP"), make_node(501, country="JP")]
+    registry.replace(nodes)
+    affinity = _affinity()
+    node_filter = NodeFilter.parse("country-JP-session-abc")
+    picks = set()
+    for i in range(50):
+        affinity._sessions.clear()
+        picks.add(affinity.pick(f"session-{i}", registry, node_filter).id)
+    assert picks <= {500, 501}
+    # 同一会话的选择是确定的
+    affinity._sessions.clear()
+    first = affinity.pick("abc", registry, node_filter).id
+    affinity._sessions.clear()
+    assert affinity.pick("abc", registry, node_filter).id == first
+    
+    assert affinity.pick("x", registry, NodeFilter.parse("country-FR")) is None
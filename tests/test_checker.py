@@ -0,0 +1,77 @@
+import asyncio
+
+from conftest import make_node
+
+from ipool.health.checker import HealthChecker
+from ipool.health.schedule import CheckSchedule
+from ipool.node.models import HealthCheckResult
+
+
+def _tiered(node, probe_ok: bool, full_due: bool):
+    checker = HealthChecker()
+    checker.schedule = CheckSchedule(interval=60, min_interval=10, max_interval=600, full_interval=3600)
+    checker.schedule.add_spread([node.id])
+    if not full_due:
+        checker.schedule.record(node.id, bool(node.is_healthy), full=True)
+    calls = []
+    
+    async def check(proxy):
+        calls.append("check")
+        return HealthCheckResult(success=True, response_time=100)
+    
+    async def probe(proxy):
+        calls.append("probe")
+        return HealthCheckResult(success=probe_ok, response_time=5)
+    
+    checker.engine.check = check
+    checker.engine.probe = probe
+    (result, full) = asyncio.run(checker._check_node(node))
+    return calls, result, full
+
+
+def test_full_check_when_due():
+    calls, _, full = _tiered(make_node(1), probe_ok=True, full_due=True)
+    assert (calls, full) == (["check"], True)
+
+
+def test_probe_only_when_it_agrees_with_node_state():
+    calls, result, full = _tiered(make_node(1, is_healthy=True), probe_ok=True, full_due=False)
+    assert (calls, full) == (["probe"], False)
+    assert result.response_time == 5
+    
+    calls, _, full = _tiered(make_node(2, is_healthy=False), probe_ok=False, full_due=False)
+    assert (calls, full) == (["probe"], False)
+
+
+def test_disagreeing_probe_is_confirmed_by_a_full_check():
+    calls, result, full = _tiered(make_node(1, is_healthy=False), probe_ok=True, full_due=False)
+    assert (calls, full) == (["probe", "check"], True)
+    assert result.response_time == 100
+    
+    calls, _, full = _tiered(make_node(2, is_healthy=True), probe_ok=False, full_due=False)
+    assert (calls, full) == (["probe", "check"], True)
+
+
+def test_check_results_do_not_overwrite_traffic_success_rate(monkeypatch, registry):
+    from ipool.health import checker as checker_module
+    from ipool.health.history import HealthHistory
+    from ipool.health.writer import HealthResultWriter
+    
+    registry.replace([make_node(1, success_rate=97.5)])
+    monkeypatch.setattr(checker_module, "node_registry", registry)
+    checker = HealthChecker()
+    checker.history = HealthHistory(size=16, window=600, bucket=60)
+    checker.schedule.add_spread([1])
+    writer = HealthResultWriter(batch_size=100)
+    node = registry.get(1)
+    
+    async def run():
+        await checker._handle_result(node, HealthCheckResult(success=True, response_time=80), True, writer)
+        await checker._handle_result(node, HealthCheckResult(success=False, response_time=0), True, writer)
+    
+    asyncio.run(run())
+    # 检查结果写入 check_success_rate，success_rate 由请求结果反馈维护
+    assert node.check_success_rate == 50.0
+    assert node.success_rate == 97.5
+    assert "success_rate" not in writer._pending[1]
+    assert writer._pending[1]["check_success_rate"] == 50.0
@@ -0,0 +1,136 @@
+import asyncio
+import random
+
+import pytest
+from conftest import make_node
+
+from ipool.config import settings
+from ipool.node.registry import NodeSnapshot
+from ipool.protocols import base
+from ipool.protocols.http import HttpProxyServer
+from ipool.protocols.upstream import UpstreamError
+from ipool.scheduler.random import RandomScheduler
+from ipool.scheduler.filters import NodeFilter
+
+
+class _Scheduler:
+    """按顺序返回节点并记录结果报告的调度器替身"""
+    
+    def __init__(self, nodes):
+        self.nodes = list(nodes)
+        self.reports = []
+    
+    async def next_proxy(self, node_filter=None):
+        return self.nodes.pop(0) if self.nodes else None
+    
+    async def session_proxy(self, node_filter):
+        return await self.next_proxy(node_filter)
+    
+    async def report_failure(self, proxy_node, error, kind=None):
+        self.reports.append(("failure", proxy_node.id, kind))
+    
+    async def report_aborted(self, proxy_node):
+        self.reports.append(("aborted", proxy_node.id))
+
+
+class _RandomScheduler(RandomScheduler):
+    """记录结果报告的真实随机调度器"""
+    
+    def __init__(self, registry):
+        super().__init__()
+        self.registry = registry
+        self.reports = []
+    
+    async def report_failure(self, proxy_node, error, kind=None):
+        self._release(proxy_node)
+        self.reports.append(("failure", proxy_node.id, kind))
+    
+    async def report_aborted(self, proxy_node):
+        self._release(proxy_node)
+        self.reports.append(("aborted", proxy_node.id))
+
+
+class _Writer:
+    def __init__(self):
+        self.closed = False
+    
+    def close(self):
+        self.closed = True
+
+
+def _connect(monkeypatch, nodes, behaviours, node_filter=None, scheduler=None):
+    """behaviours: 节点ID -> (延迟秒数, 是否成功)"""
+    writers = {}
+    
+    async def open_upstream(proxy_node, host, port):
+        delay, ok = behaviours[proxy_node.id]
+        await asyncio.sleep(delay)
+        if not ok:
+            raise UpstreamError("refused", UpstreamError.REFUSED)
+        writers[proxy_node.id] = _Writer()
+        return object(), writers[proxy_node.id]
+    
+    monkeypatch.setattr(base, "open_upstream", open_upstream)
+    server = HttpProxyServer()
+    server.scheduler = scheduler or _Scheduler(NodeSnapshot(make_node(i)) for i in nodes)
+    
+    async def run():
+        return await server.connect_target("example.com", 443, node_filter)
+    
+    return asyncio.run(run()), server.scheduler.reports, writers
+
+
+@pytest.fixture(autouse=True)
+def connect_settings(monkeypatch):
+    monkeypatch.setattr(settings, "connect_race_delay", 0.05)
+    monkeypatch.setattr(settings, "connect_max_attempts", 3)
+
+
+def test_failed_node_is_reported_and_retried_on_another(monkeypatch):
+    result, reports, _ = _connect(monkeypatch, [1, 2], {1: (0, False), 2: (0, True)})
+    assert result[0].id == 2
+    assert reports == [("failure", 1, UpstreamError.REFUSED)]
+
+
+def test_slow_node_is_raced_by_a_second_node(monkeypatch):
+    result, reports, _ = _connect(monkeypatch, [1, 2], {1: (10, True), 2: (0, True)})
+    assert result[0].id == 2
+    # 落后的尝试被取消，不计为失败
+    assert reports == [("aborted", 1)]
+
+
+def test_all_attempts_failing_raises_the_last_error(monkeypatch):
+    with pytest.raises(UpstreamError):
+        _connect(monkeypatch, [1, 2, 3, 4], {i: (0, False) for i in range(1, 5)})
+
+
+def test_attempts_are_bounded(monkeypatch):
+    monkeypatch.setattr(settings, "connect_max_attempts", 2)
+    with pytest.raises(UpstreamError):
+        _connect(monkeypatch, [1, 2, 3], {1: (0, False), 2: (0, False), 3: (0, True)})
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_retry_excludes_nodes_already_tried(monkeypatch, registry, seed):
+    # 小节点池中随机调度器经常重复选中同一个节点，重试时排除已尝试的节点
+    random.seed(seed)
+    registry.replace([make_node(1), make_node(2), make_node(3)])
+    result, reports, _ = _connect(
+        monkeypatch, [], {1: (0, False), 2: (0, False), 3: (0, True)}, scheduler=_RandomScheduler(registry)
+    )
+    assert result[0].id == 3
+    assert all(report[0] == "failure" for report in reports)
+    assert len(reports) == len({report[1] for report in reports})
+
+
+def test_no_available_node_returns_none(monkeypatch):
+    result, reports, _ = _connect(monkeypatch, [], {})
+    assert result is None
+    assert reports == []
+
+
+def test_session_requests_use_a_single_attempt(monkeypatch):
+    node_filter = NodeFilter.parse("session-abc")
+    assert node_filter.session
+    with pytest.raises(UpstreamError):
+        _connect(monkeypatch, [1, 2], {1: (0, False), 2: (0, True)}, node_filter)
@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+from conftest import make_node, patch_session
+
+from ipool.node import connections
+from ipool.node.connections import ConnectionCounter
+from ipool.node.registry import NodeSnapshot
+
+
+@pytest.fixture
+def session(monkeypatch):
+    return patch_session(monkeypatch, connections)
+
+
+def test_acquire_and_release_update_snapshot():
+    counter = ConnectionCounter(flush_interval=1)
+    node = NodeSnapshot(make_node(1))
+    counter.acquire(node)
+    counter.acquire(node)
+    counter.release(node)
+    assert node.current_connections == 1
+    assert counter.total == 1
+    # 连接数不会减到负数
+    counter.release(node)
+    counter.release(node)
+    assert node.current_connections == 0
+
+
+def test_release_after_registry_replace(registry):
+    counter = ConnectionCounter(flush_interval=1)
+    registry.replace([make_node(1, tags="old")])
+    node = registry.get(1)
+    counter.acquire(node)
+    # 连接进行中注册表被全量重新加载（例如工作进程收到重置消息）
+    registry.replace([make_node(1, tags="new"), make_node(2)])
+    counter.release(node)
+    assert registry.get(1) is node
+    assert node.tags == "new"
+    assert node.current_connections == 0
+    assert counter.total == 0
+
+
+def test_flush_writes_net_deltas_in_one_batch(session):
+    counter = ConnectionCounter(flush_interval=1)
+    first, second, third = (NodeSnapshot(make_node(i)) for i in (1, 2, 3))
+    counter.acquire(first)
+    counter.acquire(first)
+    counter.acquire(second)
+    counter.acquire(third)
+    counter.release(third)
+    asyncio.run(counter.flush())
+    assert session.executed == [[{"node_id": 1, "delta": 2}, {"node_id": 2, "delta": 1}]]
+    
+    # 写回后增量清空
+    asyncio.run(counter.flush())
+    assert len(session.executed) == 1
+
+
+def test_failed_flush_keeps_deltas(session):
+    counter = ConnectionCounter(flush_interval=1)
+    node = NodeSnapshot(make_node(1))
+    counter.acquire(node)
+    session.fail = True
+    with pytest.raises(RuntimeError):
+        asyncio.run(counter.flush())
+    session.fail = False
+    counter.acquire(node)
+    asyncio.run(counter.flush())
+    assert session.executed == [[{"node_id": 1, "delta": 2}]]
@@ -0,0 +1,92 @@
+import asyncio
+
+from conftest import FakeProxy, make_node
+
+from ipool.health.engine import FAILED_RESPONSE_TIME, HealthCheckEngine
+from ipool.node.models import HealthCheckResult
+
+
+async def _http_server(status: int):
+    async def handle(reader, writer):
+        await reader.readuntil(b"\r\n\r\n")
+        writer.write(b"HTTP/1.1 %d X\r\nContent-Length: 0\r\nConnection: close\r\n\r\n" % status)
+        await writer.drain()
+        writer.close()
+    
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+def _check(status: int, probe: bool = False, port=None):
+    async def run():
+        server, target_port = await _http_server(status)
+        proxy = await FakeProxy("socks5").start()
+        engine = HealthCheckEngine(f"http://127.0.0.1:{target_port}/", timeout=5, concurrency=4)
+        await engine.start()
+        try:
+            node = make_node(1, host="127.0.0.1", port=port or proxy.port)
+            return await (engine.probe(node) if probe else engine.check(node))
+        finally:
+            await engine.close()
+            await proxy.close()
+            server.close()
+    
+    return asyncio.run(run())
+
+
+def test_check_through_socks_node():
+    assert _check(200).success
+    result = _check(500)
+    assert not result.success
+    assert "500" in result.error_message
+
+
+def test_probe_only_needs_the_tunnel():
+    # 探测不发送请求，目标返回错误状态也不影响结果
+    assert _check(500, probe=True).success
+    result = _check(200, probe=True, port=1)
+    assert not result.success
+    assert result.response_time == FAILED_RESPONSE_TIME
+
+
+def test_check_many_bounds_concurrency():
+    async def run():
+        engine = HealthCheckEngine("http://127.0.0.1/", timeout=5, concurrency=3)
+        await engine.start()
+        running = peak = 0
+        
+        async def check(node):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            return HealthCheckResult(success=True, response_time=1)
+        
+        try:
+            seen = [node.id async for node, _ in engine.check_many((make_node(i) for i in range(20)), check)]
+        finally:
+            await engine.close()
+        return seen, peak
+    
+    seen, peak = asyncio.run(run())
+    assert sorted(seen) == list(range(20))
+    assert peak == 3
+
+
+def test_slow_check_times_out():
+    async def run():
+        engine = HealthCheckEngine("http://127.0.0.1/", timeout=0.05, concurrency=1)
+        await engine.start()
+        
+        async def hang(node):
+            await asyncio.sleep(10)
+        
+        try:
+            return await engine._run(make_node(1), hang)
+        finally:
+            await engine.close()
+    
+    result = asyncio.run(run())
+    assert not result.success
+    assert result.error_message == "请求超时"
@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+from conftest import make_node, patch_session
+
+from ipool.node.registry import NodeSnapshot
+from ipool.scheduler import base as scheduler_base
+from ipool.scheduler import feedback as feedback_module
+from ipool.scheduler.custom import CustomRuleScheduler
+from ipool.scheduler.feedback import MIN_RATE_SAMPLES, FeedbackQueue, Outcome
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+    
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def session(monkeypatch):
+    return patch_session(monkeypatch, feedback_module)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = _Clock()
+    monkeypatch.setattr(feedback_module.time, "monotonic", fake)
+    return fake
+
+
+def _submit(queue, node, successes=0, failures=0, latency=None):
+    for _ in range(successes):
+        queue.submit(Outcome(node, True, connect_time=latency))
+    for _ in range(failures):
+        queue.submit(Outcome(node, False, error_kind="refused"))
+
+
+def test_success_rate_is_windowed_and_recovers(session, clock):
+    queue = FeedbackQueue(batch_size=10, rate_window=60)
+    node = NodeSnapshot(make_node(1, success_rate=100.0))
+    
+    _submit(queue, node, successes=5, failures=5)
+    asyncio.run(queue.flush())
+    assert node.success_rate == 50.0
+    
+    clock.now += 30
+    _submit(queue, node, successes=10)
+    asyncio.run(queue.flush())
+    assert node.success_rate == 75.0
+    
+    # 失败的批次滑出窗口后成功率恢复
+    clock.now += 45
+    _submit(queue, node, successes=5)
+    asyncio.run(queue.flush())
+    assert node.success_rate == 100.0
+
+
+def test_few_samples_do_not_override_success_rate(session, clock):
+    queue = FeedbackQueue(rate_window=60)
+    node = NodeSnapshot(make_node(1, success_rate=90.0))
+    _submit(queue, node, failures=MIN_RATE_SAMPLES - 1)
+    asyncio.run(queue.flush())
+    assert node.success_rate == 90.0
+    # 没有变化的节点不写回数据库
+    assert session.executed == []
+
+
+def test_latency_and_rate_changes_are_written_back_in_one_batch(session, clock):
+    queue = FeedbackQueue(rate_window=60)
+    fast = NodeSnapshot(make_node(1, response_time=100.0))
+    flaky = NodeSnapshot(make_node(2))
+    _submit(queue, fast, successes=1, latency=50.0)
+    _submit(queue, flaky, successes=2, failures=MIN_RATE_SAMPLES)
+    asyncio.run(queue.flush())
+    
+    assert fast.response_time == pytest.approx(85.0)
+    [params] = session.executed
+    assert {row["node_id"] for row in params} == {1, 2}
+    assert queue._windows.keys() == {1, 2}
+    
+    # 整个窗口内没有新结果的节点被丢弃
+    clock.now += 120
+    _submit(queue, fast, successes=1, latency=50.0)
+    asyncio.run(queue.flush())
+    assert queue._windows.keys() == {1}
+
+
+def test_feedback_invalidates_custom_rule_scores(session, clock, registry, monkeypatch):
+    registry.replace([make_node(1), make_node(2)])
+    scheduler = CustomRuleScheduler([
+        {"name": "稳定节点优先", "condition": "node.success_rate > 90", "priority": 100},
+    ])
+    scheduler.registry = registry
+    monkeypatch.setattr(scheduler_base, "get_scheduler", lambda: scheduler)
+    
+    async def run():
+        picks = {(await scheduler.next_proxy()).id for _ in range(50)}
+        queue = FeedbackQueue(rate_window=60)
+        _submit(queue, registry.get(1), failures=MIN_RATE_SAMPLES)
+        await queue.flush()
+        return picks, {(await scheduler.next_proxy()).id for _ in range(50)}
+    
+    before, after = asyncio.run(run())
+    assert before == {1, 2}
+    assert after == {2}
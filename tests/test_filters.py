@@ -0,0 +1,54 @@
+from conftest import make_node
+
+from ipool.scheduler.filters import NodeFilter
+
+
+def test_parse_key_value_pairs():
+    node_filter = NodeFilter.parse("user-country-JP-region-tokyo-tag-Residential-tag-fast-protocol-SOCKS5")
+    assert node_filter.country == "JP"
+    assert node_filter.region == "tokyo"
+    assert node_filter.protocol == "socks5"
+    assert node_filter.tags == ["residential", "fast"]
+    assert node_filter.session is None
+
+
+def test_parse_ignores_unknown_and_dangling_tokens():
+    node_filter = NodeFilter.parse("alice-foo-country-US-tag")
+    assert node_filter.country == "US"
+    assert node_filter.tags == []
+
+
+def test_parse_without_conditions_returns_none():
+    assert NodeFilter.parse(None) is None
+    assert NodeFilter.parse("") is None
+    assert NodeFilter.parse("alice") is None
+    assert NodeFilter.parse("country-") is None
+
+
+def test_session_only_filter_is_empty_but_kept():
+    node_filter = NodeFilter.parse("alice-session-abc123")
+    assert node_filter.session == "abc123"
+    assert node_filter.is_empty
+
+
+def test_mask_uses_registry_indexes(registry):
+    registry.replace([
+        make_node(1, country="US", tags="premium"),
+        make_node(2, country="US"),
+        make_node(3, country="JP", tags="premium"),
+    ])
+    node_filter = NodeFilter.parse("country-us-tag-premium")
+    assert registry.ids_in(node_filter.mask(registry)) == [1]
+
+
+def test_excluding_copies_the_filter(registry):
+    registry.replace([make_node(1, country="US"), make_node(2, country="US"), make_node(3, country="JP")])
+    node_filter = NodeFilter.parse("country-us")
+    excluded = node_filter.excluding([1])
+    assert registry.ids_in(excluded.mask(registry)) == [2]
+    assert registry.ids_in(node_filter.mask(registry)) == [1, 2]
+    
+    # 只有排除条件时同样走筛选路径
+    only_excluded = NodeFilter().excluding([2, 99])
+    assert not only_excluded.is_empty
+    assert registry.ids_in(only_excluded.mask(registry)) == [1, 3]
@@ -0,0 +1,39 @@
+import asyncio
+import random
+
+from conftest import make_node
+
+from ipool.scheduler.health_first import HealthFirstScheduler
+
+
+def _scheduler(registry, top_k=2):
+    scheduler = HealthFirstScheduler(top_k=top_k)
+    scheduler.registry = registry
+    return scheduler
+
+
+def test_picks_only_from_top_k(registry):
+    random.seed(4)
+    registry.replace([make_node(i, response_time=i * 100.0) for i in range(1, 8)])
+    scheduler = _scheduler(registry)
+    # 不释放连接，负载上升后两次随机选择会转向前 K 名中的另一个节点
+    picks = {asyncio.run(scheduler.next_proxy()).id for _ in range(50)}
+    assert picks == {1, 2}
+
+
+def test_ranking_is_sorted_and_updated_incrementally(registry):
+    registry.replace([make_node(i, response_time=i * 100.0) for i in range(1, 6)])
+    scheduler = _scheduler(registry)
+    scheduler._sync()
+    assert [node_id for _, node_id in scheduler._ranking] == [1, 2, 3, 4, 5]
+    
+    registry.update_health(5, True, 1.0, 100.0)
+    registry.update_health(1, False, 10000, 0.0)
+    scheduler._sync()
+    assert [node_id for _, node_id in scheduler._ranking] == [5, 2, 3, 4]
+    assert scheduler._ranking == sorted(scheduler._ranking)
+
+
+def test_no_available_nodes(registry):
+    registry.replace([make_node(1, is_healthy=False)])
+    assert asyncio.run(_scheduler(registry).next_proxy()) is None
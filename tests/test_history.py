@@ -0,0 +1,145 @@
+import asyncio
+import contextlib
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from conftest import make_node, patch_session
+
+from ipool.health import history as history_module
+from ipool.health.history import HealthHistory
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = SimpleNamespace(value=1_000_020.0)
+    monkeypatch.setattr(history_module, "time", SimpleNamespace(time=lambda: now.value))
+    return now
+
+
+def test_percentiles_and_success_rate(clock):
+    history = HealthHistory(size=64, window=600, bucket=60)
+    for latency in range(10, 101, 10):
+        history.record(1, True, float(latency))
+    stats = None
+    for _ in range(10):
+        stats = history.record(1, False, 500.0)
+
+    assert stats.samples == 20
+    assert stats.success_rate == 50.0
+    # 失败的检查不计入延迟
+    assert (stats.p50, stats.p95, stats.p99) == (50.0, 100.0, 100.0)
+    assert history.stats(1) == stats
+
+
+def test_probes_do_not_evict_latency_samples(clock):
+    history = HealthHistory(size=4, window=600, bucket=60)
+    history.record(1, True, 80.0)
+    for _ in range(10):
+        clock.value += 1
+        stats = history.record(1, True)
+
+    # 结果缓冲区只剩最近 4 次探测，完整检查的延迟仍然保留
+    assert stats.samples == 4
+    assert stats.p50 == 80.0
+
+
+def test_samples_outside_window_expire(clock):
+    history = HealthHistory(size=16, window=100, bucket=60)
+    history.record(1, True, 80.0)
+    history.record(1, False)
+    clock.value += 101
+    stats = history.record(1, True)
+
+    assert stats.samples == 1
+    assert stats.success_rate == 100.0
+    assert stats.p50 is None
+
+
+def test_flush_writes_closed_buckets(monkeypatch, clock):
+    fake = patch_session(monkeypatch, history_module)
+    history = HealthHistory(size=16, window=600, bucket=60)
+    history.record(1, True, 40.0)
+    history.record(1, True, 60.0)
+    history.record(1, False)
+    history.record(2, True)
+
+    asyncio.run(history.flush())
+    assert fake.executed == []
+
+    clock.value += 60
+    history.record(1, True)
+    asyncio.run(history.flush())
+
+    # 节点 1 有新结果时结束上一段，节点 2 的段在时间段轮换后由 flush 结束
+    rows = {row["node_id"]: row for row in fake.executed[0]}
+    assert rows[1]["bucket_start"] == datetime.utcfromtimestamp(1_000_020)
+    assert (rows[1]["checks"], rows[1]["successes"], rows[1]["latency_samples"]) == (3, 2, 2)
+    assert (rows[1]["latency_p50"], rows[1]["latency_p99"]) == (40.0, 60.0)
+    assert (rows[2]["checks"], rows[2]["latency_samples"], rows[2]["latency_p50"]) == (1, 0, None)
+
+
+def test_load_restores_history_and_registry_latencies(monkeypatch, clock, registry):
+    registry.replace([make_node(1), make_node(2)])
+    monkeypatch.setattr(history_module, "node_registry", registry)
+
+    def row(node_id, start, checks, successes, samples, p50=None, p95=None, p99=None):
+        return SimpleNamespace(
+            node_id=node_id, bucket_start=datetime.utcfromtimestamp(start), checks=checks,
+            successes=successes, latency_samples=samples,
+            latency_p50=p50, latency_p95=p95, latency_p99=p99,
+        )
+
+    rows = [
+        row(1, 999_900, 10, 8, 0),
+        row(1, 999_960, 10, 10, 20, 50.0, 200.0, 400.0),
+        row(3, 999_960, 5, 5, 1, 30.0, 30.0, 30.0),  # 已不在注册表中的节点
+    ]
+
+    class Session:
+        async def execute(self, stmt, params=None):
+            return SimpleNamespace(all=lambda: rows)
+
+    @contextlib.asynccontextmanager
+    async def get_session():
+        yield Session()
+
+    monkeypatch.setattr(history_module, "get_session", get_session)
+    history = HealthHistory(size=64, window=600, bucket=60)
+
+    assert asyncio.run(history.load()) == 1
+    stats = history.stats(1)
+    assert stats.samples == 20
+    assert stats.success_rate == 90.0
+    assert (stats.p50, stats.p95, stats.p99) == (50.0, 200.0, 400.0)
+    assert history.stats(3) is None
+
+    node = registry.get(1)
+    assert (node.latency_p50, node.latency_p95, node.latency_p99) == (50.0, 200.0, 400.0)
+    assert node.check_success_rate == 90.0
+    assert node.is_healthy and node.success_rate == 100.0
+    assert registry.get(2).latency_p50 is None
+
+    # 恢复的历史与之后的结果一起统计
+    clock.value += 1
+    assert history.record(1, False).samples == 21
+
+
+def test_load_failure_keeps_empty_history(monkeypatch, clock):
+    fake = patch_session(monkeypatch, history_module)
+    fake.fail = True
+    history = HealthHistory(size=16, window=600, bucket=60)
+
+    assert asyncio.run(history.load()) == 0
+    assert len(history) == 0
+
+
+def test_remove_closes_bucket(monkeypatch, clock):
+    fake = patch_session(monkeypatch, history_module)
+    history = HealthHistory(size=16, window=600, bucket=60)
+    history.record(1, True, 40.0)
+    history.remove(1)
+
+    assert history.stats(1) is None
+    asyncio.run(history.flush())
+    assert [row["node_id"] for row in fake.executed[0]] == [1]
@@ -0,0 +1,221 @@
+import asyncio
+
+import pytest
+from conftest import make_node
+
+from ipool.node.registry import NodeSnapshot
+from ipool.protocols import http as http_module
+from ipool.protocols.http import HttpProxyServer, _ClientAborted
+from ipool.protocols.parser import HttpParseError, parse_request_head, parse_response_head
+
+
+class _Writer:
+    """收集写入数据的 StreamWriter 替身，reset 为 True 时模拟对端已断开"""
+    
+    def __init__(self, reset: bool = False):
+        self.data = bytearray()
+        self.reset = reset
+        self.closed = False
+    
+    def write(self, data):
+        self.data += data
+    
+    async def drain(self):
+        if self.reset:
+            raise ConnectionResetError("peer reset")
+    
+    def is_closing(self) -> bool:
+        return self.reset or self.closed
+    
+    def close(self):
+        self.closed = True
+
+
+class _Scheduler:
+    """返回固定节点并记录结果报告的调度器替身"""
+    
+    def __init__(self):
+        self.node = NodeSnapshot(make_node(1))
+        self.reports = []
+    
+    async def next_proxy(self, node_filter=None):
+        return self.node
+    
+    async def report_success(self, proxy_node, connect_time, ttfb=None, bytes_up=0, bytes_down=0):
+        self.reports.append(("success", bytes_down))
+    
+    async def report_failure(self, proxy_node, error, kind=None):
+        self.reports.append(("failure", kind))
+    
+    async def report_aborted(self, proxy_node):
+        self.reports.append(("aborted",))
+
+
+def _forward(response: bytes, method: str = "GET", client_keep_alive: bool = True):
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(response)
+        reader.feed_eof()
+        head = await reader.readuntil(b"\r\n\r\n")
+        writer = _Writer()
+        result = await HttpProxyServer()._forward_response(reader, writer, method, head, client_keep_alive)
+        return result, bytes(writer.data)
+    
+    return asyncio.run(run())
+
+
+def _split(data: bytes):
+    head, _, body = data.partition(b"\r\n\r\n")
+    return parse_response_head(head + b"\r\n\r\n"), body
+
+
+def test_response_hop_by_hop_headers_are_replaced():
+    (framed, reusable, _), data = _forward(
+        b"HTTP/1.1 200 OK\r\nConnection: keep-alive, X-Hop\r\nKeep-Alive: timeout=5\r\n"
+        b"Proxy-Connection: keep-alive\r\nX-Hop: 1\r\nX-End: 2\r\nContent-Length: 5\r\n\r\nhello"
+    )
+    response, body = _split(data)
+    assert (framed, reusable) == (True, True)
+    assert body == b"hello"
+    assert response.get("connection") == "keep-alive"
+    for name in ("keep-alive", "proxy-connection", "x-hop"):
+        assert name not in response
+    assert response.get("x-end") == "2"
+
+
+def test_proxy_declares_close_when_client_connection_ends():
+    (framed, reusable, _), data = _forward(
+        b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok", client_keep_alive=False
+    )
+    response, _ = _split(data)
+    assert framed and reusable
+    assert response.get("connection") == "close"
+
+
+def test_response_without_length_closes_client_connection():
+    (framed, reusable, _), data = _forward(b"HTTP/1.1 200 OK\r\nConnection: keep-alive\r\n\r\nuntil eof")
+    response, body = _split(data)
+    assert (framed, reusable) == (False, False)
+    assert response.get("connection") == "close"
+    assert body == b"until eof"
+
+
+def test_chunked_response_drops_content_length():
+    (framed, _, _), data = _forward(
+        b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\nContent-Length: 100\r\n\r\n"
+        b"5\r\nhello\r\n0\r\n\r\n"
+    )
+    response, body = _split(data)
+    assert framed
+    assert "content-length" not in response
+    assert response.get("transfer-encoding") == "chunked"
+    assert body == b"5\r\nhello\r\n0\r\n\r\n"
+
+
+def test_upgrade_response_is_forwarded_unchanged():
+    raw = b"HTTP/1.1 101 Switching Protocols\r\nConnection: Upgrade\r\nUpgrade: websocket\r\n\r\nframes"
+    (framed, reusable, _), data = _forward(raw)
+    assert (framed, reusable) == (False, False)
+    assert data == raw
+
+
+def test_response_with_non_chunked_transfer_encoding_ends_at_close():
+    (framed, reusable, _), data = _forward(
+        b"HTTP/1.1 200 OK\r\nTransfer-Encoding: gzip\r\nContent-Length: 2\r\n\r\ncompressed body"
+    )
+    response, body = _split(data)
+    assert (framed, reusable) == (False, False)
+    assert "content-length" not in response
+    assert response.get("connection") == "close"
+    assert body == b"compressed body"
+
+
+def _send_body(head: bytes, body: bytes):
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(body)
+        reader.feed_eof()
+        writer = _Writer()
+        sent = await HttpProxyServer()._send_request_body(reader, writer, parse_request_head(head))
+        return sent, bytes(writer.data), await reader.read()
+    
+    return asyncio.run(run())
+
+
+def test_request_body_is_streamed_by_content_length():
+    body = b"x" * 100000
+    sent, data, rest = _send_body(b"POST / HTTP/1.1\r\nContent-Length: 100000\r\n\r\n", body + b"GET /next")
+    assert sent == len(body)
+    assert data == body
+    # 下一个流水线请求留在客户端连接上
+    assert rest == b"GET /next"
+
+
+def test_chunked_request_body_keeps_its_encoding():
+    body = b"5;ext=1\r\nhello\r\n0\r\nX-Trailer: 1\r\n\r\n"
+    sent, data, rest = _send_body(b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n", body)
+    assert (sent, data, rest) == (len(body), body, b"")
+
+
+def test_truncated_request_body_aborts():
+    with pytest.raises(_ClientAborted):
+        _send_body(b"POST / HTTP/1.1\r\nContent-Length: 10\r\n\r\n", b"short")
+    with pytest.raises(HttpParseError):
+        _send_body(b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n", b"zz\r\n")
+
+
+def _proxy_request(monkeypatch, response: bytes, client_reset: bool = False, client=None):
+    """通过替身上游处理一个 GET 请求，返回 (能否继续使用客户端连接, 结果报告)"""
+    async def open_forward(proxy_node, host, port, reuse=True):
+        reader = asyncio.StreamReader()
+        reader.feed_data(response)
+        reader.feed_eof()
+        return reader, _Writer(), True, False
+    
+    monkeypatch.setattr(http_module, "open_forward", open_forward)
+    server = HttpProxyServer()
+    server.scheduler = _Scheduler()
+    request = parse_request_head(b"GET http://example.com/ HTTP/1.1\r\nHost: example.com\r\n\r\n")
+    
+    async def run():
+        return await server._handle_http_request(asyncio.StreamReader(), client or _Writer(client_reset), request)
+    
+    return asyncio.run(run()), server.scheduler.reports
+
+
+def test_completed_response_is_reported_as_success(monkeypatch):
+    keep_alive, reports = _proxy_request(monkeypatch, b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+    assert keep_alive
+    assert reports[0][0] == "success" and reports[0][1] > 0
+
+
+def test_truncated_upstream_response_is_reported_as_failure(monkeypatch):
+    keep_alive, reports = _proxy_request(monkeypatch, b"HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\nshort")
+    assert not keep_alive
+    assert reports == [("failure", http_module.UpstreamError.PROXY)]
+
+
+def test_invalid_upstream_response_is_reported_as_failure(monkeypatch):
+    _, reports = _proxy_request(monkeypatch, b"garbage\r\n\r\n")
+    assert reports == [("failure", http_module.UpstreamError.PROXY)]
+
+
+def test_malformed_upstream_chunk_is_reported_as_failure(monkeypatch):
+    client = _Writer()
+    keep_alive, reports = _proxy_request(
+        monkeypatch, b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n5\r\nhello\r\nZZ\r\n", client=client
+    )
+    data = bytes(client.data)
+    assert not keep_alive
+    assert reports == [("failure", http_module.UpstreamError.PROXY)]
+    # 响应已经开始转发，不能再在后面追加错误响应
+    assert data.endswith(b"5\r\nhello\r\nZZ\r\n")
+    assert b"400 Bad Request" not in data
+
+
+def test_client_disconnect_is_not_blamed_on_the_node(monkeypatch):
+    keep_alive, reports = _proxy_request(
+        monkeypatch, b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok", client_reset=True
+    )
+    assert not keep_alive
+    assert reports == [("aborted",)]
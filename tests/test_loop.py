@@ -0,0 +1,34 @@
+import asyncio
+
+import pytest
+
+from ipool import loop as loop_module
+from ipool.config import settings
+from ipool.loop import LOOP_ASYNCIO, LOOP_UVLOOP, install_event_loop
+
+
+@pytest.fixture(autouse=True)
+def restore_policy():
+    policy = asyncio.get_event_loop_policy()
+    yield
+    asyncio.set_event_loop_policy(policy)
+
+
+@pytest.mark.parametrize("backend", ["asyncio", "unknown"])
+def test_stock_loop_when_requested_or_unknown(monkeypatch, backend):
+    monkeypatch.setattr(settings, "event_loop", backend)
+    assert install_event_loop() == LOOP_ASYNCIO
+
+
+@pytest.mark.parametrize("backend", ["auto", "uvloop"])
+def test_falls_back_without_uvloop(monkeypatch, backend):
+    monkeypatch.setattr(settings, "event_loop", backend)
+    monkeypatch.setattr(loop_module, "uvloop", None)
+    assert install_event_loop() == LOOP_ASYNCIO
+
+
+def test_auto_prefers_uvloop(monkeypatch):
+    uvloop = pytest.importorskip("uvloop")
+    monkeypatch.setattr(settings, "event_loop", "auto")
+    assert install_event_loop() == LOOP_UVLOOP
+    assert isinstance(asyncio.get_event_loop_policy(), uvloop.EventLoopPolicy)
@@ -0,0 +1,129 @@
+import asyncio
+
+import pytest
+
+from ipool.config import settings
+from ipool.protocols import parser
+from ipool.protocols.parser import HttpParseError, parse_response_head, read_request
+
+BACKENDS = [name for name, backend in parser._BACKENDS.items() if backend is not None]
+
+
+@pytest.fixture(params=BACKENDS)
+def parse(request):
+    return parser._BACKENDS[request.param]
+
+
+def _read(data: bytes):
+    async def run():
+        reader = asyncio.StreamReader(limit=settings.http_max_header_size)
+        reader.feed_data(data)
+        reader.feed_eof()
+        return await read_request(reader), reader
+    
+    return asyncio.run(run())
+
+
+def test_backends_parse_request_line_and_headers(parse):
+    request = parse(
+        b"GET http://example.com/a?b=1 HTTP/1.1\r\nHost: example.com\r\n"
+        b"Accept: text/html\r\naccept: text/plain\r\nX-Empty:\r\n\r\n"
+    )
+    assert (request.method, request.target, request.version) == ("GET", "http://example.com/a?b=1", "HTTP/1.1")
+    # 原始大小写和顺序保留，查询按小写名称
+    assert request.headers[:2] == [("Host", "example.com"), ("Accept", "text/html")]
+    assert request.get("accept") == "text/html, text/plain"
+    assert request.get_all("accept") == ["text/html", "text/plain"]
+    assert request.get("x-empty") == ""
+    assert "host" in request and "missing" not in request
+
+
+def test_backends_parse_connect(parse):
+    request = parse(b"CONNECT example.com:443 HTTP/1.1\r\nHost: example.com:443\r\n\r\n")
+    assert (request.method, request.target) == ("CONNECT", "example.com:443")
+    assert request.keep_alive
+
+
+@pytest.mark.parametrize("head", [
+    b"GET /\r\n\r\n",
+    b"GET / HTTP/1.1\r\nBad Header\r\n\r\n",
+    b"GET / HTTP/1.1\r\nHost: a\r\n folded\r\n\r\n",
+])
+def test_backends_reject_malformed_requests(parse, head):
+    with pytest.raises(HttpParseError):
+        parse(head)
+
+
+def test_keep_alive_defaults_by_version(parse):
+    assert parse(b"GET / HTTP/1.1\r\nHost: a\r\n\r\n").keep_alive
+    assert not parse(b"GET / HTTP/1.1\r\nHost: a\r\nConnection: close\r\n\r\n").keep_alive
+    assert not parse(b"GET / HTTP/1.0\r\n\r\n").keep_alive
+    assert parse(b"GET / HTTP/1.0\r\nConnection: Keep-Alive\r\n\r\n").keep_alive
+
+
+def test_content_length_must_be_consistent():
+    request = parser._parse_python(b"POST / HTTP/1.1\r\nContent-Length: 5\r\nContent-Length: 6\r\n\r\n")
+    with pytest.raises(HttpParseError):
+        request.content_length
+    request = parser._parse_python(b"POST / HTTP/1.1\r\nContent-Length: -1\r\n\r\n")
+    with pytest.raises(HttpParseError):
+        request.content_length
+
+
+def test_read_request_handles_pipelined_requests():
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(b"GET /1 HTTP/1.1\r\nHost: a\r\n\r\n\r\nGET /2 HTTP/1.1\r\nHost: a\r\n\r\n")
+        reader.feed_eof()
+        return [await read_request(reader) for _ in range(3)]
+    
+    first, second, end = asyncio.run(run())
+    assert (first.target, second.target, end) == ("/1", "/2", None)
+
+
+def test_read_request_rejects_truncated_head():
+    with pytest.raises(HttpParseError) as excinfo:
+        _read(b"GET / HTTP/1.1\r\nHost: a\r\n")
+    assert excinfo.value.status == 400
+
+
+def test_read_request_enforces_header_limits(monkeypatch):
+    monkeypatch.setattr(settings, "http_max_headers", 3)
+    headers = b"".join(b"X-%d: 1\r\n" % i for i in range(4))
+    with pytest.raises(HttpParseError) as excinfo:
+        _read(b"GET / HTTP/1.1\r\n" + headers + b"\r\n")
+    assert excinfo.value.status == 431
+    
+    monkeypatch.setattr(settings, "http_max_header_size", 64)
+    with pytest.raises(HttpParseError) as excinfo:
+        _read(b"GET / HTTP/1.1\r\nX-Long: " + b"a" * 100 + b"\r\n\r\n")
+    assert excinfo.value.status == 431
+
+
+def test_parse_response_head():
+    response = parse_response_head(b"HTTP/1.1 204 No Content\r\nConnection: close\r\n\r\n")
+    assert response.status == 204
+    assert not response.keep_alive
+    with pytest.raises(HttpParseError) as excinfo:
+        parse_response_head(b"garbage\r\n\r\n")
+    assert excinfo.value.status == 502
+
+
+@pytest.mark.parametrize("headers", [
+    b"Transfer-Encoding: chunked\r\nContent-Length: 5\r\n",
+    b"Transfer-Encoding: chunked, gzip\r\n",
+    b"Transfer-Encoding: chunked\r\nTransfer-Encoding: gzip\r\n",
+    b"Transfer-Encoding: xchunked\r\n",
+])
+def test_read_request_rejects_ambiguous_body_framing(headers):
+    with pytest.raises(HttpParseError) as excinfo:
+        _read(b"POST / HTTP/1.1\r\nHost: a\r\n" + headers + b"\r\n")
+    assert excinfo.value.status == 400
+
+
+def test_chunked_must_be_the_final_coding():
+    request, _ = _read(b"POST / HTTP/1.1\r\nTransfer-Encoding: gzip\r\nTransfer-Encoding: Chunked\r\n\r\n")
+    assert request.transfer_codings == ["gzip", "chunked"]
+    assert request.chunked
+    response = parse_response_head(b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked, gzip\r\n\r\n")
+    assert not response.chunked
@@ -0,0 +1,139 @@
+import asyncio
+
+import pytest
+
+from conftest import FakeProxy, make_node, start_echo_server
+
+from ipool.node.registry import NodeSnapshot
+from ipool.protocols import pool as pool_module
+from ipool.protocols import upstream as upstream_module
+from ipool.protocols.pool import UpstreamPool
+from ipool.protocols.upstream import open_upstream
+
+
+async def _echo_through(node, echo_port: int) -> bytes:
+    reader, writer = await open_upstream(node, "127.0.0.1", echo_port, timeout=5)
+    writer.write(b"ping")
+    await writer.drain()
+    data = await reader.readexactly(4)
+    writer.close()
+    return data
+
+
+needs_socket_handshake = pytest.mark.skipif(
+    not upstream_module._HANDSHAKE_ON_SOCKET,
+    reason="已安装的 python-socks 不支持在传入的 socket 上握手"
+)
+
+
+@needs_socket_handshake
+def test_warm_connections_are_reused(monkeypatch):
+    pool = UpstreamPool(warm_size=1, max_idle=2, idle_ttl=60, maintain_interval=60)
+    monkeypatch.setattr(upstream_module, "upstream_pool", pool)
+    
+    async def run():
+        echo, echo_port = await start_echo_server()
+        proxy = await FakeProxy("socks5").start()
+        pool._running = True
+        try:
+            node = NodeSnapshot(make_node(1, host="127.0.0.1", port=proxy.port))
+            assert await _echo_through(node, echo_port) == b"ping"
+            # 第一次使用后后台补足一个预热连接
+            await asyncio.gather(*pool._tasks)
+            assert len(pool._pools[1].sockets) == 1
+            sock, reused = await pool.connect_socket(node)
+            sock.close()
+            await asyncio.gather(*pool._tasks)
+            return reused, proxy.connections
+        finally:
+            await pool.stop()
+            await proxy.close()
+            echo.close()
+    
+    reused, connections = asyncio.run(run())
+    assert reused
+    # 一次直接连接、两次预热
+    assert connections == 3
+
+
+@needs_socket_handshake
+def test_stale_warm_connection_is_retried_on_a_fresh_one(monkeypatch):
+    pool = UpstreamPool(warm_size=0, idle_ttl=60)
+    monkeypatch.setattr(upstream_module, "upstream_pool", pool)
+    # 代理可能在存活检查之后才关闭空闲连接，这里直接跳过检查
+    monkeypatch.setattr(pool_module, "_socket_alive", lambda sock: True)
+    
+    async def run():
+        echo, echo_port = await start_echo_server()
+        proxy = await FakeProxy("socks5").start()
+        
+        async def close_at_once(reader, writer):
+            writer.close()
+        
+        dead = await asyncio.start_server(close_at_once, "127.0.0.1", 0)
+        try:
+            node = NodeSnapshot(make_node(1, host="127.0.0.1", port=proxy.port))
+            stale_node = NodeSnapshot(make_node(1, host="127.0.0.1", port=dead.sockets[0].getsockname()[1]))
+            stale = await pool.open_socket(stale_node)
+            await asyncio.sleep(0.05)
+            pool._pool(node).sockets.append((stale, pool_module.time.monotonic()))
+            data = await _echo_through(node, echo_port)
+            return data, proxy.connections, len(pool._pools[1].sockets)
+        finally:
+            await pool.stop()
+            await proxy.close()
+            dead.close()
+            echo.close()
+    
+    data, connections, warm = asyncio.run(run())
+    assert data == b"ping"
+    assert connections == 1
+    assert warm == 0
+
+
+def test_keep_alive_checkin_and_checkout(monkeypatch, registry):
+    registry.replace([make_node(1)])
+    monkeypatch.setattr(pool_module, "node_registry", registry)
+    pool = UpstreamPool(warm_size=0, max_idle=1, idle_ttl=60)
+    
+    async def run():
+        echo, echo_port = await start_echo_server()
+        node = registry.get(1)
+        first = await asyncio.open_connection("127.0.0.1", echo_port)
+        second = await asyncio.open_connection("127.0.0.1", echo_port)
+        pool.checkin(node, "key", *first)
+        # 超过 max_idle 时关闭最早归还的连接
+        pool.checkin(node, "key", *second)
+        result = (
+            first[1].is_closing(),
+            pool.checkout(node, "other"),
+            pool.checkout(node, "key") == second,
+            pool.checkout(node, "key"),
+        )
+        second[1].close()
+        echo.close()
+        return result
+    
+    first_closed, other, got_second, empty = asyncio.run(run())
+    assert first_closed
+    assert other is None
+    assert got_second
+    assert empty is None
+
+
+def test_checkin_closes_connections_of_removed_nodes(monkeypatch, registry):
+    monkeypatch.setattr(pool_module, "node_registry", registry)
+    pool = UpstreamPool(warm_size=0, idle_ttl=60)
+    
+    async def run():
+        echo, echo_port = await start_echo_server()
+        reader, writer = await asyncio.open_connection("127.0.0.1", echo_port)
+        node = NodeSnapshot(make_node(1))
+        pool.checkin(node, "key", reader, writer)
+        closed = writer.is_closing()
+        echo.close()
+        return closed, pool.checkout(node, "key")
+    
+    closed, conn = asyncio.run(run())
+    assert closed
+    assert conn is None
@@ -0,0 +1,44 @@
+import asyncio
+import random
+from collections import Counter
+
+from conftest import make_node
+
+from ipool.scheduler.random import AliasTable, RandomScheduler
+
+
+def test_alias_table_follows_weights():
+    random.seed(1)
+    table = AliasTable(["a", "b", "c"], [1, 2, 7])
+    counts = Counter(table.sample() for _ in range(100000))
+    assert abs(counts["a"] / 100000 - 0.1) < 0.01
+    assert abs(counts["b"] / 100000 - 0.2) < 0.01
+    assert abs(counts["c"] / 100000 - 0.7) < 0.01
+
+
+def test_alias_table_never_samples_zero_weight():
+    random.seed(2)
+    table = AliasTable(["a", "b"], [0, 3])
+    assert {table.sample() for _ in range(1000)} == {"b"}
+
+
+def test_alias_table_empty():
+    assert AliasTable([], []).sample() is None
+
+
+def test_weighted_scheduler_rebuilds_only_on_weight_changes(registry):
+    registry.replace([make_node(1, weight=1), make_node(2, weight=3)])
+    scheduler = RandomScheduler(weighted=True)
+    scheduler.registry = registry
+    asyncio.run(scheduler.next_proxy())
+    table = scheduler._alias_table
+    
+    # 与权重无关的变化不重建别名表
+    registry.update_health(1, True, 10.0, 99.0)
+    asyncio.run(scheduler.next_proxy())
+    assert scheduler._alias_table is table
+    
+    registry.upsert(make_node(1, weight=5))
+    asyncio.run(scheduler.next_proxy())
+    assert scheduler._alias_table is not table
+    assert scheduler._table_weights == {1: 5, 2: 3}
@@ -0,0 +1,89 @@
+from conftest import make_node
+
+from ipool.node.registry import JOURNAL_SIZE
+
+
+def test_replace_and_available(registry):
+    registry.replace([make_node(1), make_node(2, is_healthy=False), make_node(3, is_active=False)])
+    assert len(registry) == 3
+    assert [node.id for node in registry.available_nodes()] == [1]
+    assert registry.get(2).available is False
+
+
+def test_upsert_and_remove_keep_available_array_consistent(registry):
+    registry.replace([make_node(i) for i in range(1, 6)])
+    registry.remove(2)
+    registry.upsert(make_node(4, is_healthy=False))
+    registry.upsert(make_node(6))
+    assert sorted(node.id for node in registry.available_nodes()) == [1, 3, 5, 6]
+    assert registry.get(2) is None
+    # 被删除节点的槽位可以被复用
+    assert registry.get(6).slot == 1
+
+
+def test_update_health_moves_node_out_of_available(registry):
+    registry.replace([make_node(1), make_node(2)])
+    registry.update_health(1, False, 10000, 50.0)
+    assert [node.id for node in registry.available_nodes()] == [2]
+    assert registry.get(1).check_success_rate == 50.0
+
+
+def test_changed_since_tracks_updates(registry):
+    registry.replace([make_node(1), make_node(2)])
+    version = registry.version
+    assert registry.changed_since(version) == set()
+    registry.update_health(1, True, 20.0, 100.0)
+    registry.remove(2)
+    assert registry.changed_since(version) == {1, 2}
+    assert registry.changed_since(registry.version) == set()
+
+
+def test_changed_since_returns_none_after_truncation(registry):
+    registry.replace([make_node(1)])
+    version = registry.version
+    for _ in range(JOURNAL_SIZE + 1):
+        registry.update_health(1, True, 20.0, 100.0)
+    assert registry.changed_since(version) is None
+
+
+def test_replace_keeps_connection_counts(registry):
+    registry.replace([make_node(1)])
+    registry.get(1).current_connections = 7
+    registry.replace([make_node(1)])
+    assert registry.get(1).current_connections == 7
+
+
+def test_listeners_are_notified(registry):
+    calls = []
+    registry.add_listener(lambda: calls.append(registry.version))
+    registry.replace([make_node(1)])
+    registry.update_health(1, False, 10000, 0.0)
+    assert len(calls) == 2
+
+
+def test_bitmap_match_intersects_dimensions(registry):
+    registry.replace([
+        make_node(1, country="US", tags="premium, fast", protocol="http"),
+        make_node(2, country="us", tags="premium", protocol="socks5"),
+        make_node(3, country="JP", tags="Premium", protocol="http"),
+        make_node(4, country="US", tags="premium", is_healthy=False),
+    ])
+    assert sorted(registry.ids_in(registry.match(country="US", tags=["premium"]))) == [1, 2]
+    assert registry.ids_in(registry.match(country="US", protocol="http", tags=["fast"])) == [1]
+    assert sorted(registry.ids_in(registry.match(tags=["PREMIUM"], available_only=False))) == [1, 2, 3, 4]
+    assert registry.match(country="FR") == 0
+    assert sorted(registry.ids_in(registry.match())) == [1, 2, 3]
+
+
+def test_bitmaps_follow_updates_and_removal(registry):
+    registry.replace([make_node(1, country="US", tags="a"), make_node(2, country="US", tags="a")])
+    registry.upsert(make_node(1, country="JP", tags="b"))
+    registry.remove(2)
+    assert registry.bitmap("country", "us") == 0
+    assert registry.bitmap("tag", "a") == 0
+    assert registry.ids_in(registry.match(country="JP", tags=["b"])) == [1]
+    assert registry.ids_in(registry.match(country="JP")) == [1]
+    
+    # 复用的槽位不会继承旧节点的索引键
+    registry.upsert(make_node(3))
+    assert registry.ids_in(registry.match(tags=["a"])) == []
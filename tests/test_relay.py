@@ -0,0 +1,190 @@
+import asyncio
+import hashlib
+import os
+import socket
+import sys
+
+import pytest
+
+from conftest import start_echo_server
+
+from ipool.config import settings
+from ipool.protocols import relay as relay_module
+from ipool.protocols.relay import AdaptiveBuffer, relay, tune_connection
+
+PAYLOAD_SIZE = 8 * 1024 * 1024
+
+
+def _shrink_buffers(writer):
+    # 发送缓冲区较小时 transport.write 经常只能发出一部分，剩余数据进入 transport 的写队列
+    sock = writer.get_extra_info("socket")
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 32768)
+
+
+async def _slow_echo(reader, writer):
+    """小块读取的回显，比转发慢，让两条转发连接都持续处于背压状态"""
+    _shrink_buffers(writer)
+    while True:
+        data = await reader.read(4096)
+        if not data:
+            break
+        writer.write(data)
+        await writer.drain()
+        await asyncio.sleep(0)
+    writer.write_eof()
+    await writer.drain()
+    writer.close()
+
+
+async def _relay_roundtrip(payload: bytes) -> bytes:
+    echo = await asyncio.start_server(_slow_echo, "127.0.0.1", 0)
+    echo_port = echo.sockets[0].getsockname()[1]
+    relays = []
+    
+    async def handle(client_reader, client_writer):
+        upstream_reader, upstream_writer = await asyncio.open_connection("127.0.0.1", echo_port)
+        for writer in (client_writer, upstream_writer):
+            _shrink_buffers(writer)
+        relays.append(await relay(client_reader, client_writer, upstream_reader, upstream_writer))
+    
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        _shrink_buffers(writer)
+        
+        async def send():
+            view = memoryview(payload)
+            for i in range(0, len(view), 65536):
+                writer.write(view[i:i + 65536])
+                await writer.drain()
+            writer.write_eof()
+        
+        sender = asyncio.create_task(send())
+        received = await asyncio.wait_for(reader.read(-1), 60)
+        await sender
+        writer.close()
+        return received
+    finally:
+        server.close()
+        echo.close()
+
+
+@pytest.mark.parametrize("splice", [False, True])
+def test_relay_preserves_large_payload_under_backpressure(monkeypatch, splice):
+    if splice and not relay_module.HAS_SPLICE:
+        pytest.skip("当前平台不支持 splice")
+    monkeypatch.setattr(settings, "relay_splice", splice)
+    monkeypatch.setattr(settings, "relay_buffer_min", 1024)
+    monkeypatch.setattr(settings, "relay_buffer_max", 16384)
+    payload = os.urandom(PAYLOAD_SIZE)
+    received = asyncio.run(_relay_roundtrip(payload))
+    assert len(received) == len(payload)
+    assert hashlib.sha256(received).digest() == hashlib.sha256(payload).digest()
+
+
+def test_relay_forwards_data_buffered_before_the_handoff(monkeypatch):
+    """握手阶段已读入 StreamReader 的数据要先转发出去（不依赖 StreamReader 的内部结构）"""
+    monkeypatch.setattr(settings, "relay_splice", False)
+    
+    async def run():
+        echo = await asyncio.start_server(_slow_echo, "127.0.0.1", 0)
+        echo_port = echo.sockets[0].getsockname()[1]
+        
+        async def handle(client_reader, client_writer):
+            # 等到客户端的全部数据都已进入 StreamReader 再开始转发
+            await client_reader.readexactly(5)
+            await asyncio.sleep(0.1)
+            upstream_reader, upstream_writer = await asyncio.open_connection("127.0.0.1", echo_port)
+            await relay(client_reader, client_writer, upstream_reader, upstream_writer)
+        
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.sockets[0].getsockname()[1])
+        writer.write(b"hello early data")
+        writer.write_eof()
+        received = await asyncio.wait_for(reader.read(-1), 10)
+        writer.close()
+        server.close()
+        echo.close()
+        return received
+    
+    assert asyncio.run(run()) == b" early data"
+
+
+def test_take_buffered_drains_reader_over_its_limit():
+    """StreamReader 超过 limit 自行暂停过读取时，取出数据后 transport 仍保持暂停"""
+    
+    async def run():
+        drained = asyncio.get_running_loop().create_future()
+        
+        async def handle(reader, writer):
+            await reader.readexactly(1)
+            await asyncio.sleep(0.1)
+            transport = writer.transport
+            transport.pause_reading()
+            data, eof = await relay_module._take_buffered(reader, transport)
+            drained.set_result((data, eof, transport.is_reading()))
+            writer.close()
+        
+        server = await asyncio.start_server(handle, "127.0.0.1", 0, limit=1024)
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.sockets[0].getsockname()[1])
+        writer.write(b"x" + b"y" * 10000)
+        await writer.drain()
+        result = await asyncio.wait_for(drained, 10)
+        writer.close()
+        server.close()
+        return result
+    
+    data, eof, reading = asyncio.run(run())
+    version = sys.version.split()[0]
+    assert data and set(data) == {ord("y")}, version
+    assert not eof, version
+    assert not reading, version
+
+
+def test_adaptive_buffer_grows_and_shrinks():
+    buffer = AdaptiveBuffer(1024, 8192)
+    for _ in range(4):
+        buffer.record(buffer.size)
+    assert buffer.size == 8192
+    for _ in range(AdaptiveBuffer.SHRINK_AFTER):
+        buffer.record(10)
+    assert buffer.size == 4096
+
+
+def test_adaptive_buffer_stays_within_bounds():
+    buffer = AdaptiveBuffer(1024, 4096)
+    for _ in range(10):
+        buffer.record(buffer.size)
+    assert buffer.size == 4096
+    for _ in range(10 * AdaptiveBuffer.SHRINK_AFTER):
+        buffer.record(0)
+    assert buffer.size == 1024
+    assert len(buffer.view()) == 1024
+
+
+def test_tune_connection_applies_socket_settings(monkeypatch):
+    monkeypatch.setattr(settings, "tcp_nodelay", True)
+    monkeypatch.setattr(settings, "relay_sndbuf", 65536)
+    monkeypatch.setattr(settings, "relay_rcvbuf", 0)
+    
+    async def run():
+        server, port = await start_echo_server()
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        sock = writer.get_extra_info("socket")
+        rcvbuf = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        tune_connection(writer)
+        result = (
+            sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY),
+            sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF),
+            sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) == rcvbuf,
+        )
+        writer.close()
+        server.close()
+        return result
+    
+    nodelay, sndbuf, rcvbuf_unchanged = asyncio.run(run())
+    assert nodelay
+    # Linux 会把设置值翻倍以容纳簿记开销
+    assert sndbuf >= 65536
+    assert rcvbuf_unchanged
@@ -0,0 +1,76 @@
+import asyncio
+import random
+from collections import Counter
+
+from conftest import make_node
+
+from ipool.scheduler.heap import IndexedHeap
+from ipool.scheduler.random import RandomScheduler
+from ipool.scheduler.round_robin import RoundRobinScheduler
+
+
+def _pick(scheduler, count):
+    picks = []
+    for _ in range(count):
+        node = asyncio.run(scheduler.next_proxy())
+        picks.append(node.id if node else None)
+        if node is not None:
+            scheduler._release(node)
+    return picks
+
+
+def test_indexed_heap_matches_sorted_order():
+    random.seed(3)
+    heap = IndexedHeap()
+    keys = {}
+    for i in range(200):
+        keys[i] = random.random()
+        heap.push(i, keys[i])
+    for i in random.sample(range(200), 50):
+        keys[i] = random.random()
+        heap.update(i, keys[i])
+    for i in random.sample(range(200), 50):
+        heap.remove(i)
+        del keys[i]
+    order = []
+    while len(heap):
+        item_id, key = heap.peek()
+        assert key == keys[item_id]
+        order.append(item_id)
+        heap.remove(item_id)
+    assert order == sorted(keys, key=keys.get)
+
+
+def test_smooth_round_robin_interleaves_by_weight(registry):
+    registry.replace([make_node(1, weight=5), make_node(2, weight=1), make_node(3, weight=1)])
+    scheduler = RoundRobinScheduler()
+    scheduler.registry = registry
+    picks = _pick(scheduler, 70)
+    assert Counter(picks) == {1: 50, 2: 10, 3: 10}
+    # 平滑轮询不会连续选择同一个低权重节点
+    assert all(picks[i:i + 2] != [2, 2] for i in range(len(picks) - 1))
+
+
+def test_least_conn_prefers_lowest_relative_load(registry):
+    registry.replace([make_node(1, weight=2), make_node(2, weight=1)])
+    scheduler = RoundRobinScheduler(mode=RoundRobinScheduler.MODE_LEAST_CONN)
+    scheduler.registry = registry
+    held = [asyncio.run(scheduler.next_proxy()) for _ in range(3)]
+    assert Counter(node.id for node in held) == {1: 2, 2: 1}
+
+
+def test_weight_zero_is_excluded_by_all_weighted_schedulers(registry):
+    registry.replace([make_node(1, weight=0), make_node(2, weight=1)])
+    for scheduler in (
+        RoundRobinScheduler(),
+        RoundRobinScheduler(mode=RoundRobinScheduler.MODE_LEAST_CONN),
+        RandomScheduler(weighted=True),
+    ):
+        scheduler.registry = registry
+        assert set(_pick(scheduler, 20)) == {2}
+    
+    # 只有权重为 0 的节点时没有可选节点
+    registry.upsert(make_node(2, weight=0))
+    for scheduler in (RoundRobinScheduler(), RandomScheduler(weighted=True)):
+        scheduler.registry = registry
+        assert _pick(scheduler, 1) == [None]
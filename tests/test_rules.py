@@ -0,0 +1,92 @@
+import random
+
+import pytest
+from conftest import make_node
+
+from ipool.node.registry import NodeSnapshot
+from ipool.scheduler.rules import NodeColumns, RuleSyntaxError, _ListOps, _NumpyOps, compile_condition, np
+
+CONDITIONS = [
+    "node.response_time < 100 and node.success_rate > 90",
+    "node.country in ('US', 'JP')",
+    "node.country not in ['US']",
+    "'premium' in (node.tags or '')",
+    "not node.is_healthy or node.weight >= 3",
+    "10 < node.response_time * 2 <= 300",
+    "-node.weight + 5 > 2",
+    "node.current_connections / node.max_connections < 0.5",
+    "node.weight / 0 > 1",
+    "node.protocol == 'http'",
+    "node.latency_p99 < 500",
+    "node.latency_p50 >= 100 or node.weight > 4",
+    "not node.latency_p95 > 200",
+]
+
+
+def _nodes(count=60):
+    rng = random.Random(5)
+    nodes = []
+    for i in range(count):
+        node = NodeSnapshot(make_node(
+            i,
+            response_time=rng.uniform(0, 300),
+            success_rate=rng.uniform(50, 100),
+            weight=rng.randint(0, 5),
+            max_connections=rng.choice([0, 10, 100]),
+            country=rng.choice(["US", "JP", "DE", None]),
+            tags=rng.choice(["premium,fast", "cheap", None]),
+            protocol=rng.choice(["http", "socks5"]),
+            is_healthy=rng.random() < 0.8,
+        ))
+        node.current_connections = rng.randint(0, 20)
+        if rng.random() < 0.7:
+            node.latency_p50, node.latency_p95, node.latency_p99 = sorted(rng.uniform(20, 900) for _ in range(3))
+        nodes.append(node)
+    return nodes
+
+
+@pytest.mark.parametrize("condition", CONDITIONS)
+def test_list_ops_evaluate(condition):
+    nodes = _nodes()
+    mask = compile_condition(condition).evaluate(NodeColumns(nodes, ops=_ListOps))
+    assert len(mask) == len(nodes)
+
+
+@pytest.mark.skipif(np is None, reason="NumPy 未安装")
+@pytest.mark.parametrize("condition", CONDITIONS)
+def test_numpy_and_list_ops_agree(condition):
+    nodes = _nodes()
+    rule = compile_condition(condition)
+    expected = rule.evaluate(NodeColumns(nodes, ops=_ListOps))
+    with np.errstate(all="raise"):
+        actual = rule.evaluate(NodeColumns(nodes, ops=_NumpyOps)).tolist()
+    assert actual == expected
+
+
+def test_division_by_zero_never_matches():
+    nodes = [NodeSnapshot(make_node(1, max_connections=0))]
+    rule = compile_condition("node.current_connections / node.max_connections < 1")
+    assert rule.evaluate(NodeColumns(nodes, ops=_ListOps)) == [False]
+
+
+@pytest.mark.parametrize("ops", [_ListOps] + ([_NumpyOps] if np is not None else []))
+@pytest.mark.parametrize("condition", ["node.latency_p99 < 500", "node.latency_p99 > 500", "node.latency_p50 == 0"])
+def test_missing_latency_never_matches(ops, condition):
+    # 没有延迟历史的节点不能因为缺省值而满足延迟条件
+    nodes = [NodeSnapshot(make_node(1))]
+    mask = compile_condition(condition).evaluate(NodeColumns(nodes, ops=ops))
+    assert list(mask) == [False]
+
+
+@pytest.mark.parametrize("condition", [
+    "__import__('os')",
+    "node.__class__",
+    "node.missing > 1",
+    "other.weight > 1",
+    "node.weight ** 2",
+    "[x for x in (1, 2)]",
+    "node.weight >",
+])
+def test_rejects_unsafe_or_invalid_rules(condition):
+    with pytest.raises(RuleSyntaxError):
+        compile_condition(condition)
@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+from conftest import make_node, patch_session
+
+from ipool.health import checker as checker_module
+from ipool.health import history as history_module
+from ipool.health import schedule as schedule_module
+from ipool.health import writer as writer_module
+from ipool.health.checker import HealthChecker
+from ipool.health.engine import HealthCheckEngine
+from ipool.health.history import HealthHistory
+from ipool.health.schedule import FAILURE_BACKOFF, STABLE_GROWTH, CheckSchedule
+from ipool.node.models import HealthCheckResult
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+    
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = _Clock()
+    monkeypatch.setattr(schedule_module.time, "monotonic", fake)
+    monkeypatch.setattr(schedule_module, "JITTER", 0)
+    return fake
+
+
+def test_initial_checks_are_spread_over_one_interval(clock):
+    schedule = CheckSchedule(interval=100, min_interval=10, max_interval=1000)
+    schedule.add_spread(range(10))
+    assert schedule.pop_due(100) == [0]
+    clock.now += 50
+    assert schedule.pop_due(100) == [1, 2, 3, 4, 5]
+    # 取出的节点在记录结果之前不会再次到期
+    clock.now += 1000
+    assert schedule.pop_due(100) == [6, 7, 8, 9]
+    assert schedule.pop_due(100) == []
+
+
+def test_intervals_adapt_to_node_state(clock):
+    schedule = CheckSchedule(interval=100, min_interval=10, max_interval=400)
+    schedule.add_spread([1])
+    schedule.pop_due(1)
+    
+    schedule.record(1, True)
+    assert schedule.interval_of(1) == 100 * STABLE_GROWTH
+    for _ in range(10):
+        schedule.record(1, True)
+    assert schedule.interval_of(1) == 400
+    
+    # 状态变化后尽快复查，持续失败时指数退避
+    schedule.record(1, False)
+    assert schedule.interval_of(1) == 10
+    schedule.record(1, False)
+    assert schedule.interval_of(1) == 10 * FAILURE_BACKOFF
+    schedule.record(1, True)
+    assert schedule.interval_of(1) == 10
+
+
+def test_removed_and_rescheduled_entries_are_discarded(clock):
+    schedule = CheckSchedule(interval=100, min_interval=10, max_interval=400)
+    schedule.add_spread([1, 2, 3])
+    schedule.remove(2)
+    clock.now += 100
+    assert schedule.pop_due(10) == [1, 3]
+    schedule.postpone(1)
+    schedule.postpone(1)
+    clock.now += 100
+    assert schedule.pop_due(10) == [1]
+    assert len(schedule) == 2
+
+
+def test_full_checks_follow_full_interval(clock):
+    schedule = CheckSchedule(interval=100, min_interval=10, max_interval=400, full_interval=1000)
+    schedule.add_spread([1])
+    assert schedule.needs_full_check(1)
+    schedule.record(1, True, full=True)
+    clock.now += 500
+    assert not schedule.needs_full_check(1)
+    schedule.record(1, True, full=False)
+    clock.now += 600
+    assert schedule.needs_full_check(1)
+
+
+def test_slow_node_does_not_hold_back_other_checks(monkeypatch, registry):
+    registry.replace([make_node(i) for i in range(1, 5)])
+    monkeypatch.setattr(checker_module, "node_registry", registry)
+    patch_session(monkeypatch, writer_module)
+    patch_session(monkeypatch, history_module)
+    
+    checker = HealthChecker()
+    checker.engine = HealthCheckEngine("http://127.0.0.1/", timeout=5, concurrency=2)
+    checker.schedule = CheckSchedule(interval=0.02, min_interval=0.02, max_interval=0.02, full_interval=0)
+    checker.history = HealthHistory(size=16, window=60, bucket=60)
+    checks = []
+    
+    async def check(node):
+        checks.append(node.id)
+        await asyncio.sleep(0.6 if node.id == 1 else 0.01)
+        return HealthCheckResult(success=True, response_time=1)
+    
+    checker.engine.check = check
+    
+    async def run():
+        task = asyncio.create_task(checker.start())
+        await asyncio.sleep(0.4)
+        await checker.stop()
+        await asyncio.wait_for(task, 5)
+    
+    asyncio.run(run())
+    # 慢节点占用一个任务期间，另一个任务继续检查其余到期的节点
+    assert checks.count(1) == 1
+    assert len(checks) - 1 >= 10
+    assert checker._in_flight == set()
+    # 中途停止时仍在检查的节点按原间隔重新安排
+    assert checker.schedule.next_due() is not None
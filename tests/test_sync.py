@@ -0,0 +1,62 @@
+import asyncio
+from multiprocessing import Pipe
+
+from conftest import make_node
+
+from ipool.node.registry import NodeRegistry
+from ipool.node.sync import RegistryPublisher, RegistrySubscriber
+
+
+async def _settle(condition, timeout: float = 5):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, "注册表未同步"
+        await asyncio.sleep(0.01)
+
+
+def test_worker_registry_follows_control_registry(registry):
+    registry.replace([make_node(1), make_node(2)])
+    worker_registry = NodeRegistry()
+    
+    async def run():
+        publisher = RegistryPublisher(registry)
+        receiving, sending = Pipe(duplex=False)
+        publisher.attach(1, sending)
+        subscriber = RegistrySubscriber(receiving, worker_registry)
+        await asyncio.wait_for(subscriber.start(), 5)
+        assert sorted(node.id for node in worker_registry.nodes()) == [1, 2]
+        
+        # 同一轮事件循环内的多次变更合并推送
+        registry.update_health(1, False, 10000, 50.0)
+        registry.remove(2)
+        registry.upsert(make_node(3, country="JP"))
+        await _settle(lambda: worker_registry.get(3) is not None and worker_registry.get(2) is None)
+        
+        publisher.detach(1)
+        await asyncio.wait_for(subscriber.wait_closed(), 5)
+    
+    asyncio.run(run())
+    assert [node.id for node in worker_registry.available_nodes()] == [3]
+    assert worker_registry.get(1).check_success_rate == 50.0
+    assert worker_registry.ids_in(worker_registry.bitmap("country", "JP")) == [3]
+
+
+def test_truncated_journal_falls_back_to_full_snapshot(registry, monkeypatch):
+    registry.replace([make_node(1)])
+    worker_registry = NodeRegistry()
+    
+    async def run():
+        publisher = RegistryPublisher(registry)
+        receiving, sending = Pipe(duplex=False)
+        publisher.attach(1, sending)
+        subscriber = RegistrySubscriber(receiving, worker_registry)
+        await asyncio.wait_for(subscriber.start(), 5)
+        
+        monkeypatch.setattr(registry, "changed_since", lambda version: None)
+        registry.upsert(make_node(2))
+        await _settle(lambda: worker_registry.get(2) is not None)
+        publisher.detach(1)
+    
+    asyncio.run(run())
+    assert sorted(node.id for node in worker_registry.nodes()) == [1, 2]
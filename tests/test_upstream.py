@@ -0,0 +1,38 @@
+import asyncio
+
+import pytest
+from conftest import FakeProxy, make_node, start_echo_server
+
+from ipool.node.registry import NodeSnapshot
+from ipool.protocols.upstream import UpstreamError, open_upstream
+
+
+async def _roundtrip(protocol: str, reuse: bool = False) -> bytes:
+    echo, echo_port = await start_echo_server()
+    proxy = await FakeProxy(protocol).start()
+    try:
+        node = NodeSnapshot(make_node(1, host="127.0.0.1", port=proxy.port, protocol=protocol))
+        reader, writer = await open_upstream(node, "127.0.0.1", echo_port, timeout=5, reuse=reuse)
+        writer.write(b"ping")
+        await writer.drain()
+        data = await reader.readexactly(4)
+        writer.close()
+        return data
+    finally:
+        await proxy.close()
+        echo.close()
+
+
+@pytest.mark.parametrize("protocol", ["socks5", "http"])
+def test_open_upstream_tunnels_through_node(protocol):
+    assert asyncio.run(_roundtrip(protocol)) == b"ping"
+
+
+def test_open_upstream_reports_unreachable_node():
+    async def run():
+        node = NodeSnapshot(make_node(1, host="127.0.0.1", port=1, protocol="socks5"))
+        await open_upstream(node, "127.0.0.1", 80, timeout=2, reuse=False)
+    
+    with pytest.raises(UpstreamError) as excinfo:
+        asyncio.run(run())
+    assert excinfo.value.kind in (UpstreamError.REFUSED, UpstreamError.UNREACHABLE, UpstreamError.PROXY)
@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+from conftest import make_node, patch_session
+
+from ipool.health import writer as writer_module
+from ipool.health.writer import MAX_WRITE_ATTEMPTS, HealthResultWriter, result_changes
+
+
+@pytest.fixture
+def session(monkeypatch):
+    return patch_session(monkeypatch, writer_module)
+
+
+def test_rows_are_grouped_by_changed_columns(session):
+    writer = HealthResultWriter(batch_size=3)
+    
+    async def run():
+        await writer.add(1, {"last_check": 1, "is_healthy": False})
+        await writer.add(2, {"last_check": 1})
+        await writer.add(3, {"last_check": 1, "is_healthy": True})
+    
+    asyncio.run(run())
+    assert writer.written == 3 and len(writer) == 0
+    assert sorted(session.executed, key=len) == [
+        [{"node_id": 2, "new_last_check": 1}],
+        [
+            {"node_id": 1, "new_is_healthy": False, "new_last_check": 1},
+            {"node_id": 3, "new_is_healthy": True, "new_last_check": 1},
+        ],
+    ]
+
+
+def test_failed_batch_is_retried_with_newer_values_merged(session):
+    writer = HealthResultWriter(batch_size=100)
+    
+    async def run():
+        await writer.add(1, {"last_check": 1, "is_healthy": False})
+        session.fail = True
+        await writer.flush()
+        # 写回失败后加入的新结果覆盖旧值，旧批次中的其他变化列保留
+        await writer.add(1, {"last_check": 2, "response_time": 10.0})
+        session.fail = False
+        await writer.flush()
+    
+    asyncio.run(run())
+    assert session.executed == [
+        [{"node_id": 1, "new_is_healthy": False, "new_response_time": 10.0, "new_last_check": 2}],
+    ]
+    assert writer.written == 1 and writer.dropped == 0
+
+
+def test_full_batch_waits_before_retrying(session):
+    writer = HealthResultWriter(batch_size=1)
+    session.fail = True
+    
+    async def run():
+        await writer.add(1, {"last_check": 1})
+        # 失败后批满也不立即重试
+        session.fail = False
+        await writer.add(2, {"last_check": 1})
+    
+    asyncio.run(run())
+    assert session.executed == []
+    assert len(writer) == 2
+
+
+def test_results_are_dropped_after_bounded_attempts(session):
+    writer = HealthResultWriter(batch_size=100)
+    session.fail = True
+    
+    async def run():
+        await writer.add(1, {"last_check": 1})
+        for _ in range(MAX_WRITE_ATTEMPTS):
+            await writer.flush()
+    
+    asyncio.run(run())
+    assert len(writer) == 0
+    assert writer.dropped == 1
+
+
+def test_result_changes_only_include_changed_columns():
+    node = make_node(1, is_healthy=True, response_time=50.0, check_success_rate=100.0)
+    assert set(result_changes(node, True, 50.0, 100.0)) == {"last_check"}
+    assert set(result_changes(node, False, 10000, 90.0)) == {"last_check", "is_healthy", "response_time", "check_success_rate"}